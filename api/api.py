@@ -10,8 +10,10 @@ Endpoints:
 - GET /events - Fetch upcoming community events for dashboard
 """
 
+import re
 import sys
 import uuid
+import threading
 import datetime
 from pathlib import Path
 from typing import Any, Dict, List, Optional
@@ -45,6 +47,7 @@ _session_caches: Dict[str, Dict[str, Any]] = {}
 # Cache settings
 _CACHE_MAX_SESSIONS = 100  # Max number of sessions to keep in cache
 _CACHE_MAX_AGE_MINUTES = 60  # Max age of cache before considered stale
+_HISTORY_MAX_MESSAGES = 20  # Most history the chat pipeline ever reads back
 
 
 def _cleanup_old_caches():
@@ -111,6 +114,24 @@ CORS(
 )
 
 
+# =============================================================================
+# SQL Pipeline Warm-up
+# =============================================================================
+def _warm_sql_pipeline():
+    """Load table metadata and embed the tables catalog before the first SQL question arrives."""
+    try:
+        import main_chat.sql_pipeline.sql_retrieval as sql_retrieval
+
+        sql_retrieval._warm_metadata_cache()
+    except Exception as e:
+        print(f"Error warming SQL pipeline caches: {e}")
+
+
+# In the background so startup (and each gunicorn worker) isn't held up by Gemini
+if config.GEMINI_API_KEY:
+    threading.Thread(target=_warm_sql_pipeline, name="warm-sql-pipeline", daemon=True).start()
+
+
 # =============================================================================
 # Database Connection
 # =============================================================================
@@ -179,94 +200,69 @@ def before_request_handler():
 # =============================================================================
 # Helper Functions
 # =============================================================================
-def extract_sources(mode: str, result: Dict[str, Any]) -> List[Dict[str, str]]:
-    """Extract source citations from the result based on mode."""
+_SQL_FROM_RE = re.compile(r"FROM\s+`?(\w+)`?", re.IGNORECASE)
+
+
+def _sql_sources(sql_query: str) -> List[Dict[str, str]]:
+    """Cite the first table in the SQL's FROM clause."""
+    match = _SQL_FROM_RE.search(sql_query) if sql_query else None
+    return [{"type": "sql", "table": match.group(1)}] if match else []
+
+
+def _rag_sources(metadata: List[Dict[str, Any]], policy_limit: int, slots: int) -> List[Dict[str, str]]:
+    """Cite RAG documents, policies first, deduplicated by source and doc_type."""
     sources = []
+    seen = set()
 
-    if mode == "sql":
-        # Extract table name from SQL result
-        sql_query = result.get("sql", "")
-        if sql_query:
-            # Simple extraction - look for FROM clause
-            import re
-
-            match = re.search(r"FROM\s+`?(\w+)`?", sql_query, re.IGNORECASE)
-            if match:
-                sources.append({"type": "sql", "table": match.group(1)})
-
-    elif mode == "rag":
-        # Extract from RAG metadata
-        metadata = result.get("metadata", [])
-        seen = set()
-
-        # PRIORITIZE POLICY SOURCES FIRST
-        # Split metadata by doc_type
-        policy_meta = [m for m in metadata if m.get("doc_type") == "policy"]
-        other_meta = [m for m in metadata if m.get("doc_type") != "policy"]
-
-        # Process policy sources first (up to 3)
-        for meta in policy_meta[:5]:
-            source = meta.get("source", "Unknown")
-            doc_type = meta.get("doc_type", "unknown")
-            key = f"{source}:{doc_type}"
-            if key not in seen:
-                seen.add(key)
-                sources.append({"type": "rag", "source": source, "doc_type": doc_type})
+    # PRIORITIZE POLICY SOURCES FIRST
+    policy_meta = [m for m in metadata if m.get("doc_type") == "policy"]
+    other_meta = [m for m in metadata if m.get("doc_type") != "policy"]
 
-        # Then add other sources (transcripts, etc.) to fill remaining slots
-        remaining_slots = 10 - len(sources)
-        for meta in other_meta[:remaining_slots]:
+    def _add(metas):
+        for meta in metas:
             source = meta.get("source", "Unknown")
             doc_type = meta.get("doc_type", "unknown")
-            key = f"{source}:{doc_type}"
+            key = (source, doc_type)
             if key not in seen:
                 seen.add(key)
                 sources.append({"type": "rag", "source": source, "doc_type": doc_type})
 
-    elif mode == "hybrid":
-        # Combine SQL and RAG sources
-        sql_part = result.get("sql", {})
-        rag_part = result.get("rag", {})
+    _add(policy_meta[:policy_limit])
+    # Then other sources (transcripts, etc.) fill the remaining slots
+    _add(other_meta[: slots - len(sources)])
+    return sources
 
-        # SQL source
-        sql_query = sql_part.get("sql", "") if isinstance(sql_part, dict) else ""
-        if sql_query:
-            import re
 
-            match = re.search(r"FROM\s+`?(\w+)`?", sql_query, re.IGNORECASE)
-            if match:
-                sources.append({"type": "sql", "table": match.group(1)})
+def _sources_for_sql(result: Dict[str, Any]) -> List[Dict[str, str]]:
+    return _sql_sources(result.get("sql", ""))
 
-        # RAG sources - prioritize policies
-        rag_metadata = rag_part.get("metadata", []) if isinstance(rag_part, dict) else []
-        seen = set()
 
-        # Split by doc_type
-        policy_meta = [m for m in rag_metadata if m.get("doc_type") == "policy"]
-        other_meta = [m for m in rag_metadata if m.get("doc_type") != "policy"]
+def _sources_for_rag(result: Dict[str, Any]) -> List[Dict[str, str]]:
+    return _rag_sources(result.get("metadata", []), policy_limit=5, slots=10)
 
-        # Add policy sources first (up to 2 in hybrid mode)
-        for meta in policy_meta[:4]:
-            source = meta.get("source", "Unknown")
-            doc_type = meta.get("doc_type", "unknown")
-            key = f"{source}:{doc_type}"
-            if key not in seen:
-                seen.add(key)
-                sources.append({"type": "rag", "source": source, "doc_type": doc_type})
-
-        # Then other sources
-        remaining_slots = 8 - len(sources)
-        for meta in other_meta[:remaining_slots]:
-            source = meta.get("source", "Unknown")
-            doc_type = meta.get("doc_type", "unknown")
-            key = f"{source}:{doc_type}"
-            if key not in seen:
-                seen.add(key)
-                sources.append({"type": "rag", "source": source, "doc_type": doc_type})
 
+def _sources_for_hybrid(result: Dict[str, Any]) -> List[Dict[str, str]]:
+    sql_part = result.get("sql")
+    rag_part = result.get("rag")
+    sources = _sql_sources(sql_part.get("sql", "") if isinstance(sql_part, dict) else "")
+    rag_metadata = rag_part.get("metadata", []) if isinstance(rag_part, dict) else []
+    sources += _rag_sources(rag_metadata, policy_limit=4, slots=8 - len(sources))
     return sources
 
 
+_SOURCE_EXTRACTORS = {
+    "sql": _sources_for_sql,
+    "rag": _sources_for_rag,
+    "hybrid": _sources_for_hybrid,
+}
+
+
+def extract_sources(mode: str, result: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Extract source citations from the result based on mode."""
+    extractor = _SOURCE_EXTRACTORS.get(mode)
+    return extractor(result) if extractor else []
+
+
 def log_interaction(
     session_id: str,
     client_query: str,
@@ -348,7 +344,11 @@ def chat():
     """
     data = request.get_json() or {}
     message = data.get("message", "").strip()
-    conversation_history = data.get("conversation_history", [])
+    # Keep only the tail the pipeline actually uses, once, instead of carrying the whole client history
+    conversation_history = data.get("conversation_history") or []
+    if not isinstance(conversation_history, list):
+        conversation_history = []
+    conversation_history = conversation_history[-_HISTORY_MAX_MESSAGES:]
 
     if not message:
         return jsonify({"error": "Message is required"}), 400
@@ -404,17 +404,19 @@ def chat():
                 )
             else:  # hybrid
                 result = _run_hybrid(message, plan, conversation_history)
-                sqlp = result.get("sql", {})
-                ragp = result.get("rag", {})
+                sqlp = result.get("sql")
+                sqlp = sqlp if isinstance(sqlp, dict) else {}
+                ragp = result.get("rag")
+                ragp = ragp if isinstance(ragp, dict) else {}
                 # Build and store retrieval cache
                 _session_caches[session_id] = build_retrieval_cache(
                     mode="hybrid",
                     question=message,
                     answer=result.get("answer", ""),
-                    sql_result=sqlp.get("result") if isinstance(sqlp, dict) else None,
-                    sql_query=sqlp.get("sql") if isinstance(sqlp, dict) else None,
-                    rag_chunks=ragp.get("chunks") if isinstance(ragp, dict) else None,
-                    rag_metadata=ragp.get("metadata") if isinstance(ragp, dict) else None,
+                    sql_result=sqlp.get("result"),
+                    sql_query=sqlp.get("sql"),
+                    rag_chunks=ragp.get("chunks"),
+                    rag_metadata=ragp.get("metadata"),
                 )
 
             answer = result.get("answer", "I couldn't find an answer to your question.")
@@ -0,0 +1,73 @@
+"""
+Unit tests for extract_sources, the citation list returned by /chat.
+
+Importing api.py builds its MySQL connection pool, so the pool class is
+patched out; no database, Gemini key or running server is needed.
+"""
+
+from pathlib import Path
+import sys
+from unittest import mock
+
+import pytest
+
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(_PROJECT_ROOT))
+
+pytest.importorskip("flask")
+pytest.importorskip("flask_cors")
+pytest.importorskip("mysql.connector.pooling")
+
+with mock.patch("mysql.connector.pooling.MySQLConnectionPool"):
+    from api import api  # noqa: E402
+
+
+def _meta(source, doc_type):
+    return {"source": source, "doc_type": doc_type}
+
+
+def _rag(source, doc_type):
+    return {"type": "rag", "source": source, "doc_type": doc_type}
+
+
+_POLICIES = [_meta(f"policy {i}.txt", "policy") for i in range(7)]
+# The repeated transcript still takes one of the slots it is sliced into
+_TRANSCRIPTS = [_meta("t0", "transcript"), _meta("t0", "transcript")] + [_meta(f"t{i}", "transcript") for i in range(1, 8)]
+
+
+@pytest.mark.parametrize(
+    "sql, expected",
+    [
+        ("SELECT `type`, COUNT(*) FROM `service_requests_311` GROUP BY `type`", [{"type": "sql", "table": "service_requests_311"}]),
+        ("select * from weekly_events join t2 on 1", [{"type": "sql", "table": "weekly_events"}]),
+        ("SELECT 1", []),
+        ("", []),
+    ],
+)
+def test_sql_sources_cite_the_first_table(sql, expected):
+    assert api.extract_sources("sql", {"sql": sql}) == expected
+
+
+def test_rag_sources_list_policies_first_then_fill_to_ten():
+    sources = api.extract_sources("rag", {"metadata": _TRANSCRIPTS + _POLICIES})
+    assert sources == [_rag(f"policy {i}.txt", "policy") for i in range(5)] + [_rag(f"t{i}", "transcript") for i in range(4)]
+
+
+def test_rag_sources_default_missing_fields():
+    sources = api.extract_sources("rag", {"metadata": [{}, {"source": "notes.txt"}]})
+    assert sources == [_rag("Unknown", "unknown"), _rag("notes.txt", "unknown")]
+
+
+def test_hybrid_sources_share_eight_slots_with_the_sql_table():
+    result = {"sql": {"sql": "SELECT * FROM `shootings`"}, "rag": {"metadata": _POLICIES + _TRANSCRIPTS}}
+    sources = api.extract_sources("hybrid", result)
+    assert sources == [{"type": "sql", "table": "shootings"}] + [_rag(f"policy {i}.txt", "policy") for i in range(4)] + [_rag("t0", "transcript"), _rag("t1", "transcript")]
+
+
+def test_hybrid_sources_tolerate_missing_parts():
+    assert api.extract_sources("hybrid", {"sql": None, "rag": {"metadata": _TRANSCRIPTS[:3]}}) == [_rag("t0", "transcript"), _rag("t1", "transcript")]
+    assert api.extract_sources("hybrid", {}) == []
+
+
+def test_unknown_mode_has_no_sources():
+    assert api.extract_sources("history", {"sql": "SELECT * FROM t", "metadata": _POLICIES}) == []
@@ -1,6 +1,11 @@
 import os
+import random
+import re
+import sys
+import threading
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Optional
 from dotenv import load_dotenv
 
 # ============================================================================
@@ -42,11 +47,19 @@ MYSQL_USER = os.getenv("MYSQL_USER", "")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "")
 MYSQL_DB = os.getenv("MYSQL_DB", "rethink_ai_boston")
 MYSQL_MAX_RETRIES = 3
+MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "8"))
+MYSQL_POOL_MAX_CONNECTIONS = int(os.getenv("MYSQL_POOL_MAX_CONNECTIONS", "16"))
+MYSQL_MAX_RESULT_ROWS = int(os.getenv("MYSQL_MAX_RESULT_ROWS", "10000"))
 
 METADATA_CATALOG_PATH = os.getenv("METADATA_CATALOG_PATH", "")
 METADATA_DIR = os.getenv("METADATA_DIR", "")
 SCHEMA_METADATA_PATH = os.getenv("SCHEMA_METADATA_PATH", "")
 PGSCHEMA = os.getenv("PGSCHEMA", "public")
+SCHEMA_CACHE_TTL_SECONDS = int(os.getenv("SCHEMA_CACHE_TTL_SECONDS", "300"))
+QUERY_CACHE_TTL_SECONDS = int(os.getenv("QUERY_CACHE_TTL_SECONDS", "600"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "256"))
+# Table selection by embedding similarity; below this cosine score the Gemini selector is used instead
+TABLE_SELECT_MIN_SIMILARITY = float(os.getenv("TABLE_SELECT_MIN_SIMILARITY", "0.75"))
 
 # ============================================================================
 # Gemini AI Configuration
@@ -56,14 +69,28 @@ GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-lite")
 GEMINI_SUMMARY_MODEL = os.getenv("GEMINI_SUMMARY_MODEL", GEMINI_MODEL)
 GEMINI_EMBED_MODEL = os.getenv("GEMINI_EMBED_MODEL", "text-embedding-004")
 
+# Gemini requests in flight at once per process; extra callers wait instead of tripping 429s
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+# Retries after a 429 RESOURCE_EXHAUSTED reply, with jittered exponential backoff
+GEMINI_RATE_LIMIT_RETRIES = int(os.getenv("GEMINI_RATE_LIMIT_RETRIES", "3"))
+
 # Lazy-loaded client instance
 _genai_client = None
+_genai_client_lock = threading.Lock()
+
+_gemini_slots = threading.BoundedSemaphore(max(1, GEMINI_MAX_CONCURRENCY))
+# Server-suggested wait in a 429 error's RetryInfo detail, e.g. 'retryDelay': '7s'
+_RETRY_DELAY_RE = re.compile(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s")
+_RATE_LIMIT_MAX_WAIT_SECONDS = 30.0
 
 
 def get_genai_client():
     """
     Get or create the singleton Gemini client.
 
+    The client owns the HTTP connection pool, so every caller (including
+    worker threads) shares it and reuses its keep-alive connections.
+
     Returns:
         google.genai.Client: Configured Gemini client
 
@@ -78,13 +105,62 @@ def get_genai_client():
     if not GEMINI_API_KEY:
         raise RuntimeError("GEMINI_API_KEY not configured in environment")
 
-    try:
-        from google import genai
+    with _genai_client_lock:
+        # Another thread may have built it while we waited for the lock
+        if _genai_client is not None:
+            return _genai_client
+        try:
+            from google import genai
 
-        _genai_client = genai.Client(api_key=GEMINI_API_KEY)
-        return _genai_client
-    except ImportError:
-        raise RuntimeError("google-genai package not installed. " "Run: pip install google-genai")
+            _genai_client = genai.Client(api_key=GEMINI_API_KEY)
+            return _genai_client
+        except ImportError:
+            raise RuntimeError("google-genai package not installed. " "Run: pip install google-genai")
+
+
+def _is_rate_limited(exc: Exception) -> bool:
+    return getattr(exc, "code", None) == 429 or "RESOURCE_EXHAUSTED" in str(exc)
+
+
+def _rate_limit_delay(exc: Exception, attempt: int) -> float:
+    """Seconds to wait before retry `attempt` (0-based): the server's hint if larger, else jittered 2**attempt."""
+    delay = (2**attempt) * random.uniform(0.75, 1.25)
+    hint = _RETRY_DELAY_RE.search(str(exc))
+    if hint:
+        delay = max(delay, float(hint.group(1)))
+    return min(delay, _RATE_LIMIT_MAX_WAIT_SECONDS)
+
+
+def _call_gemini(call: Callable[[], Any], can_retry: Callable[[], bool] = lambda: True) -> Any:
+    """
+    Run one Gemini request under the process-wide concurrency cap.
+
+    A 429 is retried up to GEMINI_RATE_LIMIT_RETRIES times, waiting outside
+    the cap; `can_retry` lets streaming callers refuse once text was emitted.
+    """
+    for attempt in range(GEMINI_RATE_LIMIT_RETRIES + 1):
+        with _gemini_slots:
+            try:
+                return call()
+            except Exception as exc:
+                if attempt >= GEMINI_RATE_LIMIT_RETRIES or not _is_rate_limited(exc) or not can_retry():
+                    raise
+                delay = _rate_limit_delay(exc, attempt)
+        if VERBOSE_LOGGING:
+            print(f"[Debug] Gemini rate limited, retrying in {delay:.1f}s", file=sys.stderr)
+        time.sleep(delay)
+
+
+def _tracking_stream(stream_call: Callable[[], Any], on_chunk: Optional[Callable[[str], None]]) -> str:
+    """Collect a streamed reply, retrying a 429 only while no text has reached `on_chunk`."""
+    emitted = []
+
+    def _on_chunk(text: str) -> None:
+        emitted.append(True)
+        if on_chunk:
+            on_chunk(text)
+
+    return _call_gemini(lambda: _collect_stream(stream_call(), _on_chunk), can_retry=lambda: not emitted)
 
 
 def generate_content(
@@ -92,6 +168,7 @@ def generate_content(
     model: Optional[str] = None,
     temperature: float = 0,
     system_instruction: Optional[str] = None,
+    response_mime_type: Optional[str] = None,
 ) -> str:
     """
     Generate content using Gemini.
@@ -101,6 +178,7 @@ def generate_content(
         model: Model name (defaults to GEMINI_MODEL)
         temperature: Sampling temperature (0 = deterministic)
         system_instruction: Optional system prompt
+        response_mime_type: Optional output format, e.g. "application/json" for JSON-only replies
 
     Returns:
         str: Generated text response
@@ -116,16 +194,112 @@ def generate_content(
 
     if system_instruction:
         config_obj.system_instruction = system_instruction
-
-    response = client.models.generate_content(
-        model=model_name,
-        contents=prompt,
-        config=config_obj,
+    if response_mime_type:
+        config_obj.response_mime_type = response_mime_type
+
+    response = _call_gemini(
+        lambda: client.models.generate_content(
+            model=model_name,
+            contents=prompt,
+            config=config_obj,
+        )
     )
+    _log_usage(response)
 
     return get_response_text(response).strip()
 
 
+def generate_content_stream(
+    prompt: str,
+    model: Optional[str] = None,
+    temperature: float = 0,
+    system_instruction: Optional[str] = None,
+    on_chunk: Optional[Callable[[str], None]] = None,
+) -> str:
+    """
+    Generate content using Gemini, streaming the response as it is produced.
+
+    Args:
+        prompt: The user prompt/question
+        model: Model name (defaults to GEMINI_MODEL)
+        temperature: Sampling temperature (0 = deterministic)
+        system_instruction: Optional system prompt
+        on_chunk: Called with each text chunk as soon as it arrives
+
+    Returns:
+        str: The full generated text
+    """
+    client = get_genai_client()
+    model_name = model or GEMINI_MODEL
+
+    from google.genai import types
+
+    config_obj = types.GenerateContentConfig(
+        temperature=temperature,
+    )
+
+    if system_instruction:
+        config_obj.system_instruction = system_instruction
+
+    return _tracking_stream(
+        lambda: client.models.generate_content_stream(
+            model=model_name,
+            contents=prompt,
+            config=config_obj,
+        ),
+        on_chunk,
+    )
+
+
+def _collect_stream(stream, on_chunk: Optional[Callable[[str], None]]) -> str:
+    """Pass each streamed text chunk to `on_chunk` and return the joined text."""
+    parts = []
+    chunk = None
+    for chunk in stream:
+        text = get_response_text(chunk) or ""
+        if not text:
+            continue
+        parts.append(text)
+        if on_chunk:
+            on_chunk(text)
+    if chunk is not None:
+        # Usage metadata is reported on the final chunk
+        _log_usage(chunk)
+
+    return "".join(parts).strip()
+
+
+def print_streamed_answer(generate: Callable[[Callable[[str], None]], str], header: str) -> str:
+    """
+    Print an answer to stdout as `generate` streams it and return the final answer.
+
+    `header` is written with the first chunk, so it lands after any progress
+    output the caller prints while preparing the answer. Answers that weren't
+    streamed (local fast paths, fallbacks) are printed whole at the end. Output
+    is flushed only for each chunk and once the answer is complete.
+    """
+    out = sys.stdout
+    streamed = []
+
+    def _write_chunk(text: str) -> None:
+        if not streamed:
+            out.write(header)
+        streamed.append(text)
+        out.write(text)
+        out.flush()
+
+    answer = generate(_write_chunk)
+    if not streamed:
+        out.write(header + answer + "\n\n")
+    elif answer.strip() != "".join(streamed).strip():
+        # The stream broke off and a fallback answer was used instead
+        out.write("\n\n" + answer + "\n\n")
+    else:
+        out.write("\n\n")
+    out.flush()
+    return answer
+
+
 def generate_content_with_history(
     messages: list,
     model: Optional[str] = None,
@@ -150,15 +324,7 @@ def generate_content_with_history(
 
     from google.genai import types
 
-    # Convert messages to Content objects
-    contents = []
-    for msg in messages:
-        role = msg.get("role", "user")
-        # Map 'assistant' to 'model' for Gemini API
-        if role == "assistant":
-            role = "model"
-        content = msg.get("content", "")
-        contents.append(types.Content(role=role, parts=[types.Part(text=content)]))
+    contents = _history_contents(messages)
 
     config_obj = types.GenerateContentConfig(
         temperature=temperature,
@@ -167,15 +333,77 @@ def generate_content_with_history(
     if system_instruction:
         config_obj.system_instruction = system_instruction
 
-    response = client.models.generate_content(
-        model=model_name,
-        contents=contents,
-        config=config_obj,
+    response = _call_gemini(
+        lambda: client.models.generate_content(
+            model=model_name,
+            contents=contents,
+            config=config_obj,
+        )
     )
+    _log_usage(response)
 
     return get_response_text(response).strip()
 
 
+def generate_content_with_history_stream(
+    messages: list,
+    model: Optional[str] = None,
+    temperature: float = 0,
+    system_instruction: Optional[str] = None,
+    on_chunk: Optional[Callable[[str], None]] = None,
+) -> str:
+    """
+    Generate content with conversation history, streaming the response.
+
+    Args:
+        messages: List of message dicts with 'role' and 'content' keys
+        model: Model name (defaults to GEMINI_MODEL)
+        temperature: Sampling temperature
+        system_instruction: Optional system prompt
+        on_chunk: Called with each text chunk as soon as it arrives
+
+    Returns:
+        str: The full generated text
+    """
+    client = get_genai_client()
+    model_name = model or GEMINI_MODEL
+
+    from google.genai import types
+
+    config_obj = types.GenerateContentConfig(
+        temperature=temperature,
+    )
+
+    if system_instruction:
+        config_obj.system_instruction = system_instruction
+
+    contents = _history_contents(messages)
+
+    return _tracking_stream(
+        lambda: client.models.generate_content_stream(
+            model=model_name,
+            contents=contents,
+            config=config_obj,
+        ),
+        on_chunk,
+    )
+
+
+def _history_contents(messages: list) -> list:
+    """Convert role/content message dicts to Gemini Content objects."""
+    from google.genai import types
+
+    contents = []
+    for msg in messages:
+        role = msg.get("role", "user")
+        # Map 'assistant' to 'model' for Gemini API
+        if role == "assistant":
+            role = "model"
+        content = msg.get("content", "")
+        contents.append(types.Content(role=role, parts=[types.Part(text=content)]))
+    return contents
+
+
 def embed_content(text: str, model: Optional[str] = None) -> list:
     """
     Generate embeddings for text.
@@ -190,9 +418,11 @@ def embed_content(text: str, model: Optional[str] = None) -> list:
     client = get_genai_client()
     model_name = model or GEMINI_EMBED_MODEL
 
-    response = client.models.embed_content(
-        model=model_name,
-        contents=text,
+    response = _call_gemini(
+        lambda: client.models.embed_content(
+            model=model_name,
+            contents=text,
+        )
     )
 
     if hasattr(response, "embeddings") and response.embeddings:
@@ -203,6 +433,10 @@ def embed_content(text: str, model: Optional[str] = None) -> list:
     raise RuntimeError("Unexpected embedding response format")
 
 
+# Most texts the Gemini embedding API accepts in one request
+_EMBED_BATCH_MAX = 100
+
+
 def embed_content_batch(texts: list, model: Optional[str] = None) -> list:
     """
     Generate embeddings for multiple texts.
@@ -212,9 +446,44 @@ def embed_content_batch(texts: list, model: Optional[str] = None) -> list:
         model: Embedding model name (defaults to GEMINI_EMBED_MODEL)
 
     Returns:
-        list: List of embedding vectors
+        list: List of embedding vectors, in the order of `texts`
+    """
+    client = get_genai_client()
+    model_name = model or GEMINI_EMBED_MODEL
+
+    vectors = []
+    # One request per _EMBED_BATCH_MAX texts instead of one per text
+    for start in range(0, len(texts), _EMBED_BATCH_MAX):
+        batch = list(texts[start : start + _EMBED_BATCH_MAX])
+        response = _call_gemini(
+            lambda: client.models.embed_content(
+                model=model_name,
+                contents=batch,
+            )
+        )
+        embeddings = getattr(response, "embeddings", None) or []
+        if len(embeddings) != len(batch):
+            raise RuntimeError("Unexpected embedding response format")
+        vectors.extend(e.values for e in embeddings)
+    return vectors
+
+
+def _log_usage(response) -> None:
+    """
+    Log prompt/cached token counts when VERBOSE_LOGGING is on.
+
+    Prompts keep their invariant parts (system instruction, schema, metadata)
+    at the front so Gemini's implicit context caching can reuse them; a
+    non-zero cached count confirms the prefix is being hit.
     """
-    return [embed_content(text, model) for text in texts]
+    if not VERBOSE_LOGGING:
+        return
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    cached_tokens = getattr(usage, "cached_content_token_count", None) or 0
+    print(f"[Debug] Gemini prompt_tokens={prompt_tokens} cached_tokens={cached_tokens}", file=sys.stderr)
 
 
 def get_response_text(response):
@@ -1,9 +1,14 @@
 import os
 import sys
+import re
 import json
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 _PROJECT_ROOT = Path(__file__).resolve().parents[2]
 sys.path.insert(0, str(_PROJECT_ROOT))
@@ -11,6 +16,12 @@ sys.path.insert(0, str(_PROJECT_ROOT))
 import config
 import main_chat.rag_pipeline.rag_retrieval as rag_retrieval
 
+# Optional faster JSON parser/encoder for model replies and prompt payloads
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None
+
 
 def _fix_retrieval_vectordb_path() -> None:
     # retrieval.VECTORDB_DIR is relative; ensure it points to main_chat/vectordb_new
@@ -23,11 +34,28 @@ def _fix_retrieval_vectordb_path() -> None:
 
 def _safe_json_loads(text: str, default: Dict[str, Any]) -> Dict[str, Any]:
     try:
+        if orjson is not None:
+            return orjson.loads(text)
         return json.loads(text)
     except Exception:
         return default
 
 
+def _dumps_json(obj: Any) -> str:
+    """Compact JSON for prompt payloads; values JSON can't represent fall back to str()."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, default=str)
+
+
+# Leading ``` fence (with an optional language tag) and trailing ``` around a JSON reply
+_JSON_FENCE_RE = re.compile(r"\A```\s*(?:json|javascript|js)?\s*|\s*```\s*\Z", re.IGNORECASE)
+
+
+def _strip_code_fence(content: str) -> str:
+    return _JSON_FENCE_RE.sub("", content).strip()
+
+
 # ---------------------------------------------------------------------------
 # Retrieval Cache: stores the most recent retrieval results for follow-up use
 # ---------------------------------------------------------------------------
@@ -47,6 +75,23 @@ def create_empty_cache() -> Dict[str, Any]:
     }
 
 
+# Rows of a SQL result kept in a session's retrieval cache; readers never look past this
+_CACHE_MAX_SQL_ROWS = 50
+
+
+def _cap_sql_result(sql_result: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Keep the first rows of a SQL result plus the full row_count."""
+    if not isinstance(sql_result, dict):
+        return sql_result
+    rows = sql_result.get("rows")
+    if not isinstance(rows, list) or len(rows) <= _CACHE_MAX_SQL_ROWS:
+        return sql_result
+    capped = dict(sql_result)
+    capped["rows"] = rows[:_CACHE_MAX_SQL_ROWS]
+    capped["row_count"] = sql_result.get("row_count", len(rows))
+    return capped
+
+
 def build_retrieval_cache(
     mode: str,
     question: str,
@@ -61,7 +106,7 @@ def build_retrieval_cache(
         "mode": mode,
         "timestamp": datetime.now().isoformat(),
         "question": question,
-        "sql_result": sql_result,
+        "sql_result": _cap_sql_result(sql_result),  # Cap rows, keep the full count
         "sql_query": sql_query,
         "rag_chunks": rag_chunks[:20] if rag_chunks else None,  # Cap chunks
         "rag_metadata": rag_metadata[:20] if rag_metadata else None,
@@ -88,7 +133,7 @@ def summarize_cache(cache: Optional[Dict[str, Any]]) -> str:
     if sql_result:
         rows = sql_result.get("rows", [])
         columns = sql_result.get("columns", [])
-        row_count = len(rows) if isinstance(rows, list) else 0
+        row_count = sql_result.get("row_count", len(rows)) if isinstance(rows, list) else 0
         col_names = ", ".join(columns[:10]) if columns else "unknown columns"
         parts.append(f"SQL data: {row_count} rows with columns [{col_names}]")
 
@@ -110,8 +155,9 @@ def summarize_cache(cache: Optional[Dict[str, Any]]) -> str:
     rag_chunks = cache.get("rag_chunks")
     if rag_meta:
         chunk_count = len(rag_meta)
-        sources = list(set(m.get("source", "unknown") for m in rag_meta[:10]))
-        doc_types = list(set(m.get("doc_type", "unknown") for m in rag_meta[:10]))
+        # dict.fromkeys dedupes while keeping retrieval order, so the prompt text is stable
+        sources = list(dict.fromkeys(m.get("source", "unknown") for m in rag_meta[:10]))
+        doc_types = list(dict.fromkeys(m.get("doc_type", "unknown") for m in rag_meta[:10]))
         parts.append(f"RAG data: {chunk_count} chunks from sources: {sources[:5]}, types: {doc_types}")
 
         # Include chunk previews
@@ -141,13 +187,11 @@ def _check_if_needs_new_data(
         return {"needs_new_data": True, "reason": "No conversation history or cached data available"}
 
     # Build conversation context for analysis
-    history_context = ""
-    if conversation_history:
-        for msg in conversation_history[-10:]:  # Last 10 messages
-            role = msg.get("role", "")
-            content = msg.get("content", "")
-            if role and content:
-                history_context += f"{role.upper()}: {content}\n\n"
+    history_context = "".join(
+        f"{msg.get('role').upper()}: {msg.get('content')}\n\n"
+        for msg in (conversation_history or [])[-10:]  # Last 10 messages
+        if msg.get("role") and msg.get("content")
+    )
 
     # Build cache summary
     cache_summary = summarize_cache(retrieval_cache)
@@ -183,16 +227,10 @@ def _check_if_needs_new_data(
             prompt=prompt,
             model=config.GEMINI_MODEL,
             temperature=0,
+            response_mime_type="application/json",
         )
 
-        # Remove code fences if present
-        if content.startswith("```"):
-            content = content.strip("`").strip()
-            lines = content.splitlines()
-            if lines and lines[0].strip().lower() in ("json", "javascript", "js"):
-                content = "\n".join(lines[1:]).strip()
-
-        result = _safe_json_loads(content, default_result)
+        result = _safe_json_loads(_strip_code_fence(content), default_result)
 
         # Ensure needs_new_data is boolean
         needs_new = result.get("needs_new_data", True)
@@ -205,109 +243,150 @@ def _check_if_needs_new_data(
         return default_result
 
 
-def _route_question(question: str) -> Dict[str, Any]:
-    """
-    Decide whether to answer via SQL, RAG, or HYBRID.
-    Returns a dict like: {"mode": "sql|rag|hybrid", "transcript_tags": [..]|null, "policy_sources": [..]|null, "k": int}
+# Static part of the routing prompt; only the date line and the question vary per call
+_ROUTER_SYSTEM_PROMPT = (
+    "You are a STRICT routing classifier for a chatbot that combines SQL (structured data) and RAG (text documents).\n"
+    "You MUST classify the user's question into EXACTLY one of three modes: 'sql', 'rag', or 'hybrid'.\n"
+    "These rules are MANDATORY and NON-NEGOTIABLE. Follow them EXACTLY.\n\n"
+    "═══════════════════════════════════════════════════════════════════════════════\n"
+    "CRITICAL ROUTING RULES - ABSOLUTE PRIORITY (CHECK IN THIS ORDER):\n"
+    "═══════════════════════════════════════════════════════════════════════════════\n\n"
+    "RULE 1: CRIME-RELATED QUESTIONS → Route based on question type\n"
+    "   - If the question mentions ANY of: crime, crimes, arrest, arrests, offense, offenses, homicide, homicides, shooting, shootings, shots fired, safety incident, safety incidents, criminal activity, violence, violent\n"
+    "   - THEN apply these sub-rules:\n"
+    "     a) If asking for STATISTICS/NUMBERS ONLY (counts, trends, comparisons, breakdowns) → mode MUST be 'sql'\n"
+    "        Examples: 'How many arrests were there?', 'What is the trend in shots fired?', 'Show me crime statistics', 'Which areas have highest arrests?' → sql\n"
+    "     b) If asking for OPINIONS/CONTEXT ONLY (what people think/say about crime) → mode MUST be 'hybrid'\n"
+    "        Examples: 'What do people say about crime?', 'How do residents feel about safety?' → hybrid\n"
+    "     c) If asking for BOTH statistics AND context/opinions → mode MUST be 'hybrid'\n"
+    "        Examples: 'How many homicides and what concerns come up?', 'Show crime trends and community concerns' → hybrid\n"
+    "   - DO NOT use 'rag' alone for crime questions\n\n"
+    "RULE 2: EVENT/CALENDAR/ACTIVITY QUESTIONS → ALWAYS 'sql' mode\n"
+    "   - If the question mentions ANY of: event, events, happening, schedule, calendar, activity, activities, 'what's on', 'what is on', 'going on', meeting, meetings, workshop, workshops, 'this week', 'next week', 'today', 'tomorrow', 'weekend', day of week\n"
+    "   - THEN mode MUST be 'sql' (NO EXCEPTIONS)\n"
+    "   - DO NOT use 'rag' or 'hybrid' for event/calendar questions\n"
+    "   - Examples that MUST be 'sql':\n"
+    "     * 'What events are happening this week?' → sql\n"
+    "     * 'Show me fun activities for kids' → sql\n"
+    "     * 'What public meetings are scheduled?' → sql\n"
+    "     * 'What's happening on Saturday?' → sql\n"
+    "     * 'Are there any community events?' → sql\n\n"
+    "RULE 3: OPINION/PERSPECTIVE QUESTIONS → ALWAYS 'rag' mode\n"
+    "   - If the question asks for: opinions, perspectives, feelings, views, what people think/say/believe/feel/describe, community views, resident views\n"
+    "   - AND the question is NOT about crime (see Rule 1)\n"
+    "   - THEN mode MUST be 'rag' (NO EXCEPTIONS)\n"
+    "   - DO NOT use 'sql' or 'hybrid' for pure opinion questions\n"
+    "   - Examples that MUST be 'rag':\n"
+    "     * 'What do people think about displacement?' → rag\n"
+    "     * 'How do community members feel about housing?' → rag\n"
+    "     * 'What are people's opinions on media representation?' → rag\n"
+    "     * 'What do residents say about the neighborhood?' → rag\n\n"
+    "═══════════════════════════════════════════════════════════════════════════════\n"
+    "SECONDARY ROUTING RULES (Apply if Rules 1-3 don't match):\n"
+    "═══════════════════════════════════════════════════════════════════════════════\n\n"
+    "RULE 4: PURE STATISTICS/NUMBERS → 'sql' mode\n"
+    "   - Questions asking ONLY for: counts, numbers, statistics, trends, comparisons, breakdowns, aggregations\n"
+    "   - Questions that can be answered with numeric data from tables\n"
+    "   - This INCLUDES crime statistics (see Rule 1a)\n"
+    "   - Examples: 'How many 311 requests?', 'What is the trend in shots fired?', 'Which areas have highest arrests?', 'How many homicides last year?'\n"
+    "   - DO NOT use 'rag' or 'hybrid' if the question is purely numeric\n\n"
+    "RULE 5: POLICY/DOCUMENT CONTENT → 'rag' mode\n"
+    "   - Questions asking about: what a policy/document says, what a program aims to achieve, document content, newsletter content\n"
+    "   - Examples: 'What does Slow Streets aim to achieve?', 'What strategies does the Anti-Displacement Plan propose?', 'What was in the newsletter?'\n"
+    "   - DO NOT use 'sql' for document content questions\n\n"
+    "RULE 5.1: SPECIFIC vs GENERAL POLICY QUESTIONS\n"
+    "   - If question mentions a SPECIFIC policy by name (e.g., 'Anti-Displacement Plan', 'Slow Streets', 'Imagine Boston 2030'):\n"
+    "     * Set policy_sources to that specific document (e.g., ['Boston Anti-Displacement Plan Analysis.txt'])\n"
+    "     * ALWAYS also add relevant transcript_tags for community perspective\n"
+    "   - If question is GENERAL about policy/planning but doesn't name a specific document:\n"
+    "     * Examples: 'What are current policy issues?', 'What policies affect housing?', 'What is being planned for the neighborhood?'\n"
+    "     * Set policy_sources to null (will search ALL policy documents)\n"
+    "     * Add relevant transcript_tags\n"
+    "     * Set k to at least 10 to get diverse policy coverage\n\n"
+    "RULE 6: COMBINED DATA + CONTEXT → 'hybrid' mode\n"
+    "   - Questions that explicitly ask for BOTH numbers/data AND context/explanation\n"
+    "   - Examples: 'How many homicides and what concerns come up?', 'Show trends and how policies address them'\n"
+    "   - DO NOT use 'sql' or 'rag' alone if question explicitly requires both\n\n"
+    "═══════════════════════════════════════════════════════════════════════════════\n"
+    "STRICT VALIDATION REQUIREMENTS:\n"
+    "═══════════════════════════════════════════════════════════════════════════════\n\n"
+    "1. Mode MUST be exactly one of: 'sql', 'rag', or 'hybrid' (lowercase, no quotes in JSON)\n"
+    "2. If mode is 'sql': transcript_tags, policy_sources, and folder_categories MUST be null\n"
+    "3. If mode is 'rag' or 'hybrid':\n"
+    "   - transcript_tags: array of 0-2 strings OR null (valid tags: safety, violence, youth, media, community, displacement, government, structural racism)\n"
+    "   - policy_sources: array of strings OR null (valid: 'Boston Anti-Displacement Plan Analysis.txt', 'Boston Slow Streets Plan Analysis.txt', 'Imagine Boston 2030 Analysis.txt')\n"
+    "   - folder_categories: array of strings OR null (valid: newsletters, policy, transcripts)\n"
+    "   - k: integer between 3 and 10 (default 5, minimum 5 for event queries)\n"
+    "4. For crime questions using 'hybrid' mode (Rule 1b or 1c): transcript_tags MUST include at least one of: 'safety' or 'violence'\n"
+    "   For crime questions using 'sql' mode (Rule 1a): transcript_tags, policy_sources, and folder_categories MUST be null\n"
+    "5. For opinion questions (Rule 3): transcript_tags should include relevant tags like 'community', 'displacement', 'youth', 'media'\n"
+    "6. For event questions (Rule 2): k MUST be at least 5\n\n"
+    "═══════════════════════════════════════════════════════════════════════════════\n"
+    "OUTPUT FORMAT (STRICT):\n"
+    "═══════════════════════════════════════════════════════════════════════════════\n\n"
+    "Return ONLY valid JSON with EXACTLY these keys: mode, transcript_tags, policy_sources, folder_categories, k\n"
+    "DO NOT include any explanatory text or additional content.\n"
+    "Example valid output:\n"
+    '{"mode": "hybrid", "transcript_tags": ["safety"], "policy_sources": null, "folder_categories": null, "k": 5}\n\n'
+    "NOTE: This system is configured for DORCHESTER ONLY. All SQL queries automatically filter to Dorchester data only."
+)
+_ROUTER_USER_NOTES = (
+    "Policy sources include: 'Boston Anti-Displacement Plan Analysis.txt', 'Boston Slow Streets Plan Analysis.txt', 'Imagine Boston 2030 Analysis.txt'.\n"
+    "Transcript tags include: safety, violence, youth, media, community, displacement, government, structural racism.\n"
+    "Folder categories (for client uploads): newsletters, policy, transcripts.\n"
+    "Output JSON only."
+)
+
+
+# Classifier replies (JSON text) keyed by (normalized question, ISO date), oldest first
+_ROUTE_CACHE: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+_ROUTE_CACHE_MAX = 512
+_ROUTE_CACHE_LOCK = threading.Lock()
+
+
+def _classify_route(question: str, today: str) -> str:
     """
+    Ask Gemini to route a question; returns its reply as JSON text.
 
-    system_prompt = (
-        f"Today's date is {date.today().strftime('%A, %B %d, %Y')}.\n\n"
-        "You are a STRICT routing classifier for a chatbot that combines SQL (structured data) and RAG (text documents).\n"
-        "You MUST classify the user's question into EXACTLY one of three modes: 'sql', 'rag', or 'hybrid'.\n"
-        "These rules are MANDATORY and NON-NEGOTIABLE. Follow them EXACTLY.\n\n"
-        "═══════════════════════════════════════════════════════════════════════════════\n"
-        "CRITICAL ROUTING RULES - ABSOLUTE PRIORITY (CHECK IN THIS ORDER):\n"
-        "═══════════════════════════════════════════════════════════════════════════════\n\n"
-        "RULE 1: CRIME-RELATED QUESTIONS → Route based on question type\n"
-        "   - If the question mentions ANY of: crime, crimes, arrest, arrests, offense, offenses, homicide, homicides, shooting, shootings, shots fired, safety incident, safety incidents, criminal activity, violence, violent\n"
-        "   - THEN apply these sub-rules:\n"
-        "     a) If asking for STATISTICS/NUMBERS ONLY (counts, trends, comparisons, breakdowns) → mode MUST be 'sql'\n"
-        "        Examples: 'How many arrests were there?', 'What is the trend in shots fired?', 'Show me crime statistics', 'Which areas have highest arrests?' → sql\n"
-        "     b) If asking for OPINIONS/CONTEXT ONLY (what people think/say about crime) → mode MUST be 'hybrid'\n"
-        "        Examples: 'What do people say about crime?', 'How do residents feel about safety?' → hybrid\n"
-        "     c) If asking for BOTH statistics AND context/opinions → mode MUST be 'hybrid'\n"
-        "        Examples: 'How many homicides and what concerns come up?', 'Show crime trends and community concerns' → hybrid\n"
-        "   - DO NOT use 'rag' alone for crime questions\n\n"
-        "RULE 2: EVENT/CALENDAR/ACTIVITY QUESTIONS → ALWAYS 'sql' mode\n"
-        "   - If the question mentions ANY of: event, events, happening, schedule, calendar, activity, activities, 'what's on', 'what is on', 'going on', meeting, meetings, workshop, workshops, 'this week', 'next week', 'today', 'tomorrow', 'weekend', day of week\n"
-        "   - THEN mode MUST be 'sql' (NO EXCEPTIONS)\n"
-        "   - DO NOT use 'rag' or 'hybrid' for event/calendar questions\n"
-        "   - Examples that MUST be 'sql':\n"
-        "     * 'What events are happening this week?' → sql\n"
-        "     * 'Show me fun activities for kids' → sql\n"
-        "     * 'What public meetings are scheduled?' → sql\n"
-        "     * 'What's happening on Saturday?' → sql\n"
-        "     * 'Are there any community events?' → sql\n\n"
-        "RULE 3: OPINION/PERSPECTIVE QUESTIONS → ALWAYS 'rag' mode\n"
-        "   - If the question asks for: opinions, perspectives, feelings, views, what people think/say/believe/feel/describe, community views, resident views\n"
-        "   - AND the question is NOT about crime (see Rule 1)\n"
-        "   - THEN mode MUST be 'rag' (NO EXCEPTIONS)\n"
-        "   - DO NOT use 'sql' or 'hybrid' for pure opinion questions\n"
-        "   - Examples that MUST be 'rag':\n"
-        "     * 'What do people think about displacement?' → rag\n"
-        "     * 'How do community members feel about housing?' → rag\n"
-        "     * 'What are people's opinions on media representation?' → rag\n"
-        "     * 'What do residents say about the neighborhood?' → rag\n\n"
-        "═══════════════════════════════════════════════════════════════════════════════\n"
-        "SECONDARY ROUTING RULES (Apply if Rules 1-3 don't match):\n"
-        "═══════════════════════════════════════════════════════════════════════════════\n\n"
-        "RULE 4: PURE STATISTICS/NUMBERS → 'sql' mode\n"
-        "   - Questions asking ONLY for: counts, numbers, statistics, trends, comparisons, breakdowns, aggregations\n"
-        "   - Questions that can be answered with numeric data from tables\n"
-        "   - This INCLUDES crime statistics (see Rule 1a)\n"
-        "   - Examples: 'How many 311 requests?', 'What is the trend in shots fired?', 'Which areas have highest arrests?', 'How many homicides last year?'\n"
-        "   - DO NOT use 'rag' or 'hybrid' if the question is purely numeric\n\n"
-        "RULE 5: POLICY/DOCUMENT CONTENT → 'rag' mode\n"
-        "   - Questions asking about: what a policy/document says, what a program aims to achieve, document content, newsletter content\n"
-        "   - Examples: 'What does Slow Streets aim to achieve?', 'What strategies does the Anti-Displacement Plan propose?', 'What was in the newsletter?'\n"
-        "   - DO NOT use 'sql' for document content questions\n\n"
-        "RULE 5.1: SPECIFIC vs GENERAL POLICY QUESTIONS\n"
-        "   - If question mentions a SPECIFIC policy by name (e.g., 'Anti-Displacement Plan', 'Slow Streets', 'Imagine Boston 2030'):\n"
-        "     * Set policy_sources to that specific document (e.g., ['Boston Anti-Displacement Plan Analysis.txt'])\n"
-        "     * ALWAYS also add relevant transcript_tags for community perspective\n"
-        "   - If question is GENERAL about policy/planning but doesn't name a specific document:\n"
-        "     * Examples: 'What are current policy issues?', 'What policies affect housing?', 'What is being planned for the neighborhood?'\n"
-        "     * Set policy_sources to null (will search ALL policy documents)\n"
-        "     * Add relevant transcript_tags\n"
-        "     * Set k to at least 10 to get diverse policy coverage\n\n"
-        "RULE 6: COMBINED DATA + CONTEXT → 'hybrid' mode\n"
-        "   - Questions that explicitly ask for BOTH numbers/data AND context/explanation\n"
-        "   - Examples: 'How many homicides and what concerns come up?', 'Show trends and how policies address them'\n"
-        "   - DO NOT use 'sql' or 'rag' alone if question explicitly requires both\n\n"
-        "═══════════════════════════════════════════════════════════════════════════════\n"
-        "STRICT VALIDATION REQUIREMENTS:\n"
-        "═══════════════════════════════════════════════════════════════════════════════\n\n"
-        "1. Mode MUST be exactly one of: 'sql', 'rag', or 'hybrid' (lowercase, no quotes in JSON)\n"
-        "2. If mode is 'sql': transcript_tags, policy_sources, and folder_categories MUST be null\n"
-        "3. If mode is 'rag' or 'hybrid':\n"
-        "   - transcript_tags: array of 0-2 strings OR null (valid tags: safety, violence, youth, media, community, displacement, government, structural racism)\n"
-        "   - policy_sources: array of strings OR null (valid: 'Boston Anti-Displacement Plan Analysis.txt', 'Boston Slow Streets Plan Analysis.txt', 'Imagine Boston 2030 Analysis.txt')\n"
-        "   - folder_categories: array of strings OR null (valid: newsletters, policy, transcripts)\n"
-        "   - k: integer between 3 and 10 (default 5, minimum 5 for event queries)\n"
-        "4. For crime questions using 'hybrid' mode (Rule 1b or 1c): transcript_tags MUST include at least one of: 'safety' or 'violence'\n"
-        "   For crime questions using 'sql' mode (Rule 1a): transcript_tags, policy_sources, and folder_categories MUST be null\n"
-        "5. For opinion questions (Rule 3): transcript_tags should include relevant tags like 'community', 'displacement', 'youth', 'media'\n"
-        "6. For event questions (Rule 2): k MUST be at least 5\n\n"
-        "═══════════════════════════════════════════════════════════════════════════════\n"
-        "OUTPUT FORMAT (STRICT):\n"
-        "═══════════════════════════════════════════════════════════════════════════════\n\n"
-        "Return ONLY valid JSON with EXACTLY these keys: mode, transcript_tags, policy_sources, folder_categories, k\n"
-        "DO NOT include any explanatory text, markdown, code blocks, or additional content.\n"
-        "DO NOT use backticks or markdown formatting.\n"
-        "Example valid output:\n"
-        '{"mode": "hybrid", "transcript_tags": ["safety"], "policy_sources": null, "folder_categories": null, "k": 5}\n\n'
-        "NOTE: This system is configured for DORCHESTER ONLY. All SQL queries automatically filter to Dorchester data only."
+    Replies are cached per question ignoring case and spacing, and per day
+    (`today`, ISO date) because the prompt embeds the date. Gemini is sent
+    the question as written, since casing carries proper nouns, street names
+    and acronyms like "BPD". Failed calls raise, so they are never cached.
+    """
+    key = (" ".join(question.lower().split()), today)
+    with _ROUTE_CACHE_LOCK:
+        hit = _ROUTE_CACHE.get(key)
+        if hit is not None:
+            _ROUTE_CACHE.move_to_end(key)
+            return hit
+
+    system_prompt = f"Today's date is {date.fromisoformat(today).strftime('%A, %B %d, %Y')}.\n\n" + _ROUTER_SYSTEM_PROMPT
+
+    user_prompt = "Question:\n" + question.strip() + "\n\n" + _ROUTER_USER_NOTES
+
+    prompt = f"{system_prompt}\n\n{user_prompt}"
+    content = config.generate_content(
+        prompt=prompt,
+        model=config.GEMINI_MODEL,
+        temperature=0,
+        response_mime_type="application/json",
     )
 
-    user_prompt = (
-        "Question:\n" + question + "\n\n"
-        "Policy sources include: 'Boston Anti-Displacement Plan Analysis.txt', 'Boston Slow Streets Plan Analysis.txt', 'Imagine Boston 2030 Analysis.txt'.\n"
-        "Transcript tags include: safety, violence, youth, media, community, displacement, government, structural racism.\n"
-        "Folder categories (for client uploads): newsletters, policy, transcripts.\n"
-        "Output JSON only."
-    )
+    # JSON mode should already return bare JSON; the strip is a cheap safeguard
+    content = _strip_code_fence(content)
+    with _ROUTE_CACHE_LOCK:
+        _ROUTE_CACHE[key] = content
+        _ROUTE_CACHE.move_to_end(key)
+        while len(_ROUTE_CACHE) > _ROUTE_CACHE_MAX:
+            _ROUTE_CACHE.popitem(last=False)
+    return content
+
 
+def _route_question(question: str) -> Dict[str, Any]:
+    """
+    Decide whether to answer via SQL, RAG, or HYBRID.
+    Returns a dict like: {"mode": "sql|rag|hybrid", "transcript_tags": [..]|null, "policy_sources": [..]|null, "k": int}
+    """
     default_plan = {
         "mode": "hybrid",
         "transcript_tags": None,
@@ -316,22 +395,10 @@ def _route_question(question: str) -> Dict[str, Any]:
         "k": 5,
     }
 
+    # Repeat questions (ignoring case and spacing) reuse the classifier's reply for the day;
+    # the reply is cached as raw JSON text, so every caller gets a fresh plan dict
     try:
-        prompt = f"{system_prompt}\n\n{user_prompt}"
-        content = content = config.generate_content(
-            prompt=prompt,
-            model=config.GEMINI_MODEL,
-            temperature=0,
-        )
-
-        # Remove code fences if present
-        if content.startswith("```"):
-            content = content.strip("`").strip()
-            # If the first line is a language tag, drop it
-            lines = content.splitlines()
-            if lines:
-                if lines[0].strip().lower() in ("json", "javascript", "js"):
-                    content = "\n".join(lines[1:]).strip()
+        content = _classify_route(question or "", date.today().isoformat())
         plan = _safe_json_loads(content, default_plan)
     except Exception:
         plan = default_plan
@@ -374,7 +441,26 @@ def _route_question(question: str) -> Dict[str, Any]:
     }
 
 
-def _compose_rag_answer(question: str, chunks: List[str], metadatas: List[Dict[str, Any]], conversation_history: Optional[List[Dict[str, str]]] = None) -> str:
+_RAG_SYSTEM_PROMPT = (
+    "You are a friendly, non-technical assistant helping people understand Dorchester community data and policies.\n"
+    "This system is configured for DORCHESTER ONLY. All data queries are automatically filtered to Dorchester only.\n"
+    "Use clear, everyday language and imagine you are talking to a neighbor, not a technical expert.\n"
+    "Use only the provided SOURCES and do not add information that is not supported by the text.\n\n"
+    "When you quote or paraphrase people or documents, briefly explain who or what they are first, "
+    "then include the quote in a natural way. Avoid technical jargon, and do not mention SQL, databases, RAG, "
+    "retrieval methods, or internal tools.\n"
+    "If the question involves numbers, be honest when the sources are limited and avoid inventing precise figures.\n"
+)
+_RAG_CONVERSATION_NOTE = "\n\nYou are in a conversation. Use previous messages for context when the current question references earlier topics or asks for follow-ups."
+
+
+def _compose_rag_answer(
+    question: str,
+    chunks: List[str],
+    metadatas: List[Dict[str, Any]],
+    conversation_history: Optional[List[Dict[str, str]]] = None,
+    on_chunk: Optional[Callable[[str], None]] = None,
+) -> str:
     if not chunks:
         return "No relevant information found."
 
@@ -392,16 +478,7 @@ def _compose_rag_answer(question: str, chunks: List[str], metadatas: List[Dict[s
         context_parts.append("")
     context = "\n".join(context_parts)
 
-    system_prompt = (
-        "You are a friendly, non-technical assistant helping people understand Dorchester community data and policies.\n"
-        "This system is configured for DORCHESTER ONLY. All data queries are automatically filtered to Dorchester only.\n"
-        "Use clear, everyday language and imagine you are talking to a neighbor, not a technical expert.\n"
-        "Use only the provided SOURCES and do not add information that is not supported by the text.\n\n"
-        "When you quote or paraphrase people or documents, briefly explain who or what they are first, "
-        "then include the quote in a natural way. Avoid technical jargon, and do not mention SQL, databases, RAG, "
-        "retrieval methods, or internal tools.\n"
-        "If the question involves numbers, be honest when the sources are limited and avoid inventing precise figures.\n" + ("\n\nYou are in a conversation. Use previous messages for context when the current question references earlier topics or asks for follow-ups." if conversation_history else "")
-    )
+    system_prompt = _RAG_SYSTEM_PROMPT + (_RAG_CONVERSATION_NOTE if conversation_history else "")
     user_prompt = "SOURCES:\n" + context + "\n\n" + "QUESTION: " + question + "\n\n" + "Please answer for the user in clear, everyday language:"
 
     # Build conversation context
@@ -431,7 +508,8 @@ def _compose_rag_answer(question: str, chunks: List[str], metadatas: List[Dict[s
 
         # Add current question with context
         messages.append({"role": "user", "content": user_prompt})
-        # TODO return text?
+        if on_chunk is not None:
+            return config.generate_content_with_history_stream(messages=messages, temperature=0.3, system_instruction=system_prompt, on_chunk=on_chunk)
         return config.generate_content_with_history(messages=messages, temperature=0.3, system_instruction=system_prompt)
     except Exception:
         return "\n\n".join(context_parts[:10])
@@ -513,7 +591,8 @@ def _build_cache_context_for_answer(cache: Dict[str, Any]) -> str:
         columns = sql_result.get("columns", [])
 
         if rows and columns:
-            parts.append(f"Data table with {len(rows)} entries:")
+            row_count = sql_result.get("row_count", len(rows))
+            parts.append(f"Data table with {row_count} entries:")
             parts.append(f"Columns: {', '.join(columns)}")
             parts.append("")
 
@@ -528,8 +607,8 @@ def _build_cache_context_for_answer(cache: Dict[str, Any]) -> str:
                 else:
                     parts.append(f"Entry {i}: {row}")
 
-            if len(rows) > 50:
-                parts.append(f"... and {len(rows) - 50} more entries")
+            if row_count > 50:
+                parts.append(f"... and {row_count - 50} more entries")
 
     # Include RAG chunks
     rag_chunks = cache.get("rag_chunks", [])
@@ -546,41 +625,54 @@ def _build_cache_context_for_answer(cache: Dict[str, Any]) -> str:
     return "\n".join(parts)
 
 
+# Keyword screens are compiled into one alternation each (matching anywhere in
+# the lowercased question, like the substring checks they replace)
+_CALENDAR_KEYWORDS = (
+    "event",
+    "events",
+    "happening",
+    "schedule",
+    "calendar",
+    "activity",
+    "activities",
+    "this week",
+    "next week",
+    "today",
+    "tomorrow",
+    "weekend",
+    "saturday",
+    "sunday",
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "what's on",
+    "what is on",
+    "going on",
+    "things to do",
+    "community event",
+    "meeting",
+    "workshop",
+)
+_CALENDAR_RE = re.compile("|".join(map(re.escape, _CALENDAR_KEYWORDS)))
+
+
 def _is_calendar_question(question: str) -> bool:
     """Check if the question is about events, calendar, or schedules."""
-    calendar_keywords = [
-        "event",
-        "events",
-        "happening",
-        "schedule",
-        "calendar",
-        "activity",
-        "activities",
-        "this week",
-        "next week",
-        "today",
-        "tomorrow",
-        "weekend",
-        "saturday",
-        "sunday",
-        "monday",
-        "tuesday",
-        "wednesday",
-        "thursday",
-        "friday",
-        "what's on",
-        "what is on",
-        "going on",
-        "things to do",
-        "community event",
-        "meeting",
-        "workshop",
-    ]
-    question_lower = question.lower()
-    return any(kw in question_lower for kw in calendar_keywords)
-
-
-def _run_rag(question: str, plan: Dict[str, Any], conversation_history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+    return _CALENDAR_RE.search(question.lower()) is not None
+
+
+# Most retrievals _run_rag runs at once, however many policy sources the router returns
+_RAG_MAX_WORKERS = 8
+
+
+def _run_rag(
+    question: str,
+    plan: Dict[str, Any],
+    conversation_history: Optional[List[Dict[str, str]]] = None,
+    on_chunk: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
     k = int(plan.get("k", 5))
     tags = plan.get("transcript_tags")
     sources = plan.get("policy_sources")
@@ -593,57 +685,52 @@ def _run_rag(question: str, plan: Dict[str, Any], conversation_history: Optional
     # Use at least 20 chunks to ensure we get multiple unique sources
     retrieval_k = max(k * 3, 20)  # At least 20 chunks for source diversity
 
-    # transcripts
+    # Embed the question once; every retrieval below searches with the same vector
     try:
-        t_res = rag_retrieval.retrieve_transcripts(question, tags=tags, k=retrieval_k)
-        t_chunks = t_res.get("chunks", [])
-        print(f"  📝 Transcripts: {len(t_chunks)} chunks found")
-        combined_chunks.extend(t_chunks)
-        combined_meta.extend(t_res.get("metadata", []))
+        query_vector = rag_retrieval.embed_query(question)
     except Exception as e:
-        print(f"  ⚠️ Transcript retrieval error: {e}")
+        print(f"  ⚠️ Query embedding error, each retrieval will embed on its own: {e}")
+        query_vector = None
+
+    # Transcript and policy retrievals are independent, so they run concurrently;
+    # results are still combined in this order (transcripts, then each policy source)
+    jobs = [("📝 Transcripts", functools.partial(rag_retrieval.retrieve_transcripts, question, tags=tags, k=retrieval_k, query_vector=query_vector))]
+    if sources:
+        print(f"  🔍 Policy sources requested: {sources}")
+        # When specific policy sources are requested
+        jobs += [(f"📋 Policy source {src}", functools.partial(rag_retrieval.retrieve_policies, question, k=retrieval_k, source=src, query_vector=query_vector)) for src in sources]
+    else:
+        print("  🔍 No specific policy sources, searching all policies")
+        jobs.append(("📋 Policies", functools.partial(rag_retrieval.retrieve_policies, question, k=retrieval_k, query_vector=query_vector)))
 
-    # policies
-    try:
-        if sources:
-            print(f"  🔍 Policy sources requested: {sources}")
-            # When specific policy sources are requested
-            for src in sources:
-                print(f"  🔍 Querying policy source: {src}")
-                p_res = rag_retrieval.retrieve_policies(question, k=retrieval_k, source=src)
-                p_chunks = p_res.get("chunks", [])
-                print(f"    📋 Found {len(p_chunks)} chunks from {src}")
-                combined_chunks.extend(p_chunks)
-                combined_meta.extend(p_res.get("metadata", []))
-        else:
-            print("  🔍 No specific policy sources, searching all policies")
-            p_res = rag_retrieval.retrieve_policies(question, k=retrieval_k)
-            p_chunks = p_res.get("chunks", [])
-            print(f"  📋 Policies: {len(p_chunks)} chunks found")
-            combined_chunks.extend(p_chunks)
-            combined_meta.extend(p_res.get("metadata", []))
-    except Exception as e:
-        print(f"  ⚠️ Policy retrieval error: {e}")
+    with ThreadPoolExecutor(max_workers=min(_RAG_MAX_WORKERS, len(jobs))) as executor:
+        futures = [(label, executor.submit(fn)) for label, fn in jobs]
+    for label, future in futures:
+        try:
+            res = future.result()
+        except Exception as e:
+            print(f"  ⚠️ {label} retrieval error: {e}")
+            continue
+        chunks = res.get("chunks", [])
+        print(f"  {label}: {len(chunks)} chunks found")
+        combined_chunks.extend(chunks)
+        combined_meta.extend(res.get("metadata", []))
 
     print(f"  📊 Total combined chunks: {len(combined_chunks)} (transcripts + policies)")
 
-    answer = _compose_rag_answer(question, combined_chunks, combined_meta, conversation_history)
+    answer = _compose_rag_answer(question, combined_chunks, combined_meta, conversation_history, on_chunk=on_chunk)
     return {"answer": answer, "chunks": combined_chunks, "metadata": combined_meta}
 
 
-def _run_sql(question: str, conversation_history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
-    # Import sql_retrieval (MySQL) only when SQL path is actually used
-    import main_chat.sql_pipeline.sql_retrieval as sql_retrieval  # noqa: WPS433
+_LOCATION_KEYWORDS = ("map", "maps", "where", "location", "locations", "hotspot", "cluster", "show on a map", "geo", "geography", "near", "place", "places", "area", "neighborhood", "neighborhoods")
+_DATA_VISUALIZATION_KEYWORDS = ("show", "display", "visualize", "see", "find", "list")
+_MAP_HINT_RE = re.compile("|".join(map(re.escape, _LOCATION_KEYWORDS + _DATA_VISUALIZATION_KEYWORDS)))
 
-    database = os.environ.get("PGSCHEMA", "public")
-    schema = sql_retrieval._fetch_schema_snapshot(database)
-    # Base metadata from catalog selection
-    metadata = sql_retrieval._build_question_metadata(question)
+
+def _add_location_hints(question: str, metadata: str) -> str:
+    """Add need_location/prefer_location hints to the metadata JSON for the SQL prompt."""
     # Strongly encourage maps for location-related queries and many data queries
-    location_keywords = ["map", "maps", "where", "location", "locations", "hotspot", "cluster", "show on a map", "geo", "geography", "near", "place", "places", "area", "neighborhood", "neighborhoods"]
-    data_visualization_keywords = ["show", "display", "visualize", "see", "find", "list"]
-    question_lower = (question or "").lower()
-    want_map = any(w in question_lower for w in location_keywords) or any(w in question_lower for w in data_visualization_keywords)
+    want_map = _MAP_HINT_RE.search((question or "").lower()) is not None
 
     # Default to including location when possible
     if metadata:
@@ -662,7 +749,7 @@ def _run_sql(question: str, conversation_history: Optional[List[Dict[str, str]]]
         else:
             meta_obj = {"hints": hints}
         try:
-            metadata = json.dumps(meta_obj, ensure_ascii=False)
+            metadata = json.dumps(meta_obj, ensure_ascii=False, sort_keys=True)
         except Exception:
             pass
     else:
@@ -672,7 +759,31 @@ def _run_sql(question: str, conversation_history: Optional[List[Dict[str, str]]]
             metadata = json.dumps(meta_obj, ensure_ascii=False)
         except Exception:
             pass
-    sql = sql_retrieval._llm_generate_sql(question, schema, config.GEMINI_MODEL, metadata, conversation_history)
+    return metadata
+
+
+def _run_sql(
+    question: str,
+    conversation_history: Optional[List[Dict[str, str]]] = None,
+    on_chunk: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    # Import sql_retrieval (MySQL) only when SQL path is actually used
+    import main_chat.sql_pipeline.sql_retrieval as sql_retrieval  # noqa: WPS433
+
+    database = os.environ.get("PGSCHEMA", "public")
+    # The snapshot is cached in sql_retrieval (SCHEMA_CACHE_TTL_SECONDS); on a miss the
+    # fetch runs in the background while Gemini selects tables.
+    # Table selection and SQL generation overlap; location hints are applied to
+    # whichever metadata (speculative or selected) the SQL is generated from.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        schema_future = executor.submit(sql_retrieval._fetch_schema_snapshot, database)
+        metadata, sql = sql_retrieval._generate_sql_with_metadata(
+            question,
+            schema_future,
+            conversation_history,
+            prepare_metadata=lambda meta: _add_location_hints(question, meta),
+        )
+        schema = schema_future.result()
     exec_out = sql_retrieval._execute_with_retries(
         initial_sql=sql,
         question=question,
@@ -687,35 +798,60 @@ def _run_sql(question: str, conversation_history: Optional[List[Dict[str, str]]]
         result,
         config.GEMINI_SUMMARY_MODEL,
         conversation_history,
+        on_chunk=on_chunk,
     )
     return {"answer": answer, "sql": final_sql, "result": result}
 
 
-def _run_hybrid(question: str, plan: Dict[str, Any], conversation_history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
-    sql_part = _run_sql(question, conversation_history)
-    rag_part = _run_rag(question, plan, conversation_history)
+# Rows of the SQL result included in the hybrid merge prompt
+_HYBRID_SAMPLE_ROWS = 20
+
+_MERGE_SYSTEM_PROMPT = (
+    "You are a friendly, non-technical assistant explaining information about DORCHESTER ONLY to a general audience.\n"
+    "This system is configured for DORCHESTER ONLY. All data queries are automatically filtered to Dorchester only.\n"
+    "Use clear, everyday language and speak as if you are talking directly to the user.\n"
+    "You have access to both numeric data (counts, trends, patterns) and contextual information (people's experiences, policy documents, community perspectives).\n\n"
+    "Weave these together naturally into a single, cohesive answer that tells a complete story.\n"
+    "Blend the numbers with the context so the user understands both what is happening and why it matters.\n"
+    "Focus on what the information means for people in Dorchester, not on technical details or data sources.\n"
+    "If you see any data from other neighborhoods, ignore it completely and only discuss Dorchester.\n\n"
+    "Do NOT mention SQL, databases, RAG, retrieval, or any internal tools. Just speak as a helpful information bot.\n"
+    "Never invent data or trends not present in the inputs.\n"
+    f"'sql_result' shows at most the first {_HYBRID_SAMPLE_ROWS} rows; its 'row_count' is the full number of rows."
+)
+_MERGE_CONVERSATION_NOTE = "\n\nYou are in a conversation. Reference previous questions naturally when it helps the user."
+
+
+def _run_hybrid(
+    question: str,
+    plan: Dict[str, Any],
+    conversation_history: Optional[List[Dict[str, str]]] = None,
+    on_chunk: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    # The SQL and RAG branches share nothing, so their Gemini/DB round-trips overlap
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        sql_future = executor.submit(_run_sql, question, conversation_history)
+        rag_future = executor.submit(_run_rag, question, plan, conversation_history)
+        sql_part = sql_future.result()
+        rag_part = rag_future.result()
 
     # Merge with a short LLM call
 
-    merge_system = (
-        "You are a friendly, non-technical assistant explaining information about DORCHESTER ONLY to a general audience.\n"
-        "This system is configured for DORCHESTER ONLY. All data queries are automatically filtered to Dorchester only.\n"
-        "Use clear, everyday language and speak as if you are talking directly to the user.\n"
-        "You have access to both numeric data (counts, trends, patterns) and contextual information (people's experiences, policy documents, community perspectives).\n\n"
-        "Weave these together naturally into a single, cohesive answer that tells a complete story.\n"
-        "Blend the numbers with the context so the user understands both what is happening and why it matters.\n"
-        "Focus on what the information means for people in Dorchester, not on technical details or data sources.\n"
-        "If you see any data from other neighborhoods, ignore it completely and only discuss Dorchester.\n\n"
-        "Do NOT mention SQL, databases, RAG, retrieval, or any internal tools. Just speak as a helpful information bot.\n"
-        "Never invent data or trends not present in the inputs." + ("\n\nYou are in a conversation. Reference previous questions naturally when it helps the user." if conversation_history else "")
-    )
+    merge_system = _MERGE_SYSTEM_PROMPT + (_MERGE_CONVERSATION_NOTE if conversation_history else "")
+    # Send the merge call a sample of the rows plus the full count, not every row
+    import main_chat.sql_pipeline.sql_retrieval as sql_retrieval  # noqa: WPS433
+
+    sql_result = sql_part.get("result") or {}
+    sql_sample = sql_retrieval._summary_blob(sql_result, _HYBRID_SAMPLE_ROWS)
+    if sql_result.get("error"):
+        sql_sample["error"] = sql_result["error"]
     blob = {
         "sql_answer": sql_part.get("answer"),
-        "sql_result": sql_part.get("result"),
+        "sql_result": sql_sample,
         "rag_answer": rag_part.get("answer"),
-        "rag_sources": [m.get("source", "?") for m in rag_part.get("metadata", [])][:10],
+        "rag_sources": list(dict.fromkeys(m.get("source", "?") for m in rag_part.get("metadata", [])))[:10],
     }
-    merge_user = "Question:\n" + question + "\n\n" + "Inputs (JSON):\n" + json.dumps(blob, ensure_ascii=False, default=str)
+    merge_user = "Question:\n" + question + "\n\n" + "Inputs (JSON):\n" + _dumps_json(blob)
 
     # Build full prompt with conversation history
     # full_prompt = merge_system + "\n\n"
@@ -736,13 +872,20 @@ def _run_hybrid(question: str, plan: Dict[str, Any], conversation_history: Optio
         # Add current merge request
         messages.append({"role": "user", "content": merge_user})
 
-        answer = config.generate_content_with_history(messages=messages, temperature=0, system_instruction=merge_system)
+        if on_chunk is not None:
+            # Only the merged answer is user-facing, so only the merge call streams
+            answer = config.generate_content_with_history_stream(messages=messages, temperature=0, system_instruction=merge_system, on_chunk=on_chunk)
+        else:
+            answer = config.generate_content_with_history(messages=messages, temperature=0, system_instruction=merge_system)
     except Exception:
         answer = (sql_part.get("answer") or "") + "\n\n" + (rag_part.get("answer") or "")
 
     return {"answer": answer, "sql": sql_part, "rag": rag_part}
 
 
+_ANSWER_HEADER = "\nAnswer:\n"
+
+
 def main() -> None:
     _fix_retrieval_vectordb_path()
 
@@ -769,22 +912,17 @@ def main() -> None:
                 # Validate DB env only when needed
                 if not os.environ.get("DATABASE_URL"):
                     print("DATABASE_URL not set; falling back to RAG.")
-                    out = _run_rag(question, plan)
-                    print("\nAnswer:\n" + out.get("answer", ""))
+                    config.print_streamed_answer(lambda on_chunk: _run_rag(question, plan, on_chunk=on_chunk).get("answer", ""), _ANSWER_HEADER)
                 else:
-                    out = _run_sql(question)
-                    print("\nAnswer:\n" + out.get("answer", ""))
+                    config.print_streamed_answer(lambda on_chunk: _run_sql(question, on_chunk=on_chunk).get("answer", ""), _ANSWER_HEADER)
             elif mode == "hybrid":
                 if not os.environ.get("DATABASE_URL"):
                     print("DATABASE_URL not set; running RAG only.")
-                    out = _run_rag(question, plan)
-                    print("\nAnswer:\n" + out.get("answer", ""))
+                    config.print_streamed_answer(lambda on_chunk: _run_rag(question, plan, on_chunk=on_chunk).get("answer", ""), _ANSWER_HEADER)
                 else:
-                    out = _run_hybrid(question, plan)
-                    print("\nAnswer:\n" + out.get("answer", ""))
+                    config.print_streamed_answer(lambda on_chunk: _run_hybrid(question, plan, on_chunk=on_chunk).get("answer", ""), _ANSWER_HEADER)
             else:  # rag
-                out = _run_rag(question, plan)
-                print("\nAnswer:\n" + out.get("answer", ""))
+                config.print_streamed_answer(lambda on_chunk: _run_rag(question, plan, on_chunk=on_chunk).get("answer", ""), _ANSWER_HEADER)
         except Exception as exc:  # noqa: BLE001
             print(f"Error: {exc}")
 
@@ -1,6 +1,6 @@
-from langchain_chroma import Chroma
 from pathlib import Path
 import sys
+import threading
 
 _PROJECT_ROOT = Path(__file__).resolve().parents[2]
 sys.path.insert(0, str(_PROJECT_ROOT))
@@ -27,6 +27,9 @@ class GeminiEmbeddings:
 
 def load_vectordb():
     """Load the unified vector database (policies, transcripts, client uploads, etc.)."""
+    # Imported here so SQL-only paths that import this module don't pay for chromadb
+    from langchain_chroma import Chroma
+
     embeddings = GeminiEmbeddings()
     vectordb = Chroma(
         persist_directory=str(config.VECTORDB_DIR),
@@ -35,7 +38,35 @@ def load_vectordb():
     return vectordb
 
 
-def retrieve(query, k=5, doc_type=None, tags=None, source=None, min_score=None, vectordb=None):
+# Shared handle so each retrieval doesn't reopen the Chroma store
+_vectordb = None
+_vectordb_lock = threading.Lock()
+
+
+def get_vectordb():
+    """Get or create the process-wide vector database handle."""
+    global _vectordb
+
+    if _vectordb is not None:
+        return _vectordb
+
+    with _vectordb_lock:
+        if _vectordb is None:
+            _vectordb = load_vectordb()
+        return _vectordb
+
+
+def embed_query(text):
+    """Embed a query once so several retrievals can share the vector."""
+    return GeminiEmbeddings().embed_query(text)
+
+
+def _parse_tags(raw):
+    """Split a comma-separated tag string into a set of non-empty, stripped tags."""
+    return set(filter(None, map(str.strip, (raw or "").split(","))))
+
+
+def retrieve(query, k=5, doc_type=None, tags=None, source=None, min_score=None, vectordb=None, query_vector=None):
     """
     Universal retrieval with flexible metadata filtering.
     [... rest of function unchanged ...]
@@ -49,7 +80,7 @@ def retrieve(query, k=5, doc_type=None, tags=None, source=None, min_score=None,
         k = 5
 
     if vectordb is None:
-        vectordb = load_vectordb()
+        vectordb = get_vectordb()
 
     # Build filter dictionary
     filter_dict = None
@@ -76,15 +107,22 @@ def retrieve(query, k=5, doc_type=None, tags=None, source=None, min_score=None,
     elif source:
         filter_dict = {"source": source}
 
+    wanted_tags = set(tags) if tags else None
+
     if min_score is not None:
-        results_with_scores = vectordb.similarity_search_with_score(query, k=k * 3 if tags else k, filter=filter_dict if filter_dict else None)
+        if query_vector is not None:
+            # Despite its name, langchain_chroma's vector variant returns the same raw
+            # distances as similarity_search_with_score (lower is closer), so one
+            # min_score cutoff applies to both paths
+            results_with_scores = vectordb.similarity_search_by_vector_with_relevance_scores(query_vector, k=k * 3 if tags else k, filter=filter_dict if filter_dict else None)
+        else:
+            results_with_scores = vectordb.similarity_search_with_score(query, k=k * 3 if tags else k, filter=filter_dict if filter_dict else None)
 
         if tags:
             filtered_results = []
             for doc, score in results_with_scores:
                 if "tags" in doc.metadata:
-                    doc_tags = [t.strip() for t in doc.metadata["tags"].split(",")]
-                    if any(tag in doc_tags for tag in tags):
+                    if not wanted_tags.isdisjoint(_parse_tags(doc.metadata["tags"])):
                         filtered_results.append((doc, score))
                         if len(filtered_results) >= k:
                             break
@@ -95,14 +133,16 @@ def retrieve(query, k=5, doc_type=None, tags=None, source=None, min_score=None,
 
         return {"chunks": [doc.page_content for doc, _ in filtered_results[:k]], "metadata": [doc.metadata for doc, _ in filtered_results[:k]], "scores": [score for _, score in filtered_results[:k]], "query": query}
     else:
-        results = vectordb.similarity_search(query, k=k * 3 if tags else k, filter=filter_dict if filter_dict else None)
+        if query_vector is not None:
+            results = vectordb.similarity_search_by_vector(query_vector, k=k * 3 if tags else k, filter=filter_dict if filter_dict else None)
+        else:
+            results = vectordb.similarity_search(query, k=k * 3 if tags else k, filter=filter_dict if filter_dict else None)
 
         if tags:
             filtered_results = []
             for doc in results:
                 if "tags" in doc.metadata:
-                    doc_tags = [t.strip() for t in doc.metadata["tags"].split(",")]
-                    if any(tag in doc_tags for tag in tags):
+                    if not wanted_tags.isdisjoint(_parse_tags(doc.metadata["tags"])):
                         filtered_results.append(doc)
                         if len(filtered_results) >= k:
                             break
@@ -112,14 +152,14 @@ def retrieve(query, k=5, doc_type=None, tags=None, source=None, min_score=None,
         return {"chunks": [doc.page_content for doc in results[:k]], "metadata": [doc.metadata for doc in results[:k]], "scores": None, "query": query}
 
 
-def retrieve_transcripts(query, tags=None, k=5):
+def retrieve_transcripts(query, tags=None, k=5, query_vector=None):
     """Convenience function for transcript-only search."""
-    return retrieve(query, k=k, doc_type="transcript", tags=tags)
+    return retrieve(query, k=k, doc_type="transcript", tags=tags, query_vector=query_vector)
 
 
-def retrieve_policies(query, k=5, source=None):
+def retrieve_policies(query, k=5, source=None, query_vector=None):
     """Convenience function for policy-only search."""
-    return retrieve(query, k=k, doc_type="policy", source=source)
+    return retrieve(query, k=k, doc_type="policy", source=source, query_vector=query_vector)
 
 
 def format_results(result_dict):
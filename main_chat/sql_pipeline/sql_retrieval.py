@@ -1,8 +1,20 @@
+import os
 import sys
 import json
 import re
+import time
+import atexit
+import functools
+import hashlib
+import operator
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from decimal import Decimal
 from pathlib import Path
-from typing import Any, Dict, List, Callable
+from typing import Any, Dict, List, Callable, Optional, Tuple
 
 import pymysql
 from pocketflow import Flow, Node
@@ -22,8 +34,68 @@ try:
     from langsmith import traceable  # type: ignore
 except Exception:
 
-    def traceable(func: Callable):  # type: ignore
-        return func
+    def traceable(*args: Any, **kwargs: Any):  # type: ignore
+        # Supports both @traceable and @traceable(name=...)
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+
+# Traced inputs/outputs are serialized on the calling thread before LangSmith's
+# background uploader sends them, so keep multi-KB prompt parts and row lists out
+_TRACE_TEXT_KEYS = ("schema", "metadata")
+
+
+def _trace_inputs(inputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace schema/metadata text and result rows in traced inputs with their sizes."""
+    slim = dict(inputs)
+    for key in _TRACE_TEXT_KEYS:
+        if isinstance(slim.get(key), str):
+            slim[key] = f"<{len(slim[key])} chars>"
+    if isinstance(slim.get("result"), dict):
+        slim["result"] = _trace_result(slim["result"])
+    return slim
+
+
+def _trace_result(result: Any) -> Any:
+    """Replace a result's rows with a row count (the columns and any error are kept)."""
+    if not isinstance(result, dict) or not isinstance(result.get("rows"), list):
+        return result
+    slim = dict(result)
+    slim["rows"] = f"<{len(result['rows'])} rows>"
+    return slim
+
+
+def _trace_outputs(outputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Slim a traced {"columns", "rows"} result, whether returned bare or under "result"/"output"."""
+    slim = _trace_result(outputs)
+    for key in ("result", "output"):
+        if isinstance(slim.get(key), dict):
+            slim = dict(slim)
+            slim[key] = _trace_result(slim[key])
+    return slim
+
+
+# Optional faster JSON encoder for result rows
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None
+
+# Optional SQL parser used to check generated SQL against the schema before it reaches MySQL
+try:
+    import sqlglot  # type: ignore
+    from sqlglot import exp as sqlglot_exp  # type: ignore
+except Exception:
+    sqlglot = None
+    sqlglot_exp = None
+
+
+def _dumps_rows(obj: Any) -> str:
+    """Serialize result rows to JSON; values JSON can't represent (Decimal, dates) fall back to str()."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, default=str)
 
 
 # @traceable(name="gemini_chat")
@@ -47,9 +119,9 @@ except Exception:
 # return _chat_with_model(prompt, model_name=model_name, temperature=temperature)
 
 
-def _get_db_connection():
+def _open_db_connection():
     """
-    Get a MySQL connection.
+    Open a new MySQL connection.
 
     Defaults are chosen to work out of the box with the Docker command we set up:
       host=localhost, port=3306, user=root, password="", database=sl_data
@@ -79,71 +151,341 @@ def _get_db_connection():
     return conn
 
 
+# Idle connections kept between queries so each question doesn't pay a new
+# TCP connect + MySQL auth handshake. Connections are opened lazily.
+_DB_POOL: "queue.LifoQueue[Any]" = queue.LifoQueue(maxsize=max(1, config.MYSQL_POOL_SIZE))
+
+# Caps connections checked out at once across threads; callers block for a free slot
+_DB_SLOTS = threading.BoundedSemaphore(max(1, config.MYSQL_POOL_MAX_CONNECTIONS))
+
+
+def _get_db_connection():
+    """
+    Get a MySQL connection from the pool, opening a new one if none are idle.
+
+    Blocks while MYSQL_POOL_MAX_CONNECTIONS connections are already in use.
+    Callers must hand the connection back with `_release_db_connection`.
+    """
+    _DB_SLOTS.acquire()
+    try:
+        return _checkout_db_connection()
+    except BaseException:
+        _DB_SLOTS.release()
+        raise
+
+
+def _checkout_db_connection():
+    try:
+        conn = _DB_POOL.get_nowait()
+    except queue.Empty:
+        return _open_db_connection()
+
+    try:
+        # Idle connections may have been dropped by the server (wait_timeout)
+        conn.ping(reconnect=True)
+    except Exception:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        return _open_db_connection()
+    return conn
+
+
+def _release_db_connection(conn) -> None:
+    """Return a connection to the pool, closing it if the pool is already full."""
+    try:
+        _DB_POOL.put_nowait(conn)
+    except queue.Full:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    finally:
+        _DB_SLOTS.release()
+
+
+@contextmanager
+def _pooled_connection():
+    """`with _pooled_connection() as conn:` checks a connection out and always returns it."""
+    conn = _get_db_connection()
+    try:
+        yield conn
+    finally:
+        _release_db_connection(conn)
+
+
+def _close_db_pool() -> None:
+    """Close every idle pooled connection (registered to run at interpreter exit)."""
+    while True:
+        try:
+            conn = _DB_POOL.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+atexit.register(_close_db_pool)
+
+
+# Schema snapshots keyed by database name: (time.monotonic() when fetched, snapshot)
+_SCHEMA_CACHE: Dict[str, Tuple[float, str]] = {}
+# Serializes refreshes so an expired entry is re-fetched once, not by every waiting thread
+_SCHEMA_CACHE_LOCK = threading.Lock()
+
+
 def _fetch_schema_snapshot(database: str) -> str:
     """
     Fetch a simple schema snapshot from MySQL: table_name (col1, col2, ...).
 
+    Snapshots are cached in-process for SCHEMA_CACHE_TTL_SECONDS since the
+    schema rarely changes within a session.
+
     The `database` argument is kept for API compatibility but the active
     database comes from the MySQL connection itself.
     """
-    conn = _get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT table_name, column_name
-                FROM information_schema.columns
-                WHERE table_schema = DATABASE()
-                ORDER BY table_name, ordinal_position
-                """
-            )
-            rows = cur.fetchall()
-    finally:
-        conn.close()
+    hit = _SCHEMA_CACHE.get(database)
+    if hit and time.monotonic() - hit[0] < config.SCHEMA_CACHE_TTL_SECONDS:
+        return hit[1]
+
+    with _SCHEMA_CACHE_LOCK:
+        # Another thread may have refreshed it while this one waited for the lock
+        hit = _SCHEMA_CACHE.get(database)
+        if hit and time.monotonic() - hit[0] < config.SCHEMA_CACHE_TTL_SECONDS:
+            return hit[1]
+        snapshot = _query_schema_snapshot()
+        _SCHEMA_CACHE[database] = (time.monotonic(), snapshot)
+        return snapshot
+
+
+def _invalidate_schema_cache(database: Optional[str] = None) -> None:
+    """Drop the cached snapshot for `database`, or every snapshot when it is None."""
+    with _SCHEMA_CACHE_LOCK:
+        if database is None:
+            _SCHEMA_CACHE.clear()
+        else:
+            _SCHEMA_CACHE.pop(database, None)
+
+
+# Answers for repeated questions, keyed by `_question_cache_key`, oldest first:
+# {"sql", "result", "answer", "ts"} with ts from time.monotonic()
+_QUERY_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+_QUESTION_PUNCT_RE = re.compile(r"[^\w\s]")
+
+# SQL whose result depends on when it runs ("this week's events"); never cached
+_NONDETERMINISTIC_SQL_RE = re.compile(
+    r"\b(?:NOW|CURDATE|CURTIME|SYSDATE|UTC_DATE|UTC_TIME|UTC_TIMESTAMP|UNIX_TIMESTAMP|RAND|UUID)\s*\(|\bCURRENT_(?:DATE|TIME|TIMESTAMP)\b",
+    re.IGNORECASE,
+)
+
+
+@functools.lru_cache(maxsize=512)
+def _question_cache_key(question: str, data_version: str) -> str:
+    """
+    Canonical cache key for a question: lowercased, punctuation stripped,
+    whitespace collapsed, combined with the `_data_version` it was answered against.
+    """
+    normalized = " ".join(_QUESTION_PUNCT_RE.sub(" ", question.lower()).split())
+    return hashlib.blake2b(f"{data_version}\n{normalized}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+# (the schema/metadata values last hashed, their digest); rehashed only when one of them changes
+_DATA_VERSION: Tuple[Tuple[Any, ...], str] = ((), "")
+
 
-    table_to_columns: Dict[str, List[str]] = {}
-    for table_name, column_name in rows:
-        table_to_columns.setdefault(table_name, []).append(column_name)
+def _data_version(database: str) -> str:
+    """
+    Digest of the schema snapshot, the tables catalog and the metadata files.
+
+    Part of every question-cache key, so a schema change or a metadata edit
+    makes earlier answers unreachable instead of serving them until the TTL.
+    """
+    global _DATA_VERSION
 
-    lines: List[str] = []
-    for table_name, columns in table_to_columns.items():
-        lines.append(f"{table_name} (" + ", ".join(columns) + ")")
+    catalog = _load_catalog_entries()
+    parts = (_fetch_schema_snapshot(database), catalog, _read_selected_metadata_json([c["table"] for c in catalog], catalog), _read_metadata_text())
+    # The loaders mostly hand back the same cached objects, so this is usually identity checks
+    cached_parts, digest = _DATA_VERSION
+    if cached_parts == parts:
+        return digest
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(json.dumps(part, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+    digest = h.hexdigest()
+    _DATA_VERSION = (parts, digest)
+    return digest
+
+
+def _get_cached_answer(question: str, data_version: str) -> Optional[Dict[str, Any]]:
+    key = _question_cache_key(question, data_version)
+    entry = _QUERY_CACHE.get(key)
+    if entry is None:
+        return None
+    if time.monotonic() - entry["ts"] >= config.QUERY_CACHE_TTL_SECONDS:
+        _QUERY_CACHE.pop(key, None)
+        return None
+    _QUERY_CACHE.move_to_end(key)
+    return entry
+
+
+def _store_cached_answer(question: str, data_version: str, sql: str, result: Dict[str, Any], answer: str) -> None:
+    # A failed query (MySQL or Gemini hiccup) should be retried next time, not replayed
+    if config.QUERY_CACHE_MAX_ENTRIES <= 0 or result.get("error") or _NONDETERMINISTIC_SQL_RE.search(sql or ""):
+        return
+    key = _question_cache_key(question, data_version)
+    _QUERY_CACHE[key] = {"sql": sql, "result": result, "answer": answer, "ts": time.monotonic()}
+    _QUERY_CACHE.move_to_end(key)
+    while len(_QUERY_CACHE) > config.QUERY_CACHE_MAX_ENTRIES:
+        _QUERY_CACHE.popitem(last=False)
+
+
+def _query_schema_snapshot() -> str:
+    """Read the table/column listing for the connection's database from information_schema."""
+    with _pooled_connection() as conn, conn.cursor() as cur:
+        # Let MySQL assemble one "col1, col2, ..." string per table; the default
+        # group_concat_max_len (1024 bytes) would cut wide tables short
+        cur.execute("SET SESSION group_concat_max_len = 1048576")
+        cur.execute(
+            """
+            SELECT table_name,
+                   GROUP_CONCAT(column_name ORDER BY ordinal_position SEPARATOR ', ')
+            FROM information_schema.columns
+            WHERE table_schema = DATABASE()
+            GROUP BY table_name
+            ORDER BY table_name
+            """
+        )
+        rows = cur.fetchall()
+
+    lines = [f"{table_name} ({columns})" for table_name, columns in rows]
     return "\n".join(lines) if lines else "(no tables)"
 
 
-def _get_unique_values(table_name: str, column_name: str, schema: str = "public", limit: int = 50) -> List[Any]:
+# Distinct column values sampled for no-rows hints, least recently used first:
+# (schema, table, column, limit) -> (time.monotonic() when read, values)
+_UNIQUE_VALUES_CACHE: "OrderedDict[Tuple[str, str, str, int], Tuple[float, List[Any]]]" = OrderedDict()
+_UNIQUE_VALUES_TTL_SECONDS = 600
+_UNIQUE_VALUES_CACHE_MAX = 1024
+_UNIQUE_VALUES_CACHE_LOCK = threading.Lock()
+
+
+def _get_unique_values(table_name: str, column_name: str, schema: Optional[str] = None, limit: int = 50) -> List[Any]:
     """Get unique values from a column to help users see available options."""
-    conn = _get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                f"""
-                SELECT DISTINCT `{column_name}`
-                FROM `{table_name}`
-                WHERE `{column_name}` IS NOT NULL
-                ORDER BY `{column_name}`
-                LIMIT %s
-                """,
-                (limit,),
-            )
-            rows = cur.fetchall()
-            return [row[0] for row in rows]
-    except Exception as exc:
-        # If query times out or fails, return empty list
-        print(f"[Warning] Could not fetch unique values for {table_name}.{column_name}: {exc}", file=sys.stderr)
-        return []
-    finally:
-        conn.close()
+    return _get_unique_values_multi(table_name, [column_name], limit, schema_name=schema).get(column_name, [])
+
+
+# Server-side cap on a unique-values probe; a slow scan is dropped rather than stalling the retry
+_UNIQUE_VALUES_MAX_EXECUTION_MS = 5000
+# MySQL error raised when MAX_EXECUTION_TIME interrupts a statement
+_ER_QUERY_TIMEOUT = 3024
+# Errors about the connection rather than the SQL: server gone away, lost connection.
+# Connect-time failures never get this far; _open_db_connection exits on them.
+_TERMINAL_MYSQL_ERRORS = frozenset({2006, 2013})
+# "Table doesn't exist" / "Unknown column": the cached schema snapshot may be out of date
+_SCHEMA_MISMATCH_MYSQL_ERRORS = frozenset({1146, 1054})
+
+
+def _mysql_error_code(exc: Exception) -> Optional[int]:
+    code = exc.args[0] if getattr(exc, "args", None) else None
+    return code if isinstance(code, int) else None
+
+
+def _query_unique_values(cur, schema_name: str, table_name: str, column_names: List[str], limit: int) -> Dict[str, List[Any]]:
+    """
+    DISTINCT values of several columns in one UNION ALL statement, one branch per column.
+
+    Every value comes back as text (CAST ... AS CHAR) so branches over differently
+    typed columns combine without MySQL coercing them unpredictably. That is
+    lossless for their only use: suggestions rendered with str() in prompts and answers.
+    """
+    branches = [
+        f"""
+        SELECT {idx} AS col_idx, CAST(raw AS CHAR) AS val FROM (
+            SELECT DISTINCT `{column_name}` AS raw
+            FROM `{schema_name}`.`{table_name}`
+            WHERE `{column_name}` IS NOT NULL
+            ORDER BY raw
+            LIMIT %s
+        ) AS u{idx}
+        """
+        for idx, column_name in enumerate(column_names)
+    ]
+    sql = f"SELECT /*+ MAX_EXECUTION_TIME({_UNIQUE_VALUES_MAX_EXECUTION_MS}) */ * FROM ({' UNION ALL '.join(branches)}) AS unique_values"
+    cur.execute(sql, (limit,) * len(column_names))
+    values: Dict[str, List[Any]] = {name: [] for name in column_names}
+    for idx, val in cur:
+        values[column_names[idx]].append(val)
+    return values
+
+
+def _get_unique_values_multi(table_name: str, column_names: List[str], limit: int = 50, schema_name: Optional[str] = None) -> Dict[str, List[Any]]:
+    """
+    Get unique values for several columns of one table.
+
+    `schema_name` defaults to the connection's database (MYSQL_DB). Values
+    are cached for _UNIQUE_VALUES_TTL_SECONDS; uncached columns are fetched
+    in a single round trip. If that statement fails for any reason but the
+    execution cap, each column is retried alone so one bad column is simply
+    left out.
+    """
+    schema_name = schema_name or config.MYSQL_DB
+    values: Dict[str, List[Any]] = {}
+    now = time.monotonic()
+    missing = []
+    with _UNIQUE_VALUES_CACHE_LOCK:
+        for column_name in column_names:
+            key = (schema_name, table_name, column_name, limit)
+            hit = _UNIQUE_VALUES_CACHE.get(key)
+            if hit and now - hit[0] < _UNIQUE_VALUES_TTL_SECONDS:
+                _UNIQUE_VALUES_CACHE.move_to_end(key)
+                values[column_name] = hit[1]
+            else:
+                missing.append(column_name)
+    if not missing:
+        return values
+
+    fetched: Dict[str, List[Any]] = {}
+    with _pooled_connection() as conn, conn.cursor() as cur:
+        try:
+            fetched = _query_unique_values(cur, schema_name, table_name, missing, limit)
+        except Exception as exc:
+            # After hitting the execution cap, per-column passes would only be slow again
+            if len(missing) == 1 or _mysql_error_code(exc) == _ER_QUERY_TIMEOUT:
+                print(f"[Warning] Could not fetch unique values for {table_name}.{', '.join(missing)}: {exc}", file=sys.stderr)
+            else:
+                for column_name in missing:
+                    try:
+                        fetched.update(_query_unique_values(cur, schema_name, table_name, [column_name], limit))
+                    except Exception as col_exc:
+                        print(f"[Warning] Could not fetch unique values for {table_name}.{column_name}: {col_exc}", file=sys.stderr)
+
+    read_at = time.monotonic()
+    with _UNIQUE_VALUES_CACHE_LOCK:
+        for column_name, column_values in fetched.items():
+            key = (schema_name, table_name, column_name, limit)
+            _UNIQUE_VALUES_CACHE[key] = (read_at, column_values)
+            _UNIQUE_VALUES_CACHE.move_to_end(key)
+        while len(_UNIQUE_VALUES_CACHE) > _UNIQUE_VALUES_CACHE_MAX:
+            _UNIQUE_VALUES_CACHE.popitem(last=False)
+    values.update(fetched)
+    return values
+
+
+_FROM_TABLE_PAIR_RE = re.compile(r'FROM\s+"?(\w+)"?\s+"?(\w+)"?', re.IGNORECASE)
+# "(col1, col2, ...)" column list in a schema snapshot line
+_PAREN_LIST_RE = re.compile(r"\(([^)]+)\)")
 
 
 def _get_table_columns_from_sql(sql: str, schema_snapshot: str) -> Dict[str, List[str]]:
     """Extract table and column names from SQL query to identify which columns to get unique values from."""
-    import re
-
     # Simple extraction - look for table names in FROM/JOIN clauses
     table_cols: Dict[str, List[str]] = {}
     # Try to extract table name from FROM clause
-    from_match = re.search(r'FROM\s+"?(\w+)"?\s+"?(\w+)"?', sql, re.IGNORECASE)
+    from_match = _FROM_TABLE_PAIR_RE.search(sql)
     if from_match:
         # schema_part = from_match.group(1)
         table_name = from_match.group(2) if from_match.group(2) else from_match.group(1)
@@ -152,30 +494,45 @@ def _get_table_columns_from_sql(sql: str, schema_snapshot: str) -> Dict[str, Lis
         match = re.search(table_pattern, schema_snapshot, re.IGNORECASE)
         if match:
             cols_str = match.group(0)
-            cols_match = re.search(r"\(([^)]+)\)", cols_str)
+            cols_match = _PAREN_LIST_RE.search(cols_str)
             if cols_match:
                 cols = [c.strip().strip('"') for c in cols_match.group(1).split(",")]
                 table_cols[table_name] = cols
     return table_cols
 
 
+_FENCE_SQL_RE = re.compile(r"```[ \t]*(?:sql|mysql)?[ \t]*\n([\s\S]*?)```", re.IGNORECASE)
+_FENCE_ANY_RE = re.compile(r"```([\s\S]*?)```")
+_SQL_LANG_TAGS = frozenset({"sql", "mysql"})
+
+
 def _extract_sql_from_text(text: str) -> str:
     t = text.strip()
-    m = re.search(r"```[ \t]*(?:sql|mysql)?[ \t]*\n([\s\S]*?)```", t, flags=re.IGNORECASE)
+    m = _FENCE_SQL_RE.search(t)
     if m:
         content = m.group(1).strip()
     else:
-        m2 = re.search(r"```([\s\S]*?)```", t)
+        m2 = _FENCE_ANY_RE.search(t)
         if m2:
             content = m2.group(1).strip()
         else:
             content = t
     lines = content.splitlines()
-    if lines and lines[0].strip().lower() in ("sql", "mysql"):
+    if lines and lines[0].strip().lower() in _SQL_LANG_TAGS:
         content = "\n".join(lines[1:]).strip()
     return content
 
 
+_DORCHESTER_FILTER_RES = (
+    re.compile(r"neighborhood.*LIKE.*['\"]?dorchester", re.IGNORECASE),
+    re.compile(r"district.*=.*['\"]?C11['\"]?", re.IGNORECASE),
+    re.compile(r"district.*IN.*\([^)]*['\"]?C11['\"]?", re.IGNORECASE),
+)
+_FROM_TABLE_RE = re.compile(r"FROM\s+`?(\w+)`?", re.IGNORECASE)
+_WHERE_RE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+_TRAILING_CLAUSE_RE = re.compile(r"\b(?:ORDER BY|LIMIT|GROUP BY|HAVING)\b", re.IGNORECASE)
+
+
 def _ensure_dorchester_filter(sql: str, schema: str) -> str:
     """
     Post-process SQL to ensure it has a Dorchester filter.
@@ -188,13 +545,13 @@ def _ensure_dorchester_filter(sql: str, schema: str) -> str:
         return sql
 
     # Check if Dorchester filter already exists (more robust check)
-    has_dorchester_filter = re.search(r"neighborhood.*LIKE.*['\"]?dorchester", sql, re.IGNORECASE) or re.search(r"district.*=.*['\"]?C11['\"]?", sql, re.IGNORECASE) or re.search(r"district.*IN.*\([^)]*['\"]?C11['\"]?", sql, re.IGNORECASE)
+    has_dorchester_filter = any(pattern.search(sql) for pattern in _DORCHESTER_FILTER_RES)
 
     if has_dorchester_filter:
         return sql
 
     # Extract table name from FROM clause
-    from_match = re.search(r"FROM\s+`?(\w+)`?", sql, re.IGNORECASE)
+    from_match = _FROM_TABLE_RE.search(sql)
     if not from_match:
         return sql
 
@@ -229,13 +586,13 @@ def _ensure_dorchester_filter(sql: str, schema: str) -> str:
             return sql
 
     # Inject the filter into WHERE clause
-    where_match = re.search(r"\bWHERE\b", sql, re.IGNORECASE)
+    where_match = _WHERE_RE.search(sql)
     if where_match:
         # Find the end of existing WHERE conditions (before ORDER BY, LIMIT, etc.)
         insert_pos = where_match.end()
-        where_end_match = re.search(r"\b(?:ORDER BY|LIMIT|GROUP BY|HAVING)\b", sql[insert_pos:], re.IGNORECASE)
+        where_end_match = _TRAILING_CLAUSE_RE.search(sql, insert_pos)
         if where_end_match:
-            insert_pos = insert_pos + where_end_match.start()
+            insert_pos = where_end_match.start()
             # Insert before ORDER BY/LIMIT
             sql = sql[:insert_pos].rstrip() + " AND " + dorchester_filter + " " + sql[insert_pos:].lstrip()
         else:
@@ -243,7 +600,7 @@ def _ensure_dorchester_filter(sql: str, schema: str) -> str:
             sql = sql.rstrip().rstrip(";") + " AND " + dorchester_filter
     else:
         # No WHERE clause, add one before ORDER BY/LIMIT
-        order_match = re.search(r"\b(?:ORDER BY|LIMIT|GROUP BY|HAVING)\b", sql, re.IGNORECASE)
+        order_match = _TRAILING_CLAUSE_RE.search(sql)
         if order_match:
             insert_pos = order_match.start()
             sql = sql[:insert_pos].rstrip() + " WHERE " + dorchester_filter + " " + sql[insert_pos:].lstrip()
@@ -254,59 +611,213 @@ def _ensure_dorchester_filter(sql: str, schema: str) -> str:
     return sql
 
 
+# Parsed metadata/catalog JSON keyed by path, with the file mtime it was read at
+_JSON_CACHE: Dict[str, Tuple[float, Any]] = {}
+
+
+def _load_json_cached(path: Any) -> Any:
+    """
+    Load a JSON file, reusing the parsed object while the file's mtime is unchanged.
+
+    The returned object is shared between callers and must not be mutated.
+    """
+    key = str(path)
+    mtime = os.stat(key).st_mtime
+    hit = _JSON_CACHE.get(key)
+    if hit and hit[0] == mtime:
+        return hit[1]
+    with open(key, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    _JSON_CACHE[key] = (mtime, data)
+    return data
+
+
 def _read_metadata_text() -> str:
     path = config.SCHEMA_METADATA_PATH
     if not path:
         return ""
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return json.dumps(data, ensure_ascii=False, indent=2)
+        data = _load_json_cached(path)
+        # Canonical key order keeps the prompt prefix byte-identical across calls
+        return json.dumps(data, ensure_ascii=False, indent=2, sort_keys=True)
     except Exception as exc:
         print(f"Warning: could not read metadata JSON: {exc}", file=sys.stderr)
         return ""
 
 
+# (parsed catalog object, its filtered entries); reused while _load_json_cached returns the same object
+_CATALOG_ENTRIES: Tuple[Any, List[Dict[str, Any]]] = (None, [])
+
+
 def _load_catalog_entries() -> List[Dict[str, Any]]:
     """Load tables catalog from METADATA_CATALOG_PATH or default location."""
+    global _CATALOG_ENTRIES
+
     path = config.METADATA_CATALOG_PATH
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = _load_json_cached(path)
+        if data is _CATALOG_ENTRIES[0]:
+            return _CATALOG_ENTRIES[1]
         if isinstance(data, list):
-            return [x for x in data if isinstance(x, dict) and "table" in x]
+            entries = [x for x in data if isinstance(x, dict) and "table" in x]
+            _CATALOG_ENTRIES = (data, entries)
+            return entries
     except Exception:
         pass
     return []
 
 
+# Catalog description embeddings keyed by catalog path: (catalog mtime, table names, unit vectors)
+_TABLE_EMBEDDINGS: Dict[str, Tuple[float, List[str], List[List[float]]]] = {}
+_TABLE_EMBEDDINGS_LOCK = threading.Lock()
+# Failed catalog embeddings (outage, quota): path -> (catalog mtime, time.monotonic() to retry after).
+# Until then table selection goes straight to Gemini instead of re-sending the batch.
+_TABLE_EMBEDDING_FAILURES: Dict[str, Tuple[float, float]] = {}
+_TABLE_EMBEDDING_RETRY_SECONDS = 300
+
+# Tables scoring within this much of the best match are selected with it, up to the cap
+_TABLE_SELECT_MARGIN = 0.05
+_TABLE_SELECT_MAX = 3
+
+
+def _unit_vector(values: Any) -> List[float]:
+    vec = [float(v) for v in values]
+    norm = sum(v * v for v in vec) ** 0.5
+    return [v / norm for v in vec] if norm else vec
+
+
+def _catalog_embeddings(catalog: List[Dict[str, Any]]) -> Tuple[List[str], List[List[float]]]:
+    """
+    Embed each table's description once per catalog file version.
+
+    After a failed attempt, returns no tables for _TABLE_EMBEDDING_RETRY_SECONDS
+    (or until the catalog changes) so callers fall back without re-embedding.
+    """
+    key = str(config.METADATA_CATALOG_PATH)
+    try:
+        mtime = os.stat(key).st_mtime
+    except OSError:
+        mtime = 0.0
+    hit = _TABLE_EMBEDDINGS.get(key)
+    if hit and hit[0] == mtime:
+        return hit[1], hit[2]
+
+    with _TABLE_EMBEDDINGS_LOCK:
+        hit = _TABLE_EMBEDDINGS.get(key)
+        if hit and hit[0] == mtime:
+            return hit[1], hit[2]
+        failed = _TABLE_EMBEDDING_FAILURES.get(key)
+        if failed and failed[0] == mtime and time.monotonic() < failed[1]:
+            return [], []
+        entries = [c for c in catalog if isinstance(c, dict) and c.get("table")]
+        names = [c["table"] for c in entries]
+        texts = [f"{c['table']}: {c.get('description', '')}" for c in entries]
+        try:
+            vectors = [_unit_vector(v) for v in config.embed_content_batch(texts)]
+        except Exception:
+            _TABLE_EMBEDDING_FAILURES[key] = (mtime, time.monotonic() + _TABLE_EMBEDDING_RETRY_SECONDS)
+            raise
+        _TABLE_EMBEDDING_FAILURES.pop(key, None)
+        _TABLE_EMBEDDINGS[key] = (mtime, names, vectors)
+        return names, vectors
+
+
+@functools.lru_cache(maxsize=256)
+def _question_embedding(question: str) -> Tuple[float, ...]:
+    return tuple(_unit_vector(config.embed_content(question)))
+
+
+def _embedding_select_tables(question: str, catalog: List[Dict[str, Any]]) -> List[str]:
+    """
+    Pick tables whose description embeddings are closest to the question.
+
+    Returns [] when the best cosine score is below TABLE_SELECT_MIN_SIMILARITY
+    or embedding fails, so the caller falls back to the Gemini selector.
+    """
+    if config.TABLE_SELECT_MIN_SIMILARITY > 1:
+        return []
+    try:
+        names, vectors = _catalog_embeddings(catalog)
+        if not names:
+            return []
+        q_vec = _question_embedding(" ".join(question.lower().split()))
+    except Exception as exc:
+        print(f"[Warning] Embedding table selection unavailable: {exc}", file=sys.stderr)
+        return []
+
+    scored = sorted(((sum(map(operator.mul, q_vec, vec)), name) for name, vec in zip(names, vectors)), reverse=True)
+    best = scored[0][0]
+    if best < config.TABLE_SELECT_MIN_SIMILARITY:
+        return []
+    return _apply_table_priority(question, [name for score, name in scored[:_TABLE_SELECT_MAX] if score >= best - _TABLE_SELECT_MARGIN], catalog)
+
+
+_FENCE_BLOCK_RE = re.compile(r"```[\s\S]*?```")
+_FENCE_MARKER_RE = re.compile(r"^```[a-zA-Z]*\\n|```$", re.MULTILINE)
+
+
+_TABLE_SELECT_SYSTEM_PROMPT = (
+    "You are a helpful data analyst. Given a user question and a list of tables with "
+    "brief descriptions, choose the minimal set of tables whose metadata would be most "
+    "useful to correctly write SQL.\n\n"
+    "IMPORTANT - Keyword Matching Priority:\n"
+    "- If the question explicitly mentions '311', 'service requests', 'service calls', or '311 calls', "
+    "ALWAYS prioritize tables with those keywords in their description (e.g., 'service_requests_311').\n"
+    "- If the question mentions 'crimes', 'crime incidents', 'offenses', 'arrests', 'homicides', or 'shootings' "
+    "(without mentioning 311), use the appropriate crime table.\n"
+    "- Explicit keywords (like '311') take precedence over inferred concepts (like 'violations').\n"
+    "- When a question says '311 calls' AND mentions violations/types, use 'service_requests_311' table.\n\n"
+    "Output strictly a JSON array of table names. No text."
+)
+
+
+# Tables picked per normalized question, oldest first: question -> (catalog picked from, names).
+# Entries are only reused while _load_catalog_entries returns that same catalog list.
+_TABLE_SELECTION_CACHE: "OrderedDict[str, Tuple[List[Dict[str, Any]], List[str]]]" = OrderedDict()
+_TABLE_SELECTION_CACHE_MAX = 256
+_TABLE_SELECTION_CACHE_LOCK = threading.Lock()
+
+
 def _llm_select_tables(question: str, catalog: List[Dict[str, Any]], default_model: str) -> List[str]:
     if not catalog:
         return []
 
+    key = " ".join((question or "").lower().split())
+    with _TABLE_SELECTION_CACHE_LOCK:
+        hit = _TABLE_SELECTION_CACHE.get(key)
+        if hit and hit[0] is catalog:
+            _TABLE_SELECTION_CACHE.move_to_end(key)
+            return list(hit[1])
+
+    names = _select_tables_uncached(question, catalog)
+    # An empty pick means Gemini failed or answered badly; let the next call try again
+    if key and names:
+        with _TABLE_SELECTION_CACHE_LOCK:
+            _TABLE_SELECTION_CACHE[key] = (catalog, list(names))
+            _TABLE_SELECTION_CACHE.move_to_end(key)
+            while len(_TABLE_SELECTION_CACHE) > _TABLE_SELECTION_CACHE_MAX:
+                _TABLE_SELECTION_CACHE.popitem(last=False)
+    return names
+
+
+def _select_tables_uncached(question: str, catalog: List[Dict[str, Any]]) -> List[str]:
+    # A confident embedding match avoids sending the whole catalog to Gemini
+    picked = _embedding_select_tables(question, catalog)
+    if picked:
+        return picked
+
     brief_rows = [{"table": c.get("table"), "description": c.get("description", "")} for c in catalog if isinstance(c, dict) and c.get("table")]
 
-    system_prompt = (
-        "You are a helpful data analyst. Given a user question and a list of tables with "
-        "brief descriptions, choose the minimal set of tables whose metadata would be most "
-        "useful to correctly write SQL.\n\n"
-        "IMPORTANT - Keyword Matching Priority:\n"
-        "- If the question explicitly mentions '311', 'service requests', 'service calls', or '311 calls', "
-        "ALWAYS prioritize tables with those keywords in their description (e.g., 'service_requests_311').\n"
-        "- If the question mentions 'crimes', 'crime incidents', 'offenses', 'arrests', 'homicides', or 'shootings' "
-        "(without mentioning 311), use the appropriate crime table.\n"
-        "- Explicit keywords (like '311') take precedence over inferred concepts (like 'violations').\n"
-        "- When a question says '311 calls' AND mentions violations/types, use 'service_requests_311' table.\n\n"
-        "Output strictly a JSON array of table names. No text."
-    )
-    user_prompt = "Question:\n" + question + "\n\n" + "Tables (JSON):\n" + json.dumps(brief_rows, ensure_ascii=False)
+    system_prompt = _TABLE_SELECT_SYSTEM_PROMPT
+    # Stable content (the catalog) goes first so Gemini's implicit prompt caching can reuse it
+    user_prompt = "Tables (JSON):\n" + json.dumps(brief_rows, ensure_ascii=False) + "\n\n" + "Question:\n" + question
 
     try:
-        prompt = f"{system_prompt}\n\n{user_prompt}"
         content = config.generate_content(
-            prompt=prompt,
+            prompt=user_prompt,
             model=config.GEMINI_MODEL,
             temperature=0,
+            system_instruction=system_prompt,
         )
 
     except Exception:
@@ -315,10 +826,10 @@ def _llm_select_tables(question: str, catalog: List[Dict[str, Any]], default_mod
     # Try to extract JSON array of strings
     try:
         # Remove code fences if present
-        m = re.search(r"```[\s\S]*?```", content)
+        m = _FENCE_BLOCK_RE.search(content)
         if m:
             inner = m.group(0)
-            content = re.sub(r"^```[a-zA-Z]*\\n|```$", "", inner, flags=re.MULTILINE).strip()
+            content = _FENCE_MARKER_RE.sub("", inner).strip()
         data = json.loads(content)
         if isinstance(data, list):
             names = [x for x in data if isinstance(x, str)]
@@ -328,16 +839,39 @@ def _llm_select_tables(question: str, catalog: List[Dict[str, Any]], default_mod
         names = []
 
     available = {c.get("table"): c for c in catalog if isinstance(c, dict)}
-    return [n for n in names if n in available]
+    return _apply_table_priority(question, [n for n in names if n in available], catalog)
+
+
+def _apply_table_priority(question: str, names: List[str], catalog: List[Dict[str, Any]]) -> List[str]:
+    """
+    Enforce the selection prompt's keyword priorities on a table pick.
+
+    Tables the question names outright (per `_guess_tables`) are put first,
+    and when it mentions 311, crime tables it doesn't ask for are dropped.
+    An empty pick stays empty so callers can still tell a failed selection.
+    """
+    if not names:
+        return names
+    guess = _guess_tables(question, catalog)
+    if not guess:
+        return names
+    if any("311" in t for t in guess):
+        names = [n for n in names if n in guess or "crime" not in n.lower()]
+    return guess + [n for n in names if n not in guess]
+
+
+# Serialized metadata for a table selection: key -> (parsed metadata objects it was built from, JSON text)
+_SELECTED_METADATA_CACHE: Dict[Tuple[Tuple[str, str], ...], Tuple[Tuple[Any, ...], str]] = {}
+_SELECTED_METADATA_CACHE_MAX = 64
 
 
 def _read_selected_metadata_json(selected_tables: List[str], catalog: List[Dict[str, Any]]) -> str:
     if not selected_tables:
         return ""
-    base_dir = config.METADATA_DIR
+    base_dir = Path(config.METADATA_DIR)
     table_to_entry = {c.get("table"): c for c in catalog if isinstance(c, dict) and c.get("table")}
 
-    result: Dict[str, Any] = {"tables": []}
+    files: List[Tuple[str, str]] = []
     for table in selected_tables:
         entry = table_to_entry.get(table)
         if not entry:
@@ -345,18 +879,46 @@ def _read_selected_metadata_json(selected_tables: List[str], catalog: List[Dict[
         fname = entry.get("metadata_file")
         if not fname:
             continue
-        fpath = base_dir / fname
+        files.append((table, str(base_dir / fname)))
+
+    result: Dict[str, Any] = {"tables": []}
+    loaded: List[Any] = []
+    for table, fpath in files:
         try:
-            with open(fpath, "r", encoding="utf-8") as f:
-                meta_json = json.load(f)
+            meta_json = _load_json_cached(fpath)
             result["tables"].append({"table": table, "metadata": meta_json})
+            loaded.append(meta_json)
         except Exception:
             # Skip unreadable files
+            loaded.append(None)
             continue
+
+    # _load_json_cached returns the same objects until a file changes, so
+    # identical objects mean the serialized text is still current
+    key = tuple(files)
+    hit = _SELECTED_METADATA_CACHE.get(key)
+    if hit and len(hit[0]) == len(loaded) and all(a is b for a, b in zip(hit[0], loaded)):
+        return hit[1]
     try:
-        return json.dumps(result, ensure_ascii=False, indent=2)
+        text = json.dumps(result, ensure_ascii=False, indent=2, sort_keys=True)
     except Exception:
         return ""
+    if len(_SELECTED_METADATA_CACHE) >= _SELECTED_METADATA_CACHE_MAX:
+        _SELECTED_METADATA_CACHE.clear()
+    _SELECTED_METADATA_CACHE[key] = (tuple(loaded), text)
+    return text
+
+
+def _warm_metadata_cache() -> None:
+    """Parse the catalog and every per-table metadata file, and embed the catalog, so the first question finds them cached."""
+    catalog = _load_catalog_entries()
+    _read_selected_metadata_json([c["table"] for c in catalog], catalog)
+    _read_metadata_text()
+    if catalog and config.TABLE_SELECT_MIN_SIMILARITY <= 1:
+        try:
+            _catalog_embeddings(catalog)
+        except Exception as exc:
+            print(f"[Warning] Could not embed the tables catalog: {exc}", file=sys.stderr)
 
 
 def _build_question_metadata(question: str) -> str:
@@ -368,78 +930,191 @@ def _build_question_metadata(question: str) -> str:
     return meta or _read_metadata_text()
 
 
-@traceable(name="generate_sql")
-def _llm_generate_sql(question: str, schema: str, default_model: str, metadata: str = "", conversation_history: List[Dict[str, str]] | None = None) -> str:
-    system_prompt = (
-        "You are a helpful data analyst. Generate a single, syntactically correct MySQL "
-        "SELECT statement based strictly on the provided schema snapshot and optional metadata JSON. "
-        "Do not include explanations. Only output SQL.\n\n"
-        "Rules:\n"
-        '- USE ONLY tables and columns present in the schema snapshot; DO NOT invent new names (e.g., never create "street_violations").\n'
-        "- If metadata indicates certain columns are UNIQUE/identifiers (e.g., primary keys or constrained categories), prefer those columns for exact filtering, grouping, or joining.\n"
-        "- Prefer columns indicated in metadata (JSON) when filtering (e.g., request_type, category, subject, description).\n"
-        "- When the question uses non-schema phrases (e.g., \"street violations\"), map them to appropriate text/category columns and use case-insensitive matches (for example, using LOWER(column) LIKE '%term%') rather than fabricating table names.\n"
-        '- For 311 service requests table ("service_requests_311"): use "type" or "reason" for category/topic filtering; avoid using "subject" (department) for problem categories.\n'
-        '- For crime incident reports table ("crime_incident_reports"): contains all reported crimes with offense codes, descriptions, locations, and dates. Use offense_code_group or offense_description for filtering by crime type.\n'
-        '- For shootings table ("shootings"): contains shooting incidents where victims were struck (fatal or non-fatal). Use for questions about shootings with victims, people shot, or shooting injuries.\n'
-        "- IMPORTANT: Do NOT search generically for the literal word 'violation' (e.g., avoid WHERE col LIKE '%violation%'). "
-        "Instead, use specific categories from the appropriate table's type/reason/offense_code_group columns.\n"
-        "- Type correctness: NEVER compare text to timestamps incorrectly. If a date/time column is stored as text per metadata (e.g., 'open_dt' in 'dorchester_311'), CAST/convert it to a datetime type before comparing to NOW() or intervals.\n"
-        "- CRITICAL: This is a MySQL database. Use MySQL syntax and functions only. "
-        "Use MySQL date functions (DATE_FORMAT, YEAR, MONTH, DAY, DATE_SUB, DATE_ADD, CURDATE, NOW, etc.), not functions from other databases (SQLite, PostgreSQL, etc.).\n"
-        "- For relative date queries (e.g., 'last month', 'this month', 'last week', 'last year'):\n"
-        "  * 'last month' = the previous calendar month (e.g., if today is December 2024, 'last month' is November 2024)\n"
-        "  * Use DATE_SUB or DATE_ADD with INTERVAL to calculate date ranges\n"
-        "  * Example for 'last month': WHERE DATE_FORMAT(date_column, '%Y-%m') = DATE_FORMAT(DATE_SUB(CURDATE(), INTERVAL 1 MONTH), '%Y-%m')\n"
-        "  * Or use: WHERE date_column >= DATE_FORMAT(DATE_SUB(CURDATE(), INTERVAL 1 MONTH), '%Y-%m-01') AND date_column < DATE_FORMAT(CURDATE(), '%Y-%m-01')\n"
-        "  * For 311 requests, use the appropriate date column (often 'open_dt' or 'created_date') and CAST to DATE if needed\n"
-        "- ALWAYS generate a query that will return actual results. If the question asks for a count, use COUNT(*). If it asks for a number, make sure the query returns that number.\n"
-        "- If metadata.hints.need_location is true and the selected table includes latitude/longitude columns (e.g., 'latitude', 'longitude'), INCLUDE them in the SELECT. If returning many rows, LIMIT to a reasonable sample (e.g., 500).\n"
-        "- If metadata.hints.prefer_location is true, strongly consider including latitude/longitude columns in the SELECT when available, especially for questions about locations, places, neighborhoods, or showing/visualizing data.\n"
-        "- For queries involving 'where', 'location', 'show', 'find', 'map', or spatial concepts, ALWAYS include latitude and longitude columns when available in the table schema.\n"
-        "- CRITICAL - DORCHESTER ONLY: This system is configured to ONLY return data for Dorchester. For ALL data tables (except weekly_events), you MUST add a WHERE clause that filters to Dorchester only. "
-        "NEVER write a query without a Dorchester filter - even if there's already a WHERE clause, you MUST add the Dorchester filter using AND.\n"
-        "Filtering rules by table (check in this order):\n"
-        "  * If the table has a `district` column: WHERE (existing conditions) AND `district` = 'C11'\n"
-        "  * If the table has a `neighborhood` column (but no district): WHERE (existing conditions) AND (LOWER(`neighborhood`) LIKE 'dorchester%' OR `neighborhood` = 'Dorchester' OR LOWER(`neighborhood`) LIKE '%dorchester%')\n"
-        "  * If the table has location/address columns but no district/neighborhood: WHERE (existing conditions) AND (LOWER(`location`) LIKE '%dorchester%' OR LOWER(`address`) LIKE '%dorchester%')\n"
-        'NEVER return data from other neighborhoods or districts. If the question mentions another place, interpret it as "in Dorchester" and still filter to Dorchester only.\n'
-        "- EXCEPTION: When querying the `weekly_events` table, DO NOT filter by Dorchester or any neighborhood; these events are general and should be returned regardless of location.\n"
-        "- CRITICAL for `weekly_events` table: For date comparisons (e.g., 'this weekend', 'next week', date ranges), ALWAYS use `start_date` or `end_date` (DATE fields), NEVER use `event_date` (which is VARCHAR text like 'Monday' or 'June 3-5'). Use `event_date` only for display, not for filtering by date.\n"
-        "- ALWAYS wrap table and column identifiers in backticks (`like_this`).\n"
-        "- When using table aliases, always write them as separate backticked identifiers (for example, `T1`.`longitude`), never as a single backticked 'T1.longitude'."
-    )
+@functools.lru_cache(maxsize=32)
+def _parse_metadata_json(metadata: str) -> Dict[str, Any]:
+    """Parsed question metadata; the same text recurs across retries and questions. Treat as read-only."""
+    return json.loads(metadata)
+
+
+@functools.lru_cache(maxsize=32)
+def _metadata_columns_by_table(metadata: str) -> Dict[str, Dict[str, Any]]:
+    """Lowercased table name -> its metadata `columns` dict; the first entry wins on duplicates."""
+    index: Dict[str, Dict[str, Any]] = {}
+    for tbl_entry in _parse_metadata_json(metadata).get("tables", []):
+        tbl_meta_inner = tbl_entry.get("metadata", {})
+        index.setdefault(tbl_meta_inner.get("table", "").lower(), tbl_meta_inner.get("columns", {}))
+    return index
+
+
+# Keyword -> table-name fragment rules mirroring the priorities in the table-selection prompt.
+# The 311 rule comes first because explicit '311' mentions take precedence over crime words.
+_TABLE_GUESS_RULES = (
+    (("311", "service request", "service call"), "311"),
+    (("shooting", "people shot", "shot and"), "shooting"),
+    (("crime", "offense", "arrest", "homicide", "shots fired", "incident"), "crime"),
+    (("event", "happening", "calendar", "schedule", "activities", "workshop", "weekend"), "event"),
+)
+
+
+def _guess_tables(question: str, catalog: List[Dict[str, Any]]) -> List[str]:
+    """Cheap keyword guess at the tables `_llm_select_tables` will most likely pick."""
+    q = (question or "").lower()
+    names = [c.get("table") for c in catalog if isinstance(c, dict) and c.get("table")]
+    guessed: List[str] = []
+    for keywords, fragment in _TABLE_GUESS_RULES:
+        if fragment == "crime" and guessed and any("311" in t for t in guessed):
+            continue
+        if any(kw in q for kw in keywords):
+            guessed.extend(n for n in names if fragment in n.lower() and n not in guessed)
+    return guessed
+
+
+_EVENTS_TABLE = "weekly_events"
+_EVENTS_SELECT = (
+    "SELECT `event_name`, `event_date`, `start_date`, `end_date`, `start_time`, `end_time` "
+    "FROM `weekly_events` WHERE `start_date` <= {last} AND COALESCE(`end_date`, `start_date`) >= {first} "
+    "ORDER BY `start_date`, `start_time`"
+)
+# Canned SQL for plain "what's happening <when>" questions, keyed by the matched period.
+# Events overlapping the period are returned; weekly_events is never filtered to Dorchester.
+_EVENTS_TEMPLATES = {
+    "today": _EVENTS_SELECT.format(first="CURDATE()", last="CURDATE()"),
+    "this week": _EVENTS_SELECT.format(
+        first="DATE_SUB(CURDATE(), INTERVAL WEEKDAY(CURDATE()) DAY)",
+        last="DATE_ADD(CURDATE(), INTERVAL 6 - WEEKDAY(CURDATE()) DAY)",
+    ),
+    "this weekend": _EVENTS_SELECT.format(
+        first="DATE_ADD(CURDATE(), INTERVAL 5 - WEEKDAY(CURDATE()) DAY)",
+        last="DATE_ADD(CURDATE(), INTERVAL 6 - WEEKDAY(CURDATE()) DAY)",
+    ),
+}
+# Whole-question match on the normalized question. It must name events/activities
+# or ask what's happening/going on; anything more specific (a topic, a place, a
+# time of day) or vaguer ("what is today") falls through to Gemini.
+_EVENTS_TEMPLATE_RE = re.compile(
+    r"(?:(?:what|whats|what s|what is|what are|which)\s+|(?:show|list|tell|give)\s+(?:me\s+)?(?:about\s+)?)?"
+    r"(?:all\s+)?(?:the\s+)?"
+    r"(?:(?:events?|things to do|activities)(?:\s+(?:is|are))?(?:\s+(?:happening|going on|scheduled|on))?"
+    r"|(?:(?:is|are)\s+)?(?:happening|going on))\s+"
+    r"(?:in dorchester\s+)?(today|this week|this weekend)(?:\s+in dorchester)?"
+)
+
+
+def _match_sql_template(question: str, catalog: List[Dict[str, Any]]) -> Optional[str]:
+    """Canned SQL for a trivial events-listing question, or None to go through Gemini."""
+    if not any(c.get("table") == _EVENTS_TABLE for c in catalog):
+        return None
+    normalized = " ".join(_QUESTION_PUNCT_RE.sub(" ", (question or "").lower()).split())
+    match = _EVENTS_TEMPLATE_RE.fullmatch(normalized)
+    return _EVENTS_TEMPLATES[match.group(1)] if match else None
+
+
+_SQL_SYSTEM_PROMPT = (
+    "You are a helpful data analyst. Generate a single, syntactically correct MySQL "
+    "SELECT statement based strictly on the provided schema snapshot and optional metadata JSON. "
+    "Do not include explanations. Only output SQL.\n\n"
+    "Rules:\n"
+    '- USE ONLY tables and columns present in the schema snapshot; DO NOT invent new names (e.g., never create "street_violations").\n'
+    "- If metadata indicates certain columns are UNIQUE/identifiers (e.g., primary keys or constrained categories), prefer those columns for exact filtering, grouping, or joining.\n"
+    "- Prefer columns indicated in metadata (JSON) when filtering (e.g., request_type, category, subject, description).\n"
+    "- When the question uses non-schema phrases (e.g., \"street violations\"), map them to appropriate text/category columns and use case-insensitive matches (for example, using LOWER(column) LIKE '%term%') rather than fabricating table names.\n"
+    '- For 311 service requests table ("service_requests_311"): use "type" or "reason" for category/topic filtering; avoid using "subject" (department) for problem categories.\n'
+    '- For crime incident reports table ("crime_incident_reports"): contains all reported crimes with offense codes, descriptions, locations, and dates. Use offense_code_group or offense_description for filtering by crime type.\n'
+    '- For shootings table ("shootings"): contains shooting incidents where victims were struck (fatal or non-fatal). Use for questions about shootings with victims, people shot, or shooting injuries.\n'
+    "- IMPORTANT: Do NOT search generically for the literal word 'violation' (e.g., avoid WHERE col LIKE '%violation%'). "
+    "Instead, use specific categories from the appropriate table's type/reason/offense_code_group columns.\n"
+    "- Type correctness: NEVER compare text to timestamps incorrectly. If a date/time column is stored as text per metadata (e.g., 'open_dt' in 'dorchester_311'), CAST/convert it to a datetime type before comparing to NOW() or intervals.\n"
+    "- CRITICAL: This is a MySQL database. Use MySQL syntax and functions only. "
+    "Use MySQL date functions (DATE_FORMAT, YEAR, MONTH, DAY, DATE_SUB, DATE_ADD, CURDATE, NOW, etc.), not functions from other databases (SQLite, PostgreSQL, etc.).\n"
+    "- For relative date queries (e.g., 'last month', 'this month', 'last week', 'last year'):\n"
+    "  * 'last month' = the previous calendar month (e.g., if today is December 2024, 'last month' is November 2024)\n"
+    "  * Use DATE_SUB or DATE_ADD with INTERVAL to calculate date ranges\n"
+    "  * Example for 'last month': WHERE DATE_FORMAT(date_column, '%Y-%m') = DATE_FORMAT(DATE_SUB(CURDATE(), INTERVAL 1 MONTH), '%Y-%m')\n"
+    "  * Or use: WHERE date_column >= DATE_FORMAT(DATE_SUB(CURDATE(), INTERVAL 1 MONTH), '%Y-%m-01') AND date_column < DATE_FORMAT(CURDATE(), '%Y-%m-01')\n"
+    "  * For 311 requests, use the appropriate date column (often 'open_dt' or 'created_date') and CAST to DATE if needed\n"
+    "- ALWAYS generate a query that will return actual results. If the question asks for a count, use COUNT(*). If it asks for a number, make sure the query returns that number.\n"
+    "- If metadata.hints.need_location is true and the selected table includes latitude/longitude columns (e.g., 'latitude', 'longitude'), INCLUDE them in the SELECT. If returning many rows, LIMIT to a reasonable sample (e.g., 500).\n"
+    "- If metadata.hints.prefer_location is true, strongly consider including latitude/longitude columns in the SELECT when available, especially for questions about locations, places, neighborhoods, or showing/visualizing data.\n"
+    "- For queries involving 'where', 'location', 'show', 'find', 'map', or spatial concepts, ALWAYS include latitude and longitude columns when available in the table schema.\n"
+    "- CRITICAL - DORCHESTER ONLY: This system is configured to ONLY return data for Dorchester. For ALL data tables (except weekly_events), you MUST add a WHERE clause that filters to Dorchester only. "
+    "NEVER write a query without a Dorchester filter - even if there's already a WHERE clause, you MUST add the Dorchester filter using AND.\n"
+    "Filtering rules by table (check in this order):\n"
+    "  * If the table has a `district` column: WHERE (existing conditions) AND `district` = 'C11'\n"
+    "  * If the table has a `neighborhood` column (but no district): WHERE (existing conditions) AND (LOWER(`neighborhood`) LIKE 'dorchester%' OR `neighborhood` = 'Dorchester' OR LOWER(`neighborhood`) LIKE '%dorchester%')\n"
+    "  * If the table has location/address columns but no district/neighborhood: WHERE (existing conditions) AND (LOWER(`location`) LIKE '%dorchester%' OR LOWER(`address`) LIKE '%dorchester%')\n"
+    'NEVER return data from other neighborhoods or districts. If the question mentions another place, interpret it as "in Dorchester" and still filter to Dorchester only.\n'
+    "- EXCEPTION: When querying the `weekly_events` table, DO NOT filter by Dorchester or any neighborhood; these events are general and should be returned regardless of location.\n"
+    "- CRITICAL for `weekly_events` table: For date comparisons (e.g., 'this weekend', 'next week', date ranges), ALWAYS use `start_date` or `end_date` (DATE fields), NEVER use `event_date` (which is VARCHAR text like 'Monday' or 'June 3-5'). Use `event_date` only for display, not for filtering by date.\n"
+    "- ALWAYS wrap table and column identifiers in backticks (`like_this`).\n"
+    "- When using table aliases, always write them as separate backticked identifiers (for example, `T1`.`longitude`), never as a single backticked 'T1.longitude'."
+)
+
+_SQL_SYSTEM_PROMPT_CONVERSATION = _SQL_SYSTEM_PROMPT + (
+    "\n\nNote: You are in a conversation. If the question references previous context, use it to better understand what the user is asking."
+)
+
+_SQL_INSTRUCTION = "Instruction: Write a single MySQL SELECT to answer the question. " "Always wrap table and column identifiers in backticks. " "If the question is ambiguous, choose a reasonable interpretation.\n\n"
+
+
+# Most history text put into one prompt; a pasted wall of text shouldn't balloon every call
+_HISTORY_MAX_CHARS = 8000
+
+
+def _truncate_history(conversation_history: List[Dict[str, str]], max_chars: int = _HISTORY_MAX_CHARS) -> List[Dict[str, str]]:
+    """
+    Keep the newest messages whose combined content fits in `max_chars`.
+
+    If even the newest message is longer, it is kept cut down to `max_chars`.
+    """
+    kept: List[Dict[str, str]] = []
+    total = 0
+    for msg in reversed(conversation_history):
+        content = str(msg.get("content", ""))
+        if total + len(content) > max_chars:
+            if not kept:
+                kept.append({**msg, "content": content[:max_chars] + "…"})
+            break
+        kept.append(msg)
+        total += len(content)
+    kept.reverse()
+    return kept
+
+
+def _history_text(conversation_history: List[Dict[str, str]] | None, last_n: int) -> str:
+    """Render the last `last_n` history messages, within _HISTORY_MAX_CHARS, as "ROLE: content" blocks."""
+    if not conversation_history:
+        return ""
+    recent = _truncate_history(conversation_history[-last_n:])
+    return "".join(f"{msg.get('role', '').upper()}: {msg.get('content', '')}\n\n" for msg in recent)
+
+
+@functools.lru_cache(maxsize=32)
+def _sql_context_prompt(schema: str, metadata: str) -> str:
+    """
+    Invariant context (schema + metadata) that leads the SQL prompt.
 
+    The per-question parts (history, question) trail it, so the prefix stays
+    byte-identical across questions and Gemini's implicit prompt caching can hit.
+    """
+    context_prompt = "Schema:\n" + schema + "\n\n"
     if metadata:
-        user_prompt = (
-            "Schema:\n" + schema + "\n\n"
-            "Additional metadata (JSON):\n" + metadata + "\n\n"
-            "Instruction: Write a single MySQL SELECT to answer the question. "
-            "Always wrap table and column identifiers in backticks. "
-            "If the question is ambiguous, choose a reasonable interpretation.\n\n"
-            f"Question: {question}"
-        )
-    else:
-        user_prompt = "Schema:\n" + schema + "\n\n" "Instruction: Write a single MySQL SELECT to answer the question. " "Always wrap table and column identifiers in backticks. " "If the question is ambiguous, choose a reasonable interpretation.\n\n" f"Question: {question}"
+        context_prompt += "Additional metadata (JSON):\n" + metadata + "\n\n"
+    return context_prompt
 
-    if conversation_history:
-        # Add note about conversation context
-        system_prompt += "\n\nNote: You are in a conversation. If the question references previous context, use it to better understand what the user is asking."
+
+@traceable(name="generate_sql", process_inputs=_trace_inputs)
+def _llm_generate_sql(question: str, schema: str, default_model: str, metadata: str = "", conversation_history: List[Dict[str, str]] | None = None) -> str:
+    system_prompt = _SQL_SYSTEM_PROMPT_CONVERSATION if conversation_history else _SQL_SYSTEM_PROMPT
 
     # Build full prompt with conversation history
-    full_prompt = system_prompt + "\n\n"
-    if conversation_history:
-        for msg in conversation_history[-8:]:
-            role = msg.get("role", "")
-            content = msg.get("content", "")
-            full_prompt += f"{role.upper()}: {content}\n\n"
-    full_prompt += user_prompt
+    full_prompt = _sql_context_prompt(schema, metadata) + _history_text(conversation_history, 8) + _SQL_INSTRUCTION + f"Question: {question}"
 
     try:
         content = config.generate_content(
             prompt=full_prompt,
             model=config.GEMINI_MODEL,
             temperature=0,
+            system_instruction=system_prompt,
         )
 
         sql = _extract_sql_from_text(content)
@@ -450,7 +1125,94 @@ def _llm_generate_sql(question: str, schema: str, default_model: str, metadata:
         raise RuntimeError(f"Gemini error: {exc}")
 
 
-@traceable(name="refine_sql_on_error")
+def _generate_sql_with_metadata(
+    question: str,
+    schema: "str | Future[str]",
+    conversation_history: List[Dict[str, str]] | None = None,
+    prepare_metadata: Optional[Callable[[str], str]] = None,
+) -> Tuple[str, str]:
+    """
+    Select table metadata and generate SQL, overlapping the two Gemini calls.
+
+    While `_llm_select_tables` runs, SQL is generated speculatively from the
+    tables guessed by `_guess_tables`. If the selection agrees with the guess
+    the speculative SQL is used; otherwise it is discarded and SQL is
+    regenerated from the selected metadata. Returns (metadata, sql).
+
+    `schema` may be a Future still being fetched; it is only waited on right
+    before SQL generation, so the fetch overlaps table selection.
+    """
+    prepare = prepare_metadata or (lambda m: m)
+    catalog = _load_catalog_entries()
+    template_sql = _match_sql_template(question, catalog)
+    if template_sql:
+        return prepare(_read_selected_metadata_json([_EVENTS_TABLE], catalog)), template_sql
+    guess = _guess_tables(question, catalog) if catalog else []
+    if not guess:
+        metadata = prepare(_build_question_metadata(question))
+        return metadata, _llm_generate_sql(question, _resolve_schema(schema), config.GEMINI_MODEL, metadata, conversation_history)
+
+    spec_metadata = prepare(_read_selected_metadata_json(guess, catalog) or _read_metadata_text())
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        select_future = executor.submit(_llm_select_tables, question, catalog, config.GEMINI_MODEL)
+        spec_future = executor.submit(lambda: _llm_generate_sql(question, _resolve_schema(schema), config.GEMINI_MODEL, spec_metadata, conversation_history))
+        selected = select_future.result()
+        if set(selected) == set(guess):
+            return spec_metadata, spec_future.result()
+        spec_future.cancel()
+    finally:
+        # Don't wait on a discarded speculative call
+        executor.shutdown(wait=False)
+
+    metadata = prepare(_read_selected_metadata_json(selected, catalog) or _read_metadata_text())
+    return metadata, _llm_generate_sql(question, _resolve_schema(schema), config.GEMINI_MODEL, metadata, conversation_history)
+
+
+def _resolve_schema(schema: "str | Future[str]") -> str:
+    return schema.result() if isinstance(schema, Future) else schema
+
+
+_COL_NOT_EXIST_RE = re.compile(r'column\s+"([^"]+)"\s+does not exist|column\s+(\w+)\s+does not exist', re.IGNORECASE)
+
+
+_SQL_REFINE_SYSTEM_PROMPT = (
+    "You are a helpful data analyst. Given a MySQL error, the schema snapshot, and metadata JSON, "
+    "correct the SQL so it runs successfully. Output only a single MySQL SELECT statement with no explanations.\n\n"
+    "CRITICAL RULES:\n"
+    "- PRESERVE EXISTING NAMES: DO NOT change table or column names unless the error explicitly states they don't exist. "
+    "Keep all table and column names exactly as they appear in the original SQL. Only change names when the error message explicitly says that specific name doesn't exist.\n"
+    "- TABLE SELECTION: If the question mentions '311 calls' or 'service requests', you MUST use 'service_requests_311' table, "
+    "NOT 'crime_incident_reports'. Check the original question again if wrong table was selected.\n"
+    "- USE ONLY tables/columns present in the schema snapshot; DO NOT invent names.\n"
+    "- If the error mentions a column that 'does not exist', REMOVE that column from the SELECT statement immediately.\n"
+    "- ALWAYS check the schema snapshot to verify which columns actually exist before using them.\n"
+    "- If metadata marks certain columns as UNIQUE/identifiers, prefer those for exact filters/joins instead of free-text conditions.\n"
+    "- Prefer text/category columns identified in metadata for filtering ambiguous phrases (use case-insensitive LIKE patterns, e.g., LOWER(column) LIKE '%term%').\n"
+    '- For 311 service requests table ("service_requests_311"): prefer filtering on "type" or "reason" for categories; avoid "subject" when searching for problem types.\n'
+    '- For crime incident reports table ("crime_incident_reports"): use offense_code_group or offense_description for filtering by crime type. '
+    "ONLY use this table if the question mentions crimes/offenses WITHOUT mentioning 311 or service requests.\n"
+    '- For shootings table ("shootings"): contains shooting incidents where victims were struck (fatal or non-fatal). Use for questions about shootings with victims, people shot, or shooting injuries.\n'
+    "- Type correctness: If the error indicates comparing text to datetime, CONVERT or CAST text date columns to datetime/timestamp before date math.\n"
+    "- CRITICAL: This is a MySQL database. Use MySQL syntax and functions only. "
+    "If the error mentions unknown functions, replace them with MySQL equivalents (e.g., use DATE_FORMAT for date formatting).\n"
+    "- If metadata.hints.need_location is true and coordinates exist, INCLUDE latitude/longitude in the SELECT and consider applying a LIMIT (e.g., 500).\n"
+    "- IMPORTANT: Do NOT use a generic LIKE '%violation%' filter. Choose specific, valid category/value filters instead.\n"
+    "- CRITICAL - DORCHESTER ONLY: This system is configured to ONLY return data for Dorchester. For ALL data tables (except weekly_events), you MUST add a WHERE clause that filters to Dorchester only. "
+    "NEVER write a query without a Dorchester filter - even if there's already a WHERE clause, you MUST add the Dorchester filter using AND.\n"
+    "Filtering rules by table (check in this order):\n"
+    "  * If the table has a `district` column: WHERE (existing conditions) AND `district` = 'C11'\n"
+    "  * If the table has a `neighborhood` column (but no district): WHERE (existing conditions) AND (LOWER(`neighborhood`) LIKE 'dorchester%' OR `neighborhood` = 'Dorchester' OR LOWER(`neighborhood`) LIKE '%dorchester%')\n"
+    "  * If the table has location/address columns but no district/neighborhood: WHERE (existing conditions) AND (LOWER(`location`) LIKE '%dorchester%' OR LOWER(`address`) LIKE '%dorchester%')\n"
+    'NEVER return data from other neighborhoods or districts. If the question mentions another place, interpret it as "in Dorchester" and still filter to Dorchester only.\n'
+    "- EXCEPTION: When refining SQL that uses the `weekly_events` table, DO NOT add or enforce any Dorchester/neighborhood filter; `weekly_events` contains general events and should not be geographically restricted.\n"
+    "- CRITICAL for `weekly_events` table: For date comparisons, ALWAYS use `start_date` or `end_date` (DATE fields), NEVER use `event_date` (VARCHAR). Use `event_date` only for display.\n"
+    "- ALWAYS wrap table and column identifiers in backticks.\n"
+    "- When using table aliases, always write them as separate backticked identifiers (for example, `T1`.`longitude`), never as a single backticked 'T1.longitude'."
+)
+
+
+@traceable(name="refine_sql_on_error", process_inputs=_trace_inputs)
 def _llm_refine_sql(
     question: str,
     schema: str,
@@ -459,53 +1221,16 @@ def _llm_refine_sql(
     default_model: str,
     metadata: str = "",
 ) -> str:
-    # Always rebuild metadata if not provided to ensure we have table information
-    if not metadata:
-        metadata = _build_question_metadata(question)
-
     # Parse error to extract key information
     error_lower = error_text.lower()
     missing_column = None
     if "does not exist" in error_lower:
         # Try to extract column name from error
-        col_match = re.search(r'column\s+"([^"]+)"\s+does not exist|column\s+(\w+)\s+does not exist', error_lower, re.IGNORECASE)
+        col_match = _COL_NOT_EXIST_RE.search(error_lower)
         if col_match:
             missing_column = col_match.group(1) or col_match.group(2)
 
-    system_prompt = (
-        "You are a helpful data analyst. Given a MySQL error, the schema snapshot, and metadata JSON, "
-        "correct the SQL so it runs successfully. Output only a single MySQL SELECT statement with no explanations.\n\n"
-        "CRITICAL RULES:\n"
-        "- PRESERVE EXISTING NAMES: DO NOT change table or column names unless the error explicitly states they don't exist. "
-        "Keep all table and column names exactly as they appear in the original SQL. Only change names when the error message explicitly says that specific name doesn't exist.\n"
-        "- TABLE SELECTION: If the question mentions '311 calls' or 'service requests', you MUST use 'service_requests_311' table, "
-        "NOT 'crime_incident_reports'. Check the original question again if wrong table was selected.\n"
-        "- USE ONLY tables/columns present in the schema snapshot; DO NOT invent names.\n"
-        "- If the error mentions a column that 'does not exist', REMOVE that column from the SELECT statement immediately.\n"
-        "- ALWAYS check the schema snapshot to verify which columns actually exist before using them.\n"
-        "- If metadata marks certain columns as UNIQUE/identifiers, prefer those for exact filters/joins instead of free-text conditions.\n"
-        "- Prefer text/category columns identified in metadata for filtering ambiguous phrases (use case-insensitive LIKE patterns, e.g., LOWER(column) LIKE '%term%').\n"
-        '- For 311 service requests table ("service_requests_311"): prefer filtering on "type" or "reason" for categories; avoid "subject" when searching for problem types.\n'
-        '- For crime incident reports table ("crime_incident_reports"): use offense_code_group or offense_description for filtering by crime type. '
-        "ONLY use this table if the question mentions crimes/offenses WITHOUT mentioning 311 or service requests.\n"
-        '- For shootings table ("shootings"): contains shooting incidents where victims were struck (fatal or non-fatal). Use for questions about shootings with victims, people shot, or shooting injuries.\n'
-        "- Type correctness: If the error indicates comparing text to datetime, CONVERT or CAST text date columns to datetime/timestamp before date math.\n"
-        "- CRITICAL: This is a MySQL database. Use MySQL syntax and functions only. "
-        "If the error mentions unknown functions, replace them with MySQL equivalents (e.g., use DATE_FORMAT for date formatting).\n"
-        "- If metadata.hints.need_location is true and coordinates exist, INCLUDE latitude/longitude in the SELECT and consider applying a LIMIT (e.g., 500).\n"
-        "- IMPORTANT: Do NOT use a generic LIKE '%violation%' filter. Choose specific, valid category/value filters instead.\n"
-        "- CRITICAL - DORCHESTER ONLY: This system is configured to ONLY return data for Dorchester. For ALL data tables (except weekly_events), you MUST add a WHERE clause that filters to Dorchester only. "
-        "NEVER write a query without a Dorchester filter - even if there's already a WHERE clause, you MUST add the Dorchester filter using AND.\n"
-        "Filtering rules by table (check in this order):\n"
-        "  * If the table has a `district` column: WHERE (existing conditions) AND `district` = 'C11'\n"
-        "  * If the table has a `neighborhood` column (but no district): WHERE (existing conditions) AND (LOWER(`neighborhood`) LIKE 'dorchester%' OR `neighborhood` = 'Dorchester' OR LOWER(`neighborhood`) LIKE '%dorchester%')\n"
-        "  * If the table has location/address columns but no district/neighborhood: WHERE (existing conditions) AND (LOWER(`location`) LIKE '%dorchester%' OR LOWER(`address`) LIKE '%dorchester%')\n"
-        'NEVER return data from other neighborhoods or districts. If the question mentions another place, interpret it as "in Dorchester" and still filter to Dorchester only.\n'
-        "- EXCEPTION: When refining SQL that uses the `weekly_events` table, DO NOT add or enforce any Dorchester/neighborhood filter; `weekly_events` contains general events and should not be geographically restricted.\n"
-        "- CRITICAL for `weekly_events` table: For date comparisons, ALWAYS use `start_date` or `end_date` (DATE fields), NEVER use `event_date` (VARCHAR). Use `event_date` only for display.\n"
-        "- ALWAYS wrap table and column identifiers in backticks.\n"
-        "- When using table aliases, always write them as separate backticked identifiers (for example, `T1`.`longitude`), never as a single backticked 'T1.longitude'."
-    )
+    system_prompt = _SQL_REFINE_SYSTEM_PROMPT
 
     # Build enhanced error analysis
     error_analysis = f"Error: {error_text}"
@@ -522,11 +1247,11 @@ def _llm_refine_sql(
         "Only use columns that exist in the schema snapshot. Always wrap table and column identifiers in backticks."
     )
 
-    prompt = f"{system_prompt}\n\n{user_prompt}"
     content = config.generate_content(
-        prompt=prompt,
+        prompt=user_prompt,
         model=config.GEMINI_MODEL,
         temperature=0,
+        system_instruction=system_prompt,
     )
 
     sql = _extract_sql_from_text(content)
@@ -535,25 +1260,159 @@ def _llm_refine_sql(
     return sql
 
 
-@traceable(name="execute_sql")
-def _execute_sql(sql: str) -> Dict[str, Any]:
-    conn = _get_db_connection()
+_FETCH_BATCH_SIZE = 256
+
+# Quoted literals and backticked identifiers are blanked out before the checks
+# below, so values like 'Street Light Update' don't trip the keyword filter
+_SQL_QUOTED_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`[^`]*`")
+_SQL_READ_ONLY_RE = re.compile(r"^\s*(?:SELECT|WITH)\b", re.IGNORECASE)
+# REPLACE(...) and INSERT(...) are also read-only string functions, so those two only
+# count as writes when not followed by an argument list
+_SQL_WRITE_RE = re.compile(
+    r"\b(?:DROP|DELETE|UPDATE|ALTER|CREATE|TRUNCATE|RENAME|GRANT|REVOKE|(?:INSERT|REPLACE)(?!\s*\())\b",
+    re.IGNORECASE,
+)
+_SQL_MULTI_STATEMENT_RE = re.compile(r";\s*\S")
+
+
+def _validate_sql(sql: str, schema: Optional[str] = None) -> None:
+    """
+    Cheap local checks on generated SQL before it is sent to MySQL.
+
+    Raises ValueError for anything other than a single read-only SELECT, or
+    for unbalanced quotes, so obviously bad SQL goes straight to refinement
+    without a database round-trip. With sqlglot installed and a schema
+    snapshot given, unknown tables and columns are caught the same way.
+    """
+    stripped = _SQL_QUOTED_RE.sub("''", sql).strip().rstrip(";")
+    if any(q in stripped.replace("''", "") for q in ("'", '"', "`")):
+        raise ValueError("SQL has unbalanced quotes or backticks")
+    if not _SQL_READ_ONLY_RE.match(stripped):
+        raise ValueError("Only a single SELECT statement is allowed")
+    if _SQL_MULTI_STATEMENT_RE.search(stripped):
+        raise ValueError("Only a single SQL statement is allowed")
+    m = _SQL_WRITE_RE.search(stripped)
+    if m:
+        raise ValueError(f"Statement contains a write/DDL keyword ({m.group(0).upper()}); only SELECT is allowed")
+    if schema and sqlglot is not None:
+        _check_sql_names(sql, schema)
+
+
+@functools.lru_cache(maxsize=8)
+def _schema_columns(schema: str) -> Dict[str, frozenset]:
+    """Parse a schema snapshot ("table (col1, col2, ...)" per line) into lowercased {table: columns}."""
+    tables: Dict[str, frozenset] = {}
+    for line in schema.splitlines():
+        name, sep, rest = line.partition(" (")
+        if sep and rest.endswith(")"):
+            tables[name.strip().strip('`"').lower()] = frozenset(c.strip().strip('`"').lower() for c in rest[:-1].split(","))
+    return tables
+
+
+def _check_sql_names(sql: str, schema: str) -> None:
+    """
+    Raise ValueError naming the first table or column the schema snapshot doesn't have.
+
+    Only definite misses are reported: SQL sqlglot can't parse is left to MySQL,
+    and unqualified columns are only checked in single-level queries, where
+    every name must come from the listed tables or a SELECT alias.
+    """
+    tables = _schema_columns(schema)
+    if not tables:
+        return
     try:
-        with conn.cursor() as cur:
-            cur.execute(sql)
-            rows = cur.fetchall()
-            cols = [d[0] for d in cur.description] if cur.description else []
-    finally:
-        conn.close()
+        parsed = sqlglot.parse_one(sql, read="mysql")
+    except Exception:
+        return
+
+    cte_names = {cte.alias_or_name.lower() for cte in parsed.find_all(sqlglot_exp.CTE)}
+    aliases: Dict[str, str] = {}
+    for table in parsed.find_all(sqlglot_exp.Table):
+        name = table.name.lower()
+        if name in cte_names:
+            continue
+        if name not in tables:
+            raise ValueError(f"Table '{table.name}' doesn't exist in the schema snapshot")
+        aliases[table.alias_or_name.lower()] = name
+
+    nested = cte_names or parsed.find(sqlglot_exp.Subquery) is not None
+    select_aliases = {a.alias.lower() for a in parsed.find_all(sqlglot_exp.Alias)}
+    in_scope = frozenset().union(*(tables[t] for t in aliases.values())) if aliases else frozenset()
+    for column in parsed.find_all(sqlglot_exp.Column):
+        col = column.name.lower()
+        if not col or col == "*":
+            continue
+        qualifier = column.table.lower()
+        if qualifier:
+            table_name = aliases.get(qualifier)
+            if table_name and col not in tables[table_name]:
+                raise ValueError(f"Unknown column '{column.table}.{column.name}': column {column.name} does not exist")
+        elif not nested and aliases and col not in in_scope and col not in select_aliases:
+            raise ValueError(f"Unknown column '{column.name}': column {column.name} does not exist")
 
-    items: List[Dict[str, Any]] = []
-    for row in rows:
-        item = {cols[i]: row[i] for i in range(len(cols))}
-        items.append(item)
-    return {"columns": cols, "rows": items}
 
+@traceable(name="execute_sql", process_outputs=_trace_outputs)
+def _execute_sql(sql: str, max_rows: int = config.MYSQL_MAX_RESULT_ROWS) -> Dict[str, Any]:
+    """
+    Run `sql` and return {"columns", "rows", "truncated"}.
 
-@traceable(name="execute_with_retries")
+    At most `max_rows` rows are kept; `truncated` is True when the query
+    produced more, so row counts in the result are a lower bound.
+    """
+    # Unbuffered cursor: rows are streamed from the server and turned into
+    # dicts one batch at a time. Rows are zipped with the description's names
+    # (not SSDictCursor) so row keys always match "columns", even when a join
+    # selects two columns with the same name.
+    with _pooled_connection() as conn, conn.cursor(pymysql.cursors.SSCursor) as cur:
+        cur.execute(sql)
+        cols = [d[0] for d in cur.description] if cur.description else []
+        items: List[Dict[str, Any]] = []
+        truncated = False
+        if cols:
+            # Read in batches and stop at the cap; closing the cursor discards
+            # whatever is left on the wire without holding it in memory
+            while True:
+                batch = cur.fetchmany(_FETCH_BATCH_SIZE)
+                if not batch:
+                    break
+                room = max_rows - len(items)
+                if len(batch) > room:
+                    batch = batch[:room]
+                    truncated = True
+                items.extend(dict(zip(cols, row)) for row in batch)
+                if truncated:
+                    break
+
+    return {"columns": cols, "rows": items, "truncated": truncated}
+
+
+# Parts of a MySQL error that change with every rewrite of the same mistake:
+# the quoted SQL fragment after "near" and numbers (line numbers, error codes, literals)
+_ERROR_NEAR_RE = re.compile(r"near '(?:[^'\\]|\\.|'')*'")
+_ERROR_NUMBER_RE = re.compile(r"\d+")
+
+
+def _error_signature(err_text: str) -> str:
+    """
+    Key for "the same error again" across retries.
+
+    Quoted identifiers are kept, so a different unknown column still counts as
+    progress, while a syntax error at a different spot in rewritten SQL does not.
+    """
+    signature = _ERROR_NEAR_RE.sub("near ?", err_text)
+    return _ERROR_NUMBER_RE.sub("?", signature)[:200]
+
+
+# FROM "schema"."table" / FROM "table", and the unquoted forms
+_FROM_QUOTED_RE = re.compile(r'FROM\s+"([^"]+)"\s*\.\s*"([^"]+)"|FROM\s+"([^"]+)"', re.IGNORECASE)
+_FROM_BARE_RE = re.compile(r"FROM\s+(\w+)\.(\w+)|FROM\s+(\w+)", re.IGNORECASE)
+# Column-name fragments marking category-like columns worth sampling after a no-rows result,
+# and the narrower set whose metadata unique_values are shown to the refiner
+_KEY_COL_KEYWORDS = ("type", "reason", "category", "subject", "crime", "status", "state")
+_META_COL_KEYWORDS = ("type", "reason", "category")
+
+
+@traceable(name="execute_with_retries", process_inputs=_trace_inputs, process_outputs=_trace_outputs)
 def _execute_with_retries(
     initial_sql: str,
     question: str,
@@ -565,7 +1424,8 @@ def _execute_with_retries(
     max_attempts = max(1, min(int(max_attempts or 1), 5))
     sql = initial_sql
     last_err: Exception | None = None
-    previous_sqls = []  # Track previous SQL attempts to avoid infinite loops
+    previous_sqls: set = set()  # Normalized SQL that ran without error; a repeat stops the loop
+    failed_attempts: set = set()  # (normalized SQL, error signature) pairs already sent to the refiner
     error_count = {}  # Track how many times we've seen the same error
 
     for attempt_idx in range(1, max_attempts + 1):
@@ -583,9 +1443,9 @@ def _execute_with_retries(
                 result = {"columns": [], "rows": []}
                 return {"result": result, "sql": sql}
 
-            previous_sqls.append(sql_normalized)
-
+            _validate_sql(sql, schema)
             result = _execute_sql(sql)
+            previous_sqls.add(sql_normalized)
             # If query succeeded but returned no rows, try to refine and broaden the query
             try:
                 rows = result.get("rows", []) if isinstance(result, dict) else []
@@ -600,13 +1460,11 @@ def _execute_with_retries(
             if attempt_idx == 1:  # Only fetch unique values on first attempt
                 try:
                     # Extract table and key columns from SQL and schema
-                    import re
-
                     table_name = None
-                    schema_name = "public"
+                    schema_name = None  # the connection's database unless the SQL names one
 
                     # Find table name from FROM clause - handle schema.table format
-                    from_match = re.search(r'FROM\s+"([^"]+)"\s*\.\s*"([^"]+)"|FROM\s+"([^"]+)"', sql, re.IGNORECASE)
+                    from_match = _FROM_QUOTED_RE.search(sql)
                     if from_match:
                         if from_match.group(2):  # schema.table format
                             schema_name = from_match.group(1).strip('"').strip()
@@ -615,7 +1473,7 @@ def _execute_with_retries(
                             table_name = from_match.group(3).strip('"').strip() if from_match.group(3) else from_match.group(1).strip('"').strip()
                     else:
                         # Try without quotes
-                        from_match2 = re.search(r"FROM\s+(\w+)\.(\w+)|FROM\s+(\w+)", sql, re.IGNORECASE)
+                        from_match2 = _FROM_BARE_RE.search(sql)
                         if from_match2:
                             if from_match2.group(2):  # schema.table format
                                 schema_name = from_match2.group(1)
@@ -630,26 +1488,25 @@ def _execute_with_retries(
                         for line in schema_lines:
                             if table_name.lower() in line.lower():
                                 # Extract column names from this table's line
-                                cols_match = re.search(r"\(([^)]+)\)", line)
+                                cols_match = _PAREN_LIST_RE.search(line)
                                 if cols_match:
                                     cols = [c.strip().strip('"') for c in cols_match.group(1).split(",")]
                                     # Prioritize common category/type columns
                                     for col in cols:
                                         col_lower = col.lower()
-                                        if any(kw in col_lower for kw in ["type", "reason", "category", "subject", "crime", "status", "state"]):
+                                        if any(kw in col_lower for kw in _KEY_COL_KEYWORDS):
                                             key_columns.append(col)
                                     # If no specific columns found, take first few columns
                                     if not key_columns and cols:
                                         key_columns = cols[:3]
 
-                        # Get unique values from these columns (limit to 2 columns and 10 values each to speed up)
-                        for col in key_columns[:2]:  # Limit to 2 columns
-                            try:
-                                unique_vals = _get_unique_values(table_name, col, schema_name, limit=10)
-                                if unique_vals:
-                                    unique_values_info[col] = unique_vals
-                            except Exception:
-                                pass
+                        # Get unique values from these columns (limit to 2 columns and 10 values each to speed up),
+                        # in one UNION ALL round trip
+                        try:
+                            fetched = _get_unique_values_multi(table_name, key_columns[:2], limit=10, schema_name=schema_name)
+                            unique_values_info.update((col, vals) for col, vals in fetched.items() if vals)
+                        except Exception:
+                            pass
                 except Exception:
                     pass
 
@@ -682,36 +1539,25 @@ def _execute_with_retries(
                     error_parts.append(f"  - {col}: {', '.join(str(v)[:50] for v in vals[:10])}{'...' if len(vals) > 10 else ''}")
                 error_parts.append("\nConsider using these actual values from the database in your filters.")
 
-            # Always ensure metadata is available
-            current_metadata = metadata if metadata else _build_question_metadata(question)
+            # Build metadata at most once per call; later retries reuse the same table selection
+            if not metadata:
+                metadata = _build_question_metadata(question)
+            current_metadata = metadata
 
             # ALSO inject unique_values from metadata JSON (if present) to help LLM see all real terms
             try:
-                import json as json_lib
-
-                meta_obj = json_lib.loads(current_metadata) if current_metadata else {}
-                tables_meta = meta_obj.get("tables", [])
-                if tables_meta:
-                    # Extract table name from SQL to find matching metadata
-                    table_from_sql = None
-                    from_match = re.search(r"FROM\s+`?(\w+)`?", sql, re.IGNORECASE)
-                    if from_match:
-                        table_from_sql = from_match.group(1).lower()
-
-                    for tbl_entry in tables_meta:
-                        tbl_meta_inner = tbl_entry.get("metadata", {})
-                        tbl_name = tbl_meta_inner.get("table", "").lower()
-                        if table_from_sql and tbl_name == table_from_sql:
-                            cols_meta = tbl_meta_inner.get("columns", {})
-                            # Find category/type columns with unique_values
-                            for col_name, col_info in cols_meta.items():
-                                col_lower = col_name.lower()
-                                if any(kw in col_lower for kw in ["type", "reason", "category"]) and not col_info.get("is_numeric"):
-                                    uvals = col_info.get("unique_values", [])
-                                    if uvals and len(uvals) <= 150:
-                                        error_parts.append(f"\n\nMetadata unique_values for `{col_name}` (first 20): {', '.join(str(v)[:50] for v in uvals[:20])}")
-                                        print(f"[Debug] Injected {len(uvals)} unique_values for column `{col_name}`", file=sys.stderr)
-                            break
+                # Extract table name from SQL to find matching metadata
+                from_match = _FROM_TABLE_RE.search(sql)
+                if current_metadata and from_match:
+                    cols_meta = _metadata_columns_by_table(current_metadata).get(from_match.group(1).lower(), {})
+                    # Find category/type columns with unique_values
+                    for col_name, col_info in cols_meta.items():
+                        col_lower = col_name.lower()
+                        if any(kw in col_lower for kw in _META_COL_KEYWORDS) and not col_info.get("is_numeric"):
+                            uvals = col_info.get("unique_values", [])
+                            if uvals and len(uvals) <= 150:
+                                error_parts.append(f"\n\nMetadata unique_values for `{col_name}` (first 20): {', '.join(str(v)[:50] for v in uvals[:20])}")
+                                print(f"[Debug] Injected {len(uvals)} unique_values for column `{col_name}`", file=sys.stderr)
             except Exception as e:
                 print(f"[Debug] Exception extracting metadata unique_values: {e}", file=sys.stderr)
 
@@ -726,14 +1572,28 @@ def _execute_with_retries(
         except Exception as exc:  # noqa: BLE001
             last_err = exc
             err_text = str(exc)
-            if attempt_idx == max_attempts:
+            # The pipeline only runs SELECTs, so schema changes happen elsewhere; when
+            # MySQL doesn't know a table or column, re-read the schema next time
+            if _mysql_error_code(exc) in _SCHEMA_MISMATCH_MYSQL_ERRORS:
+                _invalidate_schema_cache()
+            # A dropped connection is terminal too: a rewritten query would fail the same way
+            if attempt_idx == max_attempts or _mysql_error_code(exc) in _TERMINAL_MYSQL_ERRORS:
                 # On final failure, return a structured error result instead of raising
                 print(f"\n[Error] SQL failed after {attempt_idx} attempts: {err_text}\n", file=sys.stderr)
                 error_result = {"columns": [], "rows": [], "error": err_text}
                 return {"result": error_result, "sql": sql}
 
             # Track error patterns to detect loops
-            error_key = err_text[:200]  # Use first 200 chars as key
+            error_key = _error_signature(err_text)
+            # The refiner already saw this SQL fail this way (e.g. its rewrite call
+            # failed and the same SQL was run again); asking again won't help
+            attempt_key = (" ".join(sql.split()), error_key)
+            if attempt_key in failed_attempts:
+                print(f"\n[Warning] Same SQL failed with the same error again, stopping after {attempt_idx} attempts\n", file=sys.stderr)
+                error_result = {"columns": [], "rows": [], "error": err_text}
+                return {"result": error_result, "sql": sql}
+            failed_attempts.add(attempt_key)
+
             error_count[error_key] = error_count.get(error_key, 0) + 1
 
             # If we've seen this exact error 2+ times, stop to avoid infinite loop
@@ -747,8 +1607,8 @@ def _execute_with_retries(
                 if "operator does not exist: text" in err_text and "timestamp" in err_text:
                     err_text += '\nHint: CAST text date columns to timestamp (e.g., "open_dt"::timestamp) ' "before comparing to NOW() or using intervals."
 
-                # Always rebuild metadata to ensure we have latest table info
-                current_metadata = metadata if metadata else _build_question_metadata(question)
+                if not metadata:
+                    metadata = _build_question_metadata(question)
 
                 sql = _llm_refine_sql(
                     question=question,
@@ -756,7 +1616,7 @@ def _execute_with_retries(
                     previous_sql=sql or "",
                     error_text=err_text,
                     default_model=config.GEMINI_MODEL,
-                    metadata=current_metadata,
+                    metadata=metadata,
                 )
             except Exception as refine_exc:  # noqa: BLE001
                 last_err = refine_exc
@@ -779,8 +1639,89 @@ def _execute_with_retries(
     return {"result": empty_result, "sql": sql}
 
 
-@traceable(name="summarize_answer")
-def _llm_generate_answer(question: str, sql: str, result: Dict[str, Any], default_model: str, conversation_history: List[Dict[str, str]] | None = None) -> str:
+# Longest string cell sent to the summarizer
+_SUMMARY_CELL_MAX_CHARS = 160
+
+
+def _trim_cell(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > _SUMMARY_CELL_MAX_CHARS:
+        return value[:_SUMMARY_CELL_MAX_CHARS] + "…"
+    return value
+
+
+def _format_small_table(rows: List[Dict[str, Any]], cols: List[str]) -> str:
+    """Plain-text rendering of a tiny result that doesn't need LLM prose."""
+    return "\n".join("- " + ", ".join(f"{c}: {r.get(c)}" for c in cols) for r in rows)
+
+
+def _format_markdown_table(rows: List[Dict[str, Any]], cols: List[str]) -> str:
+    """Markdown table for a short, narrow result."""
+    lines = ["| " + " | ".join(cols) + " |", "|" + "---|" * len(cols)]
+    lines += ["| " + line + " |" for line in _format_rows(rows, cols, " | ")]
+    return "\n".join(lines)
+
+
+_COUNT_SQL_RE = re.compile(r"^\s*SELECT\s+COUNT\s*\(", re.IGNORECASE)
+
+
+# Path the latest _llm_generate_answer call on this thread took ("llm", "fallback", ...)
+_ANSWER_PATH = threading.local()
+
+
+def _log_answer_path(path: Optional[str]) -> None:
+    _ANSWER_PATH.value = path
+    if path and config.VERBOSE_LOGGING:
+        print(f"[Debug] Answer path: {path}", file=sys.stderr)
+
+
+def _summary_blob(result: Dict[str, Any], max_rows: int = 30) -> Dict[str, Any]:
+    """Compact JSON-ready view of a SQL result for the summarization prompt."""
+    cols = result.get("columns", [])
+    rows = result.get("rows", [])
+    sample_rows = rows[:max_rows]
+    # Keep the prompt small: drop columns that are empty across the sample,
+    # send rows as value lists in "columns" order instead of repeating every
+    # column name per row, and cut long text (descriptions, addresses) short.
+    sample_cols = [c for c in cols if any(r.get(c) is not None for r in sample_rows)]
+    data_blob = {
+        "columns": sample_cols,
+        "rows": [[_trim_cell(r.get(c)) for c in sample_cols] for r in sample_rows],
+        "truncated": len(rows) > max_rows,
+        "row_count": len(rows),
+    }
+    if result.get("truncated"):
+        data_blob["row_count_note"] = f"The query matched more than {len(rows)} rows; only the first {len(rows)} were fetched."
+    return data_blob
+
+
+_ANSWER_SYSTEM_PROMPT = (
+    "You are a friendly, non-technical assistant explaining results about Dorchester ONLY to a general audience.\n"
+    "This system is configured to show ONLY Dorchester data. All queries are filtered to Dorchester only.\n"
+    "Use clear, everyday language and speak as if you are talking directly to the user.\n"
+    "Focus on what the numbers mean for people in Dorchester (trends over time, comparisons within Dorchester, biggest/smallest values there), "
+    "not on how the data was queried or any technical details.\n"
+    "IMPORTANT: If you see any data from other neighborhoods in the results, ignore it completely and only discuss Dorchester data. "
+    "If the results are empty or don't contain Dorchester data, mention that no Dorchester-specific data was found.\n"
+    "Do NOT mention SQL, queries, databases, or internal tools in your answer.\n\n"
+    "CRITICAL: You MUST answer the question using the SQL results provided below. The results contain the actual data from the database. "
+    "NEVER say you need more information when results are provided - use the data in the 'Result (JSON)' section to answer the question directly. "
+    "If the results show a number, report that number. If the results show rows of data, summarize or report the key findings. "
+    "Only say you need more information if the results section is completely empty or shows an error."
+)
+
+_ANSWER_CONVERSATION_NOTE = "\n\nYou are in a conversation. Reference previous questions naturally when it helps the user."
+
+
+_SUMMARY_MAX_ROWS = 30
+
+
+def _local_answer(sql: str, result: Dict[str, Any]) -> Optional[str]:
+    """
+    Answer an error, empty or trivial result without Gemini.
+
+    Returns None when the result is real tabular data that is worth a
+    summarization round-trip.
+    """
     # If SQL failed, provide a graceful explanation instead of crashing
     error_text = result.get("error")
     if error_text:
@@ -805,82 +1746,276 @@ def _llm_generate_answer(question: str, sql: str, result: Dict[str, Any], defaul
             return "".join(msg_parts)
         return "No results found."
 
-    max_rows = 30
-    sample_rows = rows[:max_rows]
-    data_blob = {
-        "columns": cols,
-        "rows": sample_rows,
-        "truncated": len(rows) > max_rows,
-        "row_count": len(rows),
-    }
+    # Trivial results (a single aggregate, or a couple of plain rows) are answered
+    # locally; only real tabular results are worth a summarization round-trip.
+    if len(rows) == 1 and len(cols) == 1:
+        if _COUNT_SQL_RE.match(sql or ""):
+            _log_answer_path("count")
+            return f"Count: {rows[0].get(cols[0])}"
+        _log_answer_path("scalar")
+        return f"{cols[0]}: {rows[0].get(cols[0])}"
+    if len(rows) <= 5 and all(isinstance(v, (int, float, str, Decimal)) for r in rows for v in r.values()):
+        if len(cols) <= 3:
+            _log_answer_path("markdown_table")
+            return _format_markdown_table(rows, cols)
+        if len(rows) <= 3:
+            _log_answer_path("small_table")
+            return _format_small_table(rows, cols)
+    return None
+
+
+def _raw_rows_answer(result: Dict[str, Any]) -> str:
+    """The first rows as comma-separated text, for when Gemini can't summarize them."""
+    cols = result.get("columns", [])
+    rows = result.get("rows", [])
+    lines = [", ".join(cols)] + _format_rows(rows[:_SUMMARY_MAX_ROWS], cols, ", ")
+    if len(rows) > _SUMMARY_MAX_ROWS:
+        lines.append(f"... ({len(rows) - _SUMMARY_MAX_ROWS} more rows)")
+    return "\n".join(lines)
 
-    system_prompt = (
-        "You are a friendly, non-technical assistant explaining results about Dorchester ONLY to a general audience.\n"
-        "This system is configured to show ONLY Dorchester data. All queries are filtered to Dorchester only.\n"
-        "Use clear, everyday language and speak as if you are talking directly to the user.\n"
-        "Focus on what the numbers mean for people in Dorchester (trends over time, comparisons within Dorchester, biggest/smallest values there), "
-        "not on how the data was queried or any technical details.\n"
-        "IMPORTANT: If you see any data from other neighborhoods in the results, ignore it completely and only discuss Dorchester data. "
-        "If the results are empty or don't contain Dorchester data, mention that no Dorchester-specific data was found.\n"
-        "Do NOT mention SQL, queries, databases, or internal tools in your answer.\n\n"
-        "CRITICAL: You MUST answer the question using the SQL results provided below. The results contain the actual data from the database. "
-        "NEVER say you need more information when results are provided - use the data in the 'Result (JSON)' section to answer the question directly. "
-        "If the results show a number, report that number. If the results show rows of data, summarize or report the key findings. "
-        "Only say you need more information if the results section is completely empty or shows an error." + ("\n\nYou are in a conversation. Reference previous questions naturally when it helps the user." if conversation_history else "")
-    )
 
-    user_prompt = "Question:\n" + question + "\n\n" "Executed SQL:\n" + sql + "\n\n" "Result (JSON, possibly truncated):\n" + json.dumps(data_blob, ensure_ascii=False, default=str)
+@traceable(name="summarize_answer", process_inputs=_trace_inputs)
+def _llm_generate_answer(
+    question: str,
+    sql: str,
+    result: Dict[str, Any],
+    default_model: str,
+    conversation_history: List[Dict[str, str]] | None = None,
+    on_chunk: Optional[Callable[[str], None]] = None,
+) -> str:
+    _log_answer_path(None)
+    local = _local_answer(sql, result)
+    if local is not None:
+        return local
+    _log_answer_path("llm")
+
+    data_blob = _summary_blob(result, _SUMMARY_MAX_ROWS)
+
+    system_prompt = _ANSWER_SYSTEM_PROMPT + (_ANSWER_CONVERSATION_NOTE if conversation_history else "")
+
+    user_prompt = "Question:\n" + question + "\n\n" "Executed SQL:\n" + sql + "\n\n" "Result (JSON, possibly truncated):\n" + _dumps_rows(data_blob)
 
     # Build full prompt with conversation history
-    full_prompt = system_prompt + "\n\n"
-    if conversation_history:
-        for msg in conversation_history[-10:]:
-            role = msg.get("role", "")
-            content = msg.get("content", "")
-            full_prompt += f"{role.upper()}: {content}\n\n"
-    full_prompt += user_prompt
+    full_prompt = _history_text(conversation_history, 10) + user_prompt
+
+    try:
+        if on_chunk is not None:
+            # Stream so the caller can show the answer while it is still being generated
+            content = config.generate_content_stream(
+                prompt=full_prompt,
+                model=config.GEMINI_MODEL,
+                temperature=0,
+                system_instruction=system_prompt,
+                on_chunk=on_chunk,
+            )
+        else:
+            content = config.generate_content(
+                prompt=full_prompt,
+                model=config.GEMINI_MODEL,
+                temperature=0,
+                system_instruction=system_prompt,
+            )
+
+        return content.strip()
+    except Exception:
+        _log_answer_path("fallback")
+        return _raw_rows_answer(result)
+
+
+# Only questions that compare or combine several things are worth splitting into
+# independent sub-questions; everything else skips the extra Gemini call.
+_DECOMPOSE_HINT_RE = re.compile(r"\b(?:compar(?:e[ds]?|ing|ison)|versus|vs\.?|difference between)\b", re.IGNORECASE)
+_DECOMPOSE_MAX_PARTS = 3
+
+_DECOMPOSE_SYSTEM_PROMPT = (
+    "You split questions about Dorchester data into independent sub-questions that can each be answered by one MySQL SELECT "
+    "and that can run in parallel.\n"
+    f"Return at most {_DECOMPOSE_MAX_PARTS} sub-questions. Each one must be self-contained and keep the original time range and filters.\n"
+    "If a single query (for example one GROUP BY) can answer the question, do not split it.\n"
+    "Output strictly a JSON array of strings, or [] when the question should not be split. No text."
+)
+
+
+@traceable(name="decompose_question")
+def _llm_decompose(question: str) -> List[str]:
+    """Split a comparison-style question into independent sub-questions, or return [] to answer it whole."""
+    if not _DECOMPOSE_HINT_RE.search(question):
+        return []
 
     try:
         content = config.generate_content(
-            prompt=full_prompt,
+            prompt="Question:\n" + question,
             model=config.GEMINI_MODEL,
             temperature=0,
+            system_instruction=_DECOMPOSE_SYSTEM_PROMPT,
         )
+    except Exception:
+        return []
+
+    m = _FENCE_ANY_RE.search(content)
+    text = (m.group(1) if m else content).strip()
+    if text[:4].lower() == "json":
+        text = text[4:]
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return []
+    if not isinstance(data, list):
+        return []
+    parts = [x.strip() for x in data if isinstance(x, str) and x.strip()]
+    # A single part is just the original question again
+    return parts[:_DECOMPOSE_MAX_PARTS] if len(parts) > 1 else []
+
+
+def _answer_sub_question(sub_question: str, schema: str) -> Dict[str, Any]:
+    metadata, sql = _generate_sql_with_metadata(sub_question, schema)
+    exec_out = _execute_with_retries(
+        initial_sql=sql,
+        question=sub_question,
+        schema=schema,
+        metadata=metadata,
+    )
+    result = exec_out["result"]
+    # Gemini-free answer, used if the combined summary can't be generated
+    answer = _local_answer(exec_out["sql"], result)
+    return {"question": sub_question, "sql": exec_out["sql"], "result": result, "answer": answer if answer is not None else _raw_rows_answer(result)}
 
+
+class _PerThreadStdout:
+    """
+    sys.stdout stand-in that sends a thread's writes to its own buffer while
+    one is set, so concurrent sub-pipelines don't interleave their output.
+    """
+
+    def __init__(self, target: Any) -> None:
+        self.target = target
+        self._local = threading.local()
+
+    def capture(self) -> List[str]:
+        """Start collecting this thread's output; returns the list it is written to."""
+        self._local.buffer = []
+        return self._local.buffer
+
+    def write(self, text: str) -> int:
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            return self.target.write(text)
+        buffer.append(text)
+        return len(text)
+
+    def flush(self) -> None:
+        if getattr(self._local, "buffer", None) is None:
+            self.target.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.target, name)
+
+
+def _run_decomposed(sub_questions: List[str], schema: str) -> List[Dict[str, Any]]:
+    """
+    Generate and execute SQL for each sub-question concurrently, in input order.
+
+    Each part's progress output ([SQL], retries) is collected in its "output"
+    string instead of being printed as it happens.
+    """
+    stdout = _PerThreadStdout(sys.stdout)
+
+    def _run(sub_question: str) -> Dict[str, Any]:
+        output = stdout.capture()
+        part = _answer_sub_question(sub_question, schema)
+        part["output"] = "".join(output)
+        return part
+
+    sys.stdout = stdout
+    try:
+        with ThreadPoolExecutor(max_workers=len(sub_questions)) as executor:
+            return list(executor.map(_run, sub_questions))
+    finally:
+        sys.stdout = stdout.target
+
+
+@traceable(name="summarize_decomposed_answer")
+def _llm_generate_combined_answer(
+    question: str,
+    parts: List[Dict[str, Any]],
+    on_chunk: Optional[Callable[[str], None]] = None,
+) -> str:
+    """Summarize the results of several sub-questions into one answer to the original question."""
+    sections = []
+    for part in parts:
+        result = part["result"]
+        if result.get("error"):
+            body = "No data found."
+        else:
+            body = _dumps_rows(_summary_blob(result))
+        sections.append("Sub-question:\n" + part["question"] + "\n\n" "Executed SQL:\n" + part["sql"] + "\n\n" "Result (JSON, possibly truncated):\n" + body)
+    prompt = "Question:\n" + question + "\n\n" + "\n\n".join(sections)
+
+    try:
+        if on_chunk is not None:
+            content = config.generate_content_stream(
+                prompt=prompt,
+                model=config.GEMINI_MODEL,
+                temperature=0,
+                system_instruction=_ANSWER_SYSTEM_PROMPT,
+                on_chunk=on_chunk,
+            )
+        else:
+            content = config.generate_content(
+                prompt=prompt,
+                model=config.GEMINI_MODEL,
+                temperature=0,
+                system_instruction=_ANSWER_SYSTEM_PROMPT,
+            )
         return content.strip()
     except Exception:
-        header = ", ".join(cols)
-        lines = [header] + [", ".join(str(r.get(col, "")) for col in cols) for r in sample_rows]
-        if len(rows) > max_rows:
-            lines.append(f"... ({len(rows) - max_rows} more rows)")
-        return "\n".join(lines)
+        return "\n\n".join(part["question"] + "\n" + part["answer"] for part in parts)
 
 
-def _print_schema(database: str) -> None:
+def _print_schema(schema: str) -> None:
     print("=== Database schema (tables/columns) ===")
-    print(_fetch_schema_snapshot(database))
+    print(schema)
+
+
+def _format_rows(rows: List[Dict[str, Any]], cols: List[str], sep: str) -> List[str]:
+    """Render result rows as `sep`-joined cell strings, resolving column access once per call."""
+    if not cols:
+        return ["" for _ in rows]
+    getter = operator.itemgetter(*cols)
+    try:
+        if len(cols) == 1:
+            # itemgetter with a single key returns the bare value, not a tuple
+            return [str(getter(r)) for r in rows]
+        return [sep.join(map(str, getter(r))) for r in rows]
+    except KeyError:
+        # Rows that don't carry every column (e.g. cached/partial results)
+        return [sep.join(str(r.get(c, "")) for c in cols) for r in rows]
 
 
-# Pretty-print a sample of the SQL result rows
+# Pretty-print a sample of the SQL result rows. When stdout is redirected (piped
+# CLI runs) only the row count is printed, unless VERBOSE_LOGGING asks for the table.
 def _print_result(result: Dict[str, Any]) -> None:
     try:
         cols = result.get("columns", []) if isinstance(result, dict) else []
         rows = result.get("rows", []) if isinstance(result, dict) else []
-        print("[Result] rows=", len(rows))
+        if result.get("truncated"):
+            print("[Result] rows=", len(rows), "(truncated)")
+        else:
+            print("[Result] rows=", len(rows))
         if not cols or not rows:
             return
+        if not (config.VERBOSE_LOGGING or sys.stdout.isatty()):
+            return
         header = " | ".join(str(c) for c in cols)
-        print(header)
-        print("-" * len(header))
         max_rows = 30
-        for r in rows[:max_rows]:
-            line = " | ".join(str(r.get(c, "")) for c in cols)
-            print(line)
+        lines = [header, "-" * len(header)] + _format_rows(rows[:max_rows], cols, " | ")
         if len(rows) > max_rows:
-            print(f"... ({len(rows) - max_rows} more rows)")
+            lines.append(f"... ({len(rows) - max_rows} more rows)")
+        # One write instead of a print() per row
+        sys.stdout.write("\n".join(lines) + "\n")
     except Exception:
         try:
-            print(json.dumps(result, ensure_ascii=False, default=str)[:4000])
+            print(_dumps_rows(result)[:4000])
         except Exception:
             pass
 
@@ -888,10 +2023,12 @@ def _print_result(result: Dict[str, Any]) -> None:
 # Pocketflow Nodes
 class GetSchemaNode(Node):
     def prep(self, shared):
-        return shared.get("database")
+        return shared.get("database"), shared.get("schema")
 
-    def exec(self, database):
-        return _fetch_schema_snapshot(database)
+    def exec(self, prep_res):
+        database, prefetched = prep_res
+        # main() prefetches the schema alongside the metadata build
+        return prefetched or _fetch_schema_snapshot(database)
 
     def post(self, shared, prep_res, exec_res):
         shared["schema"] = exec_res
@@ -957,13 +2094,26 @@ class SummarizeNode(Node):
         return None
 
 
+@functools.lru_cache(maxsize=None)
+def _sql_flow() -> Flow:
+    """The schema -> SQL -> run -> summarize flow, wired once; per-question state lives in `shared`."""
+    get_schema = GetSchemaNode()
+    gen_sql = GenerateSQLNode()
+    run_sql = RunSQLNode()
+    summarize = SummarizeNode()
+
+    flow = Flow().start(get_schema)
+    get_schema >> gen_sql >> run_sql >> summarize
+    return flow
+
+
 def _run_pipeline_fallback(shared: Dict[str, Any]) -> None:
     # Fallback: run steps sequentially without Pocketflow in case of flow incompatibility
     database = shared.get("database")
     question = shared.get("question")
     metadata = shared.get("metadata", "")
 
-    schema = _fetch_schema_snapshot(database)
+    schema = shared.get("schema") or _fetch_schema_snapshot(database)
     shared["schema"] = schema
     sql = _llm_generate_sql(question, schema, config.GEMINI_MODEL, metadata)
     shared["sql"] = sql
@@ -981,21 +2131,26 @@ def _run_pipeline_fallback(shared: Dict[str, Any]) -> None:
     print("[Answer]\n" + answer + "\n", flush=True)
 
 
+_ANSWER_HEADER = "[Answer]\n"
+
+
 def _interactive_loop() -> None:
     if not (config.GEMINI_API_KEY):
         print("GEMINI_API_KEY not configured", file=sys.stderr)
         sys.exit(1)
 
     database = config.PGSCHEMA
-    _print_schema(database)
-
-    get_schema = GetSchemaNode()
-    gen_sql = GenerateSQLNode()
-    run_sql = RunSQLNode()
-    summarize = SummarizeNode()
-
-    flow = Flow().start(get_schema)
-    get_schema >> gen_sql >> run_sql >> summarize
+    # Warm everything that doesn't depend on the question while the user is still typing:
+    # the schema, parsed metadata files and the Gemini client.
+    warmup = ThreadPoolExecutor(max_workers=3)
+    schema_future = warmup.submit(_fetch_schema_snapshot, database)
+    warmup.submit(_warm_metadata_cache)
+    warmup.submit(config.get_genai_client)
+    warmup.shutdown(wait=False)
+    _print_schema(schema_future.result())
+
+    # Per-question schema fetches run in the background, overlapping table selection
+    schema_pool = ThreadPoolExecutor(max_workers=1)
 
     print("\nType a question to query the database (or 'exit' to quit).\n")
     while True:
@@ -1009,20 +2164,48 @@ def _interactive_loop() -> None:
         if prompt.lower() in {"exit", "quit", ":q", "q"}:
             break
 
-        # Build metadata per-question from catalog selection
-        metadata_blob = _build_question_metadata(prompt)
-        shared = {"question": prompt, "database": database, "metadata": metadata_blob}
         try:
-            # Support different pocketflow versions
-            if hasattr(flow, "_run"):
-                flow._run(shared)
-            else:
-                flow.run(shared)
+            data_version = _data_version(database)
         except Exception as exc:
-            print(f"Error while running flow: {exc}", file=sys.stderr)
-        # Fallback if no answer was produced
-        if not shared.get("answer"):
-            _run_pipeline_fallback(shared)
+            print(f"Error while answering question: {exc}", file=sys.stderr)
+            continue
+        cached = _get_cached_answer(prompt, data_version)
+        if cached is not None:
+            _print_result(cached["result"])
+            print(_ANSWER_HEADER + cached["answer"] + "\n", flush=True)
+            continue
+
+        # The pipeline is strictly linear (schema -> SQL -> execute -> summarize),
+        # so call the steps directly instead of going through a Pocketflow Flow
+        try:
+            schema_future = schema_pool.submit(_fetch_schema_snapshot, database)  # cached; refreshed after the TTL
+            sub_questions = _llm_decompose(prompt)
+            if sub_questions:
+                # Independent parts of a comparison run concurrently; one summary combines them
+                parts = _run_decomposed(sub_questions, schema_future.result())
+                for part in parts:
+                    sys.stdout.write(f"[Sub-question] {part['question']}\n" + part["output"])
+                    _print_result(part["result"])
+                config.print_streamed_answer(lambda on_chunk: _llm_generate_combined_answer(prompt, parts, on_chunk=on_chunk), _ANSWER_HEADER)
+                continue
+
+            metadata, sql = _generate_sql_with_metadata(prompt, schema_future)
+            schema = schema_future.result()
+            exec_out = _execute_with_retries(
+                initial_sql=sql,
+                question=prompt,
+                schema=schema,
+                metadata=metadata,
+            )
+            _print_result(exec_out["result"])
+            answer = config.print_streamed_answer(lambda on_chunk: _llm_generate_answer(prompt, exec_out["sql"], exec_out["result"], config.GEMINI_SUMMARY_MODEL, on_chunk=on_chunk), _ANSWER_HEADER)
+            # The raw-rows fallback means Gemini failed; ask again next time
+            if getattr(_ANSWER_PATH, "value", None) != "fallback":
+                _store_cached_answer(prompt, data_version, exec_out["sql"], exec_out["result"], answer)
+        except Exception as exc:
+            print(f"Error while answering question: {exc}", file=sys.stderr)
+
+    schema_pool.shutdown(wait=False)
 
 
 def main() -> None:
@@ -1033,18 +2216,20 @@ def main() -> None:
             sys.exit(1)
 
         database = config.PGSCHEMA
-        # Build metadata per-question from catalog selection
-        metadata = _build_question_metadata(question)
-
-        get_schema = GetSchemaNode()
-        gen_sql = GenerateSQLNode()
-        run_sql = RunSQLNode()
-        summarize = SummarizeNode()
+        # Fetch the schema while metadata is built per-question from catalog selection
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            schema_future = executor.submit(_fetch_schema_snapshot, database)
+            metadata = _build_question_metadata(question)
+            try:
+                schema = schema_future.result()
+            except Exception as exc:
+                # GetSchemaNode fetches it again and reports the error through the flow
+                print(f"[Warning] Schema prefetch failed: {exc}", file=sys.stderr)
+                schema = None
 
-        flow = Flow().start(get_schema)
-        get_schema >> gen_sql >> run_sql >> summarize
+        flow = _sql_flow()
 
-        shared = {"question": question, "database": database, "metadata": metadata}
+        shared = {"question": question, "database": database, "metadata": metadata, "schema": schema}
         try:
             if hasattr(flow, "_run"):
                 flow._run(shared)
@@ -0,0 +1,33 @@
+"""
+Check that the SQL pipeline still imports and runs its helpers untraced
+when langsmith is not installed.
+"""
+
+import importlib.util
+from pathlib import Path
+import sys
+
+import pytest
+
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(_PROJECT_ROOT))
+
+pytest.importorskip("pymysql")
+pytest.importorskip("pocketflow")
+
+_SQL_RETRIEVAL = _PROJECT_ROOT / "main_chat" / "sql_pipeline" / "sql_retrieval.py"
+
+
+def test_sql_pipeline_imports_without_langsmith(monkeypatch):
+    # A None entry makes `from langsmith import traceable` raise ImportError
+    monkeypatch.setitem(sys.modules, "langsmith", None)
+    spec = importlib.util.spec_from_file_location("sql_retrieval_without_langsmith", _SQL_RETRIEVAL)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    def step():
+        return "ran"
+
+    assert module.traceable(step) is step
+    assert module.traceable(name="step", process_inputs=module._trace_inputs)(step) is step
+    assert module._error_signature("(1054, \"Unknown column 'x'\")") == "(?, \"Unknown column 'x'\")"
@@ -0,0 +1,40 @@
+"""
+Check that retrieve() scores and thresholds the same whether it embeds the
+query text itself or is handed a precomputed query vector.
+
+Uses an in-memory stand-in for the Chroma store; no vector DB or Gemini needed.
+"""
+
+from pathlib import Path
+import sys
+
+import pytest
+
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(_PROJECT_ROOT))
+
+documents = pytest.importorskip("langchain_core.documents")
+
+from main_chat.rag_pipeline import rag_retrieval  # noqa: E402
+
+_HITS = [("policy a", {"tags": "housing"}, 0.12), ("policy b", {"tags": "transit"}, 0.35), ("policy c", {"tags": "housing, parks"}, 0.80)]
+
+
+class _FakeVectorDB:
+    """Chroma-like store; like langchain_chroma, both scored searches return (doc, distance), lower is closer."""
+
+    def similarity_search_with_score(self, query, k, filter=None):
+        return [(documents.Document(page_content=text, metadata=meta), distance) for text, meta, distance in _HITS[:k]]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k, filter=None):
+        return self.similarity_search_with_score("", k, filter)
+
+
+@pytest.mark.parametrize("tags", [None, ["housing"]])
+def test_vector_and_text_paths_agree(tags):
+    db = _FakeVectorDB()
+    by_text = rag_retrieval.retrieve("housing plan", k=2, tags=tags, min_score=0.5, vectordb=db)
+    by_vector = rag_retrieval.retrieve("housing plan", k=2, tags=tags, min_score=0.5, vectordb=db, query_vector=[0.1, 0.2])
+    assert by_vector == by_text
+    # min_score is a distance cutoff: only hits at or below it are kept
+    assert all(score <= 0.5 for score in by_vector["scores"])
@@ -0,0 +1,42 @@
+"""
+Unit tests for the route classifier's reply cache.
+
+Gemini is replaced by a fake; no API key or vector DB is needed.
+"""
+
+from pathlib import Path
+import sys
+
+import pytest
+
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(_PROJECT_ROOT))
+
+from main_chat import chat_route  # noqa: E402
+
+
+@pytest.fixture
+def router_prompts(monkeypatch):
+    prompts = []
+
+    def _generate(prompt, **kwargs):
+        prompts.append(prompt)
+        return '{"mode": "sql", "transcript_tags": null, "policy_sources": null, "folder_categories": null, "k": 5}'
+
+    monkeypatch.setattr(chat_route, "_ROUTE_CACHE", type(chat_route._ROUTE_CACHE)())
+    monkeypatch.setattr(chat_route.config, "generate_content", _generate)
+    return prompts
+
+
+def test_router_sees_the_original_casing(router_prompts):
+    chat_route._classify_route("How many BPD calls on Dorchester Ave?", "2026-10-17")
+    assert "Question:\nHow many BPD calls on Dorchester Ave?\n" in router_prompts[0]
+
+
+def test_router_replies_are_cached_per_normalized_question_and_day(router_prompts):
+    first = chat_route._classify_route("How many BPD calls on Dorchester Ave?", "2026-10-17")
+    assert chat_route._classify_route("  how many bpd calls   on dorchester ave? ", "2026-10-17") == first
+    assert len(router_prompts) == 1
+
+    chat_route._classify_route("How many BPD calls on Dorchester Ave?", "2026-10-18")
+    assert len(router_prompts) == 2
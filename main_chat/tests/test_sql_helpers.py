@@ -0,0 +1,662 @@
+"""
+Unit tests for the SQL pipeline's pure helpers.
+
+They import sql_retrieval (so pymysql and pocketflow must be installed) but
+never open a MySQL connection or call Gemini.
+"""
+
+from pathlib import Path
+import sys
+
+import pytest
+
+_PROJECT_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(_PROJECT_ROOT))
+
+pytest.importorskip("pymysql")
+pytest.importorskip("pocketflow")
+
+from main_chat.sql_pipeline import sql_retrieval  # noqa: E402
+
+_SCHEMA = "service_requests_311 (case_id, type, reason, open_dt, neighborhood)\nweekly_events (event_name, event_date, start_date, end_date, start_time, end_time)"
+
+
+# --- _validate_sql ---------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT COUNT(*) FROM `service_requests_311`",
+        "SELECT REPLACE(`type`, '_', ' ') FROM `service_requests_311`",
+        'SELECT REPLACE(type, "_", " ") FROM service_requests_311',
+        "SELECT INSERT(`reason`, 1, 3, 'abc') FROM `service_requests_311`",
+        "SELECT `type` FROM `service_requests_311` WHERE `reason` = 'Street Light Update'",
+        "WITH t AS (SELECT `type` FROM `service_requests_311`) SELECT * FROM t",
+        "SELECT 1;",
+    ],
+)
+def test_validate_sql_accepts_read_only_select(sql):
+    sql_retrieval._validate_sql(sql)
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "DELETE FROM `service_requests_311`",
+        "REPLACE INTO `service_requests_311` VALUES (1)",
+        "INSERT INTO `service_requests_311` VALUES (1)",
+        "SELECT 1; DROP TABLE `service_requests_311`",
+        "SELECT * FROM t UNION SELECT 1 FROM t2 REPLACE INTO t",
+        "SELECT * FROM `service_requests_311` WHERE `type` = 'open",
+    ],
+)
+def test_validate_sql_rejects_writes_and_bad_quoting(sql):
+    with pytest.raises(ValueError):
+        sql_retrieval._validate_sql(sql)
+
+
+def test_validate_sql_checks_names_against_schema():
+    pytest.importorskip("sqlglot")
+    sql_retrieval._validate_sql("SELECT `type`, COUNT(*) AS n FROM `service_requests_311` GROUP BY `type` ORDER BY n", _SCHEMA)
+    with pytest.raises(ValueError, match="street_violations"):
+        sql_retrieval._validate_sql("SELECT * FROM `street_violations`", _SCHEMA)
+    with pytest.raises(ValueError, match="subject"):
+        sql_retrieval._validate_sql("SELECT `subject` FROM `service_requests_311`", _SCHEMA)
+
+
+def test_validate_sql_skips_name_checks_without_schema():
+    sql_retrieval._validate_sql("SELECT `subject` FROM `street_violations`")
+
+
+# --- _error_signature --------------------------------------------------------
+
+
+def test_error_signature_ignores_position_but_not_identifiers():
+    syntax_a = "(1064, \"You have an error in your SQL syntax; check the manual near 'FROM x' at line 1\")"
+    syntax_b = "(1064, \"You have an error in your SQL syntax; check the manual near 'WHERE y = 2' at line 3\")"
+    assert sql_retrieval._error_signature(syntax_a) == sql_retrieval._error_signature(syntax_b)
+
+    unknown_foo = "(1054, \"Unknown column 'foo' in 'field list'\")"
+    unknown_bar = "(1054, \"Unknown column 'bar' in 'field list'\")"
+    assert sql_retrieval._error_signature(unknown_foo) != sql_retrieval._error_signature(unknown_bar)
+
+
+# --- answer cache ------------------------------------------------------------
+
+
+@pytest.fixture
+def empty_query_cache(monkeypatch):
+    monkeypatch.setattr(sql_retrieval.config, "QUERY_CACHE_MAX_ENTRIES", 8)
+    monkeypatch.setattr(sql_retrieval, "_QUERY_CACHE", type(sql_retrieval._QUERY_CACHE)())
+
+
+def test_answer_cache_stores_successful_results(empty_query_cache):
+    result = {"columns": ["n"], "rows": [{"n": 3}]}
+    sql_retrieval._store_cached_answer("How many requests?", "v1", "SELECT COUNT(*) AS n FROM t", result, "Count: 3")
+    hit = sql_retrieval._get_cached_answer("how many requests", "v1")
+    assert hit is not None and hit["answer"] == "Count: 3"
+    # Answers from before a schema or metadata change are not served
+    assert sql_retrieval._get_cached_answer("how many requests", "v2") is None
+
+
+def test_answer_cache_skips_failed_and_time_dependent_queries(empty_query_cache):
+    failed = {"columns": [], "rows": [], "error": "(2013, 'Lost connection to MySQL server')"}
+    sql_retrieval._store_cached_answer("How many requests?", "v1", "SELECT COUNT(*) FROM t", failed, "I couldn't find any data")
+    sql_retrieval._store_cached_answer("Events today?", "v1", "SELECT * FROM t WHERE d = CURDATE()", {"columns": ["d"], "rows": [{"d": 1}]}, "d: 1")
+    assert sql_retrieval._get_cached_answer("How many requests?", "v1") is None
+    assert sql_retrieval._get_cached_answer("Events today?", "v1") is None
+
+
+def test_data_version_follows_schema_and_metadata(monkeypatch):
+    sources = {"schema": _SCHEMA, "catalog": list(_CATALOG), "metadata": '{"tables": []}'}
+    monkeypatch.setattr(sql_retrieval, "_DATA_VERSION", ((), ""))
+    monkeypatch.setattr(sql_retrieval, "_fetch_schema_snapshot", lambda database: sources["schema"])
+    monkeypatch.setattr(sql_retrieval, "_load_catalog_entries", lambda: sources["catalog"])
+    monkeypatch.setattr(sql_retrieval, "_read_selected_metadata_json", lambda tables, catalog: sources["metadata"])
+    monkeypatch.setattr(sql_retrieval, "_read_metadata_text", lambda: "")
+
+    first = sql_retrieval._data_version("db")
+    assert sql_retrieval._data_version("db") == first
+
+    sources["schema"] = _SCHEMA + "\nshootings (incident_num, district)"
+    after_ddl = sql_retrieval._data_version("db")
+    sources["metadata"] = '{"tables": [{"table": "shootings"}]}'
+    after_edit = sql_retrieval._data_version("db")
+    sources["catalog"] = _CATALOG + [{"table": "shootings"}]
+    after_catalog = sql_retrieval._data_version("db")
+    assert len({first, after_ddl, after_edit, after_catalog}) == 4
+
+
+# --- _match_sql_template -----------------------------------------------------
+
+_CATALOG = [{"table": "weekly_events"}, {"table": "service_requests_311"}]
+
+
+@pytest.mark.parametrize(
+    "question, period",
+    [
+        ("What's happening this week?", "this week"),
+        ("what events are happening this weekend", "this weekend"),
+        ("Show me events today", "today"),
+        ("events this week in Dorchester", "this week"),
+        ("What are the things to do this weekend?", "this weekend"),
+        ("What is going on today?", "today"),
+        ("Which activities are scheduled this week?", "this week"),
+    ],
+)
+def test_template_matches_plain_event_listings(question, period):
+    assert sql_retrieval._match_sql_template(question, _CATALOG) == sql_retrieval._EVENTS_TEMPLATES[period]
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "what is today",
+        "what today",
+        "show me this week",
+        "What is the date today?",
+        "this week",
+        "what crimes happened this week",
+        "what events are happening this week for kids",
+        "how many 311 requests this week",
+    ],
+)
+def test_template_leaves_other_questions_to_gemini(question):
+    assert sql_retrieval._match_sql_template(question, _CATALOG) is None
+
+
+def test_template_needs_events_table_in_catalog():
+    assert sql_retrieval._match_sql_template("What's happening this week?", [{"table": "service_requests_311"}]) is None
+
+
+def test_event_templates_pass_validation():
+    for sql in sql_retrieval._EVENTS_TEMPLATES.values():
+        sql_retrieval._validate_sql(sql, _SCHEMA)
+
+
+# --- _execute_with_retries short-circuits -----------------------------------
+
+
+def _fail_with(code, message):
+    def _execute(sql, *args, **kwargs):
+        raise Exception(code, message)
+
+    return _execute
+
+
+def test_lost_connection_stops_retries_without_refine(monkeypatch):
+    refines = []
+    monkeypatch.setattr(sql_retrieval, "_execute_sql", _fail_with(2013, "Lost connection to MySQL server during query"))
+    monkeypatch.setattr(sql_retrieval, "_llm_refine_sql", lambda **kwargs: refines.append(kwargs) or "SELECT 2")
+    out = sql_retrieval._execute_with_retries("SELECT 1", "q", "", "{}", max_attempts=3)
+    assert refines == []
+    assert "Lost connection" in out["result"]["error"]
+
+
+def test_repeated_error_stops_after_one_refine(monkeypatch):
+    refines = []
+    monkeypatch.setattr(sql_retrieval, "_execute_sql", _fail_with(1064, "You have an error in your SQL syntax near 'x' at line 1"))
+    monkeypatch.setattr(sql_retrieval, "_llm_refine_sql", lambda **kwargs: refines.append(kwargs) or f"SELECT {len(refines) + 1}")
+    out = sql_retrieval._execute_with_retries("SELECT 1", "q", "", "{}", max_attempts=5)
+    assert len(refines) == 1
+    assert out["result"]["rows"] == []
+
+
+def test_same_sql_and_error_is_not_refined_twice(monkeypatch):
+    runs, refines = [], []
+
+    def _execute(sql, *args, **kwargs):
+        runs.append(sql)
+        raise Exception(1205, "Lock wait timeout exceeded; try restarting transaction")
+
+    def _refine(**kwargs):
+        refines.append(kwargs)
+        raise RuntimeError("503 UNAVAILABLE")
+
+    monkeypatch.setattr(sql_retrieval, "_execute_sql", _execute)
+    monkeypatch.setattr(sql_retrieval, "_llm_refine_sql", _refine)
+    out = sql_retrieval._execute_with_retries("SELECT 1", "q", "", "{}", max_attempts=5)
+    # The failed rewrite leaves the same SQL, which is run once more and then given up on
+    assert runs == ["SELECT 1", "SELECT 1"]
+    assert len(refines) == 1
+    assert "Lock wait timeout" in out["result"]["error"]
+
+
+# --- table-selection embeddings ----------------------------------------------
+
+
+def test_failed_catalog_embedding_is_not_retried_until_backoff(monkeypatch):
+    calls = []
+
+    def _embed_batch(texts):
+        calls.append(len(texts))
+        raise RuntimeError("429 RESOURCE_EXHAUSTED")
+
+    monkeypatch.setattr(sql_retrieval.config, "TABLE_SELECT_MIN_SIMILARITY", 0.75)
+    monkeypatch.setattr(sql_retrieval.config, "embed_content_batch", _embed_batch)
+    monkeypatch.setattr(sql_retrieval, "_TABLE_EMBEDDINGS", {})
+    monkeypatch.setattr(sql_retrieval, "_TABLE_EMBEDDING_FAILURES", {})
+
+    assert sql_retrieval._embedding_select_tables("311 requests", _CATALOG) == []
+    assert sql_retrieval._embedding_select_tables("crime last month", _CATALOG) == []
+    assert calls == [len(_CATALOG)]
+
+    # Once the backoff has passed, the batch is tried again
+    key = next(iter(sql_retrieval._TABLE_EMBEDDING_FAILURES))
+    mtime, _ = sql_retrieval._TABLE_EMBEDDING_FAILURES[key]
+    sql_retrieval._TABLE_EMBEDDING_FAILURES[key] = (mtime, 0.0)
+    assert sql_retrieval._embedding_select_tables("311 requests", _CATALOG) == []
+    assert len(calls) == 2
+
+
+def test_catalog_is_embedded_in_batched_requests(monkeypatch):
+    requests = []
+
+    class _Models:
+        def embed_content(self, model, contents):
+            requests.append(list(contents))
+            return type("R", (), {"embeddings": [type("E", (), {"values": [float(len(t))]})() for t in contents]})()
+
+    monkeypatch.setattr(sql_retrieval.config, "get_genai_client", lambda: type("C", (), {"models": _Models()})())
+    texts = ["x" * (i % 7) for i in range(150)]
+    assert sql_retrieval.config.embed_content_batch(texts) == [[float(len(t))] for t in texts]
+    assert [len(batch) for batch in requests] == [100, 50]
+
+
+_CRIME_CATALOG = _CATALOG + [{"table": "crime_incident_reports"}]
+
+
+def test_embedding_pick_follows_the_311_priority(monkeypatch):
+    names = ["crime_incident_reports", "service_requests_311", "weekly_events"]
+    vectors = [[1.0, 0.0], [0.97, 0.243], [0.0, 1.0]]
+    monkeypatch.setattr(sql_retrieval.config, "TABLE_SELECT_MIN_SIMILARITY", 0.75)
+    monkeypatch.setattr(sql_retrieval, "_catalog_embeddings", lambda catalog: (names, vectors))
+    monkeypatch.setattr(sql_retrieval, "_question_embedding", lambda question: (1.0, 0.0))
+
+    # Closest by similarity is the crime table, but an explicit "311" wins
+    assert sql_retrieval._embedding_select_tables("311 calls about violations", _CRIME_CATALOG) == ["service_requests_311"]
+    assert sql_retrieval._embedding_select_tables("violations near me", _CRIME_CATALOG) == ["crime_incident_reports", "service_requests_311"]
+
+
+@pytest.mark.parametrize(
+    "question, picked, expected",
+    [
+        ("How many 311 requests about crime?", ["crime_incident_reports"], ["service_requests_311"]),
+        ("crime incidents last week", ["service_requests_311"], ["crime_incident_reports", "service_requests_311"]),
+        ("trash pickup", ["service_requests_311"], ["service_requests_311"]),
+        ("311 requests", [], []),
+    ],
+)
+def test_table_priority_post_filter(question, picked, expected):
+    assert sql_retrieval._apply_table_priority(question, picked, _CRIME_CATALOG) == expected
+
+
+# --- batched unique values ---------------------------------------------------
+
+
+class _RecordingCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, sql, args):
+        self.executed.append((sql, args))
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+def test_unique_values_are_fetched_as_text_in_one_statement():
+    cur = _RecordingCursor([(0, "Pothole"), (0, "Street Light"), (1, "2"), (1, "14")])
+    values = sql_retrieval._query_unique_values(cur, "boston", "service_requests_311", ["type", "case_id"], 10)
+
+    assert len(cur.executed) == 1
+    sql, args = cur.executed[0]
+    assert sql.count("FROM `boston`.`service_requests_311`") == 2
+    assert sql.count("UNION ALL") == 1
+    assert sql.count("CAST(raw AS CHAR)") == 2
+    assert args == (10, 10)
+    assert values == {"type": ["Pothole", "Street Light"], "case_id": ["2", "14"]}
+
+
+def test_text_suggestions_render_like_typed_values():
+    # CAST turns numeric suggestions into strings; what the user sees must not change
+    empty = {"columns": ["n"], "rows": []}
+    typed = sql_retrieval._llm_generate_answer("q", "SELECT 1", {**empty, "unique_values": {"district": [11, 12]}}, "m")
+    as_text = sql_retrieval._llm_generate_answer("q", "SELECT 1", {**empty, "unique_values": {"district": ["11", "12"]}}, "m")
+    assert typed == as_text
+    assert "11, 12" in as_text
+
+
+# --- streamed answer printer -------------------------------------------------
+
+
+def _streaming(chunks, answer):
+    def _generate(on_chunk):
+        print("[Progress] summarizing")
+        for chunk in chunks:
+            on_chunk(chunk)
+        return answer
+
+    return _generate
+
+
+@pytest.mark.parametrize(
+    "chunks, answer, expected",
+    [
+        (["There were ", "3 requests."], "There were 3 requests.", "[Progress] summarizing\n[Answer]\nThere were 3 requests.\n\n"),
+        ([], "Count: 3", "[Progress] summarizing\n[Answer]\nCount: 3\n\n"),
+        (["There were "], "Rows:\nn: 3", "[Progress] summarizing\n[Answer]\nThere were \n\nRows:\nn: 3\n\n"),
+    ],
+)
+def test_streamed_answer_prints_header_once_after_progress(capsys, chunks, answer, expected):
+    assert sql_retrieval.config.print_streamed_answer(_streaming(chunks, answer), "[Answer]\n") == answer
+    assert capsys.readouterr().out == expected
+
+
+def test_rate_limit_retries_log_to_stderr(monkeypatch, capsys):
+    calls = []
+
+    def _call():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("429 RESOURCE_EXHAUSTED. Please retry in 0.01s")
+        return "ok"
+
+    monkeypatch.setattr(sql_retrieval.config, "VERBOSE_LOGGING", True)
+    monkeypatch.setattr(sql_retrieval.config.time, "sleep", lambda seconds: None)
+    assert sql_retrieval.config._call_gemini(_call) == "ok"
+    out = capsys.readouterr()
+    # stdout carries only the streamed answer
+    assert out.out == ""
+    assert "[Debug] Gemini rate limited" in out.err
+
+
+def test_token_usage_logs_to_stderr(monkeypatch, capsys):
+    usage = type("U", (), {"prompt_token_count": 1200, "cached_content_token_count": 1024})()
+    monkeypatch.setattr(sql_retrieval.config, "VERBOSE_LOGGING", True)
+    sql_retrieval.config._log_usage(type("R", (), {"usage_metadata": usage})())
+    out = capsys.readouterr()
+    assert out.out == ""
+    assert "prompt_tokens=1200 cached_tokens=1024" in out.err
+
+
+# --- _llm_generate_answer fast paths -----------------------------------------
+
+
+def _no_gemini(*args, **kwargs):
+    raise AssertionError("fast paths must not call Gemini")
+
+
+@pytest.fixture
+def offline_answers(monkeypatch):
+    monkeypatch.setattr(sql_retrieval.config, "generate_content", _no_gemini)
+    monkeypatch.setattr(sql_retrieval.config, "generate_content_stream", _no_gemini)
+
+
+def _answer(sql, result):
+    answer = sql_retrieval._llm_generate_answer("q", sql, result, "m")
+    return answer, sql_retrieval._ANSWER_PATH.value
+
+
+def test_answer_hides_sql_errors(offline_answers):
+    answer, _ = _answer("SELECT x", {"columns": [], "rows": [], "error": "(1054, \"Unknown column 'x'\")"})
+    assert answer.startswith("I couldn't find any data")
+    assert "1054" not in answer
+
+
+def test_answer_without_rows(offline_answers):
+    assert _answer("SELECT 1", {"columns": ["n"], "rows": []})[0] == "No results found."
+    hint, _ = _answer("SELECT 1", {"columns": ["n"], "rows": [], "unique_values": {"type": [f"t{i}" for i in range(12)]}})
+    assert "**type**" in hint and "(and 2 more)" in hint
+
+
+@pytest.mark.parametrize(
+    "sql, result, expected, path",
+    [
+        ("SELECT COUNT(*) AS n FROM t", {"columns": ["n"], "rows": [{"n": 42}]}, "Count: 42", "count"),
+        ("SELECT MAX(d) AS latest FROM t", {"columns": ["latest"], "rows": [{"latest": "2024-05-01"}]}, "latest: 2024-05-01", "scalar"),
+        (
+            "SELECT type, COUNT(*) AS n FROM t GROUP BY type",
+            {"columns": ["type", "n"], "rows": [{"type": "Pothole", "n": 3}, {"type": "Graffiti", "n": 1}]},
+            "| type | n |\n|---|---|\n| Pothole | 3 |\n| Graffiti | 1 |",
+            "markdown_table",
+        ),
+        (
+            "SELECT a, b, c, d FROM t",
+            {"columns": ["a", "b", "c", "d"], "rows": [{"a": 1, "b": 2, "c": 3, "d": 4}, {"a": 5, "b": 6, "c": 7, "d": 8}]},
+            "- a: 1, b: 2, c: 3, d: 4\n- a: 5, b: 6, c: 7, d: 8",
+            "small_table",
+        ),
+    ],
+)
+def test_trivial_results_are_answered_locally(offline_answers, sql, result, expected, path):
+    assert _answer(sql, result) == (expected, path)
+
+
+_WIDE_RESULT = {"columns": ["a", "b", "c", "d"], "rows": [{"a": i, "b": i, "c": i, "d": i} for i in range(35)]}
+
+
+def test_larger_results_are_summarized_by_gemini(monkeypatch):
+    prompts = []
+    monkeypatch.setattr(sql_retrieval.config, "generate_content", lambda prompt, **kwargs: prompts.append(prompt) or "  Summary.  ")
+    assert _answer("SELECT a, b, c, d FROM t", _WIDE_RESULT) == ("Summary.", "llm")
+    assert '"truncated":true' in prompts[0].replace(" ", "")
+
+
+def test_gemini_failure_falls_back_to_raw_rows(monkeypatch):
+    monkeypatch.setattr(sql_retrieval.config, "generate_content", lambda prompt, **kwargs: 1 / 0)
+    answer, path = _answer("SELECT a, b, c, d FROM t", _WIDE_RESULT)
+    assert path == "fallback"
+    lines = answer.splitlines()
+    assert lines[0] == "a, b, c, d"
+    assert len(lines) == 1 + 30 + 1 and lines[-1] == "... (5 more rows)"
+
+
+# --- _execute_sql and cache invalidation -------------------------------------
+
+
+class _FakeCursor:
+    """Unbuffered tuple cursor, like pymysql's SSCursor."""
+
+    def __init__(self, columns, rows, executed):
+        self.rows = list(rows)
+        self.executed = executed
+        self.description = [(name,) for name in columns] if columns else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, args=None):
+        self.executed.append(sql)
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def __iter__(self):
+        return iter(())
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """Serve `fake_db.columns`/`fake_db.rows` to every query and record the SQL that was run."""
+    from contextlib import contextmanager
+
+    class _DB:
+        columns = []
+        rows = []
+        executed = []
+
+    class _Conn:
+        def cursor(self, *args):
+            return _FakeCursor(_DB.columns, _DB.rows, _DB.executed)
+
+    @contextmanager
+    def _pooled_connection():
+        yield _Conn()
+
+    monkeypatch.setattr(sql_retrieval, "_pooled_connection", _pooled_connection)
+    monkeypatch.setattr(sql_retrieval, "_FETCH_BATCH_SIZE", 4)
+    return _DB
+
+
+def test_execute_sql_stops_at_max_rows(fake_db):
+    fake_db.columns = ["n"]
+    fake_db.rows = [(i,) for i in range(10)]
+    capped = sql_retrieval._execute_sql("SELECT n FROM t", max_rows=6)
+    assert capped == {"columns": ["n"], "rows": [{"n": i} for i in range(6)], "truncated": True}
+
+    whole = sql_retrieval._execute_sql("SELECT n FROM t", max_rows=10)
+    assert len(whole["rows"]) == 10 and whole["truncated"] is False
+
+
+def test_execute_sql_row_keys_match_columns_for_duplicate_names(fake_db):
+    # SELECT a.id, b.id, a.type FROM t a JOIN t b ...
+    fake_db.columns = ["id", "id", "type"]
+    fake_db.rows = [(1, 2, "Pothole"), (3, 4, "Graffiti")]
+    out = sql_retrieval._execute_sql("SELECT a.id, b.id, a.type FROM t a JOIN t b ON a.type = b.type", max_rows=10)
+    assert out["columns"] == ["id", "id", "type"]
+    assert all(set(row) == set(out["columns"]) for row in out["rows"])
+    assert [row["type"] for row in out["rows"]] == ["Pothole", "Graffiti"]
+
+
+@pytest.mark.parametrize("code", [1146, 1054])
+def test_unknown_table_or_column_drops_the_schema_snapshot(monkeypatch, code):
+    monkeypatch.setattr(sql_retrieval, "_SCHEMA_CACHE", {"db": (0.0, _SCHEMA)})
+    monkeypatch.setattr(sql_retrieval, "_execute_sql", _fail_with(code, "Table 'db.street_violations' doesn't exist"))
+    sql_retrieval._execute_with_retries("SELECT 1", "q", _SCHEMA, "{}", max_attempts=1)
+    assert sql_retrieval._SCHEMA_CACHE == {}
+
+
+def test_other_errors_keep_the_schema_snapshot(monkeypatch):
+    monkeypatch.setattr(sql_retrieval, "_SCHEMA_CACHE", {"db": (0.0, _SCHEMA)})
+    monkeypatch.setattr(sql_retrieval, "_execute_sql", _fail_with(1064, "You have an error in your SQL syntax"))
+    sql_retrieval._execute_with_retries("SELECT 1", "q", _SCHEMA, "{}", max_attempts=1)
+    assert "db" in sql_retrieval._SCHEMA_CACHE
+
+
+@pytest.fixture
+def unique_values_queries(fake_db, monkeypatch):
+    """Empty unique-values cache whose fetches are recorded as (schema, table, columns)."""
+    queries = []
+
+    def _query(cur, schema_name, table_name, column_names, limit):
+        queries.append((schema_name, table_name, list(column_names)))
+        return {c: [f"{schema_name}.{c}"] for c in column_names}
+
+    monkeypatch.setattr(sql_retrieval, "_UNIQUE_VALUES_CACHE", type(sql_retrieval._UNIQUE_VALUES_CACHE)())
+    monkeypatch.setattr(sql_retrieval, "_query_unique_values", _query)
+    return queries
+
+
+def test_unique_values_are_served_from_cache_until_ttl(unique_values_queries):
+    db = sql_retrieval.config.MYSQL_DB
+    assert sql_retrieval._get_unique_values_multi("t", ["type", "reason"]) == {"type": [f"{db}.type"], "reason": [f"{db}.reason"]}
+    assert sql_retrieval._get_unique_values_multi("t", ["type", "reason"]) == {"type": [f"{db}.type"], "reason": [f"{db}.reason"]}
+    assert len(unique_values_queries) == 1
+
+    # An expired entry is fetched again, alone
+    read_at, cached = sql_retrieval._UNIQUE_VALUES_CACHE[(db, "t", "type", 50)]
+    sql_retrieval._UNIQUE_VALUES_CACHE[(db, "t", "type", 50)] = (read_at - sql_retrieval._UNIQUE_VALUES_TTL_SECONDS - 1, cached)
+    sql_retrieval._get_unique_values_multi("t", ["type", "reason"])
+    assert unique_values_queries[1] == (db, "t", ["type"])
+
+
+def test_unique_values_are_cached_per_schema(unique_values_queries):
+    assert sql_retrieval._get_unique_values_multi("t", ["type"], schema_name="boston") == {"type": ["boston.type"]}
+    assert sql_retrieval._get_unique_values_multi("t", ["type"], schema_name="archive") == {"type": ["archive.type"]}
+    assert len(unique_values_queries) == 2
+
+
+def test_unique_values_cache_evicts_least_recently_used(unique_values_queries, monkeypatch):
+    monkeypatch.setattr(sql_retrieval, "_UNIQUE_VALUES_CACHE_MAX", 2)
+    sql_retrieval._get_unique_values_multi("t", ["a"])
+    sql_retrieval._get_unique_values_multi("t", ["b"])
+    sql_retrieval._get_unique_values_multi("t", ["a"])  # hit; "b" is now the oldest
+    sql_retrieval._get_unique_values_multi("t", ["c"])
+    assert [key[2] for key in sql_retrieval._UNIQUE_VALUES_CACHE] == ["a", "c"]
+    assert len(unique_values_queries) == 3
+
+
+# --- table-selection cache ---------------------------------------------------
+
+
+def test_table_selection_is_cached_per_question_and_catalog(monkeypatch):
+    picks = []
+    monkeypatch.setattr(sql_retrieval, "_TABLE_SELECTION_CACHE", type(sql_retrieval._TABLE_SELECTION_CACHE)())
+    monkeypatch.setattr(sql_retrieval, "_select_tables_uncached", lambda question, catalog: picks.append(question) or ["weekly_events"])
+
+    assert sql_retrieval._llm_select_tables("Events this week?", _CATALOG, "m") == ["weekly_events"]
+    assert sql_retrieval._llm_select_tables("  events   THIS week? ", _CATALOG, "m") == ["weekly_events"]
+    assert len(picks) == 1
+
+    # A reloaded catalog is a new object, so earlier picks no longer apply
+    sql_retrieval._llm_select_tables("Events this week?", list(_CATALOG), "m")
+    assert len(picks) == 2
+
+
+def test_empty_table_selection_is_not_cached(monkeypatch):
+    picks = []
+    monkeypatch.setattr(sql_retrieval, "_TABLE_SELECTION_CACHE", type(sql_retrieval._TABLE_SELECTION_CACHE)())
+    monkeypatch.setattr(sql_retrieval, "_select_tables_uncached", lambda question, catalog: picks.append(question) or [])
+
+    sql_retrieval._llm_select_tables("Events this week?", _CATALOG, "m")
+    sql_retrieval._llm_select_tables("Events this week?", _CATALOG, "m")
+    assert len(picks) == 2
+
+
+# --- decomposed comparison questions -----------------------------------------
+
+
+@pytest.mark.parametrize("question", ["crimes on both Sunday and Monday", "How many 311 requests this week?", "shootings in Dorchester"])
+def test_plain_questions_are_not_decomposed(monkeypatch, question):
+    monkeypatch.setattr(sql_retrieval.config, "generate_content", _no_gemini)
+    assert sql_retrieval._llm_decompose(question) == []
+
+
+@pytest.mark.parametrize("question", ["Compare crime in 2023 and 2024", "311 requests vs. crime this month", "comparing shootings versus homicides"])
+def test_comparison_questions_are_decomposed(monkeypatch, question):
+    monkeypatch.setattr(sql_retrieval.config, "generate_content", lambda prompt, **kwargs: '["part one", "part two"]')
+    assert sql_retrieval._llm_decompose(question) == ["part one", "part two"]
+
+
+def test_decomposed_parts_keep_their_output_apart(monkeypatch, capsys):
+    import threading
+
+    both_started = threading.Barrier(2, timeout=5)
+
+    def _answer(sub_question, schema):
+        # Both parts print while the other is running
+        print(f"[SQL] {sub_question} 1")
+        both_started.wait()
+        print(f"[SQL] {sub_question} 2")
+        return {"question": sub_question, "sql": "SELECT 1", "result": {"columns": [], "rows": []}, "answer": "No results found."}
+
+    monkeypatch.setattr(sql_retrieval, "_answer_sub_question", _answer)
+    parts = sql_retrieval._run_decomposed(["a", "b"], _SCHEMA)
+    assert [part["output"] for part in parts] == ["[SQL] a 1\n[SQL] a 2\n", "[SQL] b 1\n[SQL] b 2\n"]
+    assert capsys.readouterr().out == ""
+    print("after")
+    assert capsys.readouterr().out == "after\n"
+
+
+def test_combined_answer_falls_back_to_part_answers_without_more_gemini_calls(monkeypatch):
+    calls = []
+
+    def _fail(prompt, **kwargs):
+        calls.append(prompt)
+        raise RuntimeError("503 UNAVAILABLE")
+
+    monkeypatch.setattr(sql_retrieval.config, "generate_content", _fail)
+    parts = [
+        {"question": "crime in 2023", "sql": "SELECT COUNT(*) AS n FROM c", "result": {"columns": ["n"], "rows": [{"n": 10}]}, "answer": "Count: 10"},
+        {"question": "crime in 2024", "sql": "SELECT COUNT(*) AS n FROM c", "result": {"columns": ["n"], "rows": [{"n": 12}]}, "answer": "Count: 12"},
+    ]
+    answer = sql_retrieval._llm_generate_combined_answer("Compare crime in 2023 and 2024", parts)
+    assert len(calls) == 1
+    assert answer == "crime in 2023\nCount: 10\n\ncrime in 2024\nCount: 12"